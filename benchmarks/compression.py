@@ -0,0 +1,82 @@
+"""
+CPU cost versus bytes saved by log records compression at realistic sizes:
+log messages with tracebacks and extras of 1 to 50 KB.
+
+Doesn't require Redis. zstd is measured if 'zstandard' is installed.
+
+Usage: python benchmarks/compression.py [records per size]
+"""
+import json
+import logging
+import sys
+import time
+from uuid import uuid4
+
+from chouette_iot_client._chouette_log_handler import ChouetteLogHandler
+from chouette_iot_client._compression import Compressor, decode_record, zstandard
+from chouette_iot_client._encoding import LogEncoder
+
+SIZES = (1024, 5 * 1024, 20 * 1024, 50 * 1024)
+
+
+def recurse(depth: int) -> None:
+    """
+    Raises an exception with a traceback of a given depth.
+    """
+    if depth:
+        recurse(depth - 1)
+    raise ValueError(f"Could not process request {uuid4()}")
+
+
+def make_log_message(size: int) -> str:
+    """
+    Makes an encoded log message of about a given size with a traceback
+    and request-like extras.
+    """
+    handler = ChouetteLogHandler("benchmark")
+    try:
+        recurse(min(size // 400, 200))
+    except ValueError:
+        exc_info = sys.exc_info()
+    record = logging.LogRecord(
+        "benchmark", logging.ERROR, __file__, 1, "Request failed", None, exc_info
+    )
+    record.request_id = str(uuid4())
+    record.headers = {f"X-Header-{n}": str(uuid4()) for n in range(10)}
+    message = handler._format_message(record)
+    encoded = LogEncoder(field_limit=0, record_limit=0).encode(message)
+    if len(encoded) < size:
+        message["payload"] = [str(uuid4()) for _ in range((size - len(encoded)) // 40)]
+        encoded = LogEncoder(field_limit=0, record_limit=0).encode(message)
+    return encoded
+
+
+def measure(compressor: Compressor, values: list) -> tuple:
+    """
+    Returns microseconds per record and a share of bytes saved.
+    """
+    started = time.process_time()
+    compressed = [compressor.compress(value) for value in values]
+    elapsed = time.process_time() - started
+    assert decode_record(compressed[0]) == json.loads(values[0])
+    original = sum(len(value) for value in values)
+    stored = sum(len(value) for value in compressed)
+    return elapsed / len(values) * 1000000, 1 - stored / original
+
+
+def main() -> None:
+    records = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    codecs = [("zlib", 1), ("zlib", 6)]
+    if zstandard is not None:
+        codecs += [("zstd", 1), ("zstd", 3)]
+    print(f"{'size':>8} {'codec':>8} {'us/record':>10} {'saved':>7}")
+    for size in SIZES:
+        values = [make_log_message(size) for _ in range(records)]
+        for codec, level in codecs:
+            compressor = Compressor(codec, threshold=0, level=level)
+            cost, saved = measure(compressor, values)
+            print(f"{size:>8} {codec}-{level:<3} {cost:>10.1f} {saved:>7.1%}")
+
+
+if __name__ == "__main__":
+    main()
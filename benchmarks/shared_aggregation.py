@@ -0,0 +1,92 @@
+"""
+Multi-process 'count' metrics throughput: a record per call stored by
+every worker versus shared memory aggregation with a single flusher.
+
+Requires a running Redis, configured by REDIS_HOST and REDIS_PORT.
+
+Usage: python benchmarks/shared_aggregation.py [workers] [calls per worker]
+"""
+import multiprocessing
+import sys
+import time
+from uuid import uuid4
+
+from redis import Redis
+
+from chouette_iot_client import ChouetteClient
+from chouette_iot_client._shared_aggregation import SharedCounterTable
+
+METRICS_KEYS = f"{ChouetteClient.storage.metrics_queue}.keys"
+
+
+def direct_worker(calls: int) -> None:
+    """
+    Sends every call as a separate record and waits till all are stored.
+    """
+    futures = [
+        ChouetteClient.count("benchmark.direct", 1, tags={"worker": "any"})
+        for _ in range(calls)
+    ]
+    for future in futures:
+        future.result()
+
+
+def shared_worker(name: str, calls: int) -> None:
+    """
+    Sends calls through a shared table and publishes them once.
+    """
+    ChouetteClient.enable_shared_aggregation(name)
+    for _ in range(calls):
+        ChouetteClient.count("benchmark.shared", 1, tags={"worker": "any"})
+    ChouetteClient._flush_aggregators()
+
+
+def run(target, args, workers: int) -> float:
+    """
+    Runs workers processes and returns the wall time.
+    """
+    processes = [
+        multiprocessing.Process(target=target, args=args) for _ in range(workers)
+    ]
+    started = time.perf_counter()
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    return time.perf_counter() - started
+
+
+def main() -> None:
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    calls = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    redis = Redis(
+        host=ChouetteClient.storage.connection_pool.connection_kwargs["host"],
+        port=ChouetteClient.storage.connection_pool.connection_kwargs["port"],
+    )
+    total = workers * calls
+
+    before = redis.zcard(METRICS_KEYS)
+    elapsed = run(direct_worker, (calls,), workers)
+    written = redis.zcard(METRICS_KEYS) - before
+    print(
+        f"direct: {total / elapsed:,.0f} calls/s, {written} records written "
+        f"by {workers} connections"
+    )
+
+    name = uuid4().hex[:16]
+    table = SharedCounterTable(name)
+    before = redis.zcard(METRICS_KEYS)
+    elapsed = run(shared_worker, (name, calls), workers)
+    ChouetteClient.enable_shared_aggregation(name)
+    ChouetteClient._flush_aggregators()
+    time.sleep(0.5)
+    written = redis.zcard(METRICS_KEYS) - before
+    print(
+        f"shared: {total / elapsed:,.0f} calls/s, {written} records written "
+        f"by 1 connection"
+    )
+    table.unlink()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Contention of many producer threads: records put into a lane under its
+lock versus records put into per-thread buffers.
+
+Records are "stored" by a function that does nothing, so only the producers
+side is measured. Doesn't require Redis.
+
+Every number is the best of 3 runs. With the GIL both paths are limited
+by the GIL itself, the difference is expected on free-threaded builds.
+
+Usage: python benchmarks/thread_buffers.py [calls per run]
+"""
+import sys
+import threading
+import time
+
+from chouette_iot_client._lanes import Lane, LaneWriter, ThreadBuffers
+
+THREADS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+def store(records):
+    """
+    Pretends that records are stored.
+    """
+    return ["key"] * len(records)
+
+
+def run(threads: int, calls: int, buffered: bool) -> float:
+    """
+    Puts calls records from threads threads and returns calls per second.
+    """
+    lane = Lane("benchmark", store, capacity=10**7, batch_size=100, flush_interval=0.01)
+    if buffered:
+        lane.buffers = ThreadBuffers(0.01)
+    writer = LaneWriter([lane])
+    writer.start()
+    per_thread = calls // threads
+    start = threading.Barrier(threads + 1)
+
+    def produce() -> None:
+        start.wait()
+        for _ in range(per_thread):
+            lane.put({"metric": "benchmark"})
+
+    producers = [threading.Thread(target=produce) for _ in range(threads)]
+    for producer in producers:
+        producer.start()
+    start.wait()
+    started = time.perf_counter()
+    for producer in producers:
+        producer.join()
+    elapsed = time.perf_counter() - started
+    lane.drain(10)
+    writer.stop()
+    return per_thread * threads / elapsed
+
+
+def main() -> None:
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 256000
+    gil = getattr(sys, "_is_gil_enabled", lambda: True)()
+    print(f"Python {sys.version.split()[0]}, GIL {'enabled' if gil else 'disabled'}")
+    print(f"{'threads':>8} {'lane calls/s':>14} {'buffers calls/s':>16}")
+    for threads in THREADS:
+        locked = max(run(threads, calls, buffered=False) for _ in range(3))
+        buffered = max(run(threads, calls, buffered=True) for _ in range(3))
+        print(f"{threads:>8} {locked:>14,.0f} {buffered:>16,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Throughput of the client without network I/O: records are written to
+in-process MemoryStorage or NullStorage, so the numbers show the client's
+own overhead only.
+
+"storage" is batches of 100 metrics passed to a storage directly, "client"
+is ChouetteClient.count calls measured till all the metrics are stored.
+Every number is the best of 3 runs. Doesn't require Redis.
+
+Usage: python benchmarks/throughput.py [records per run]
+"""
+
+import sys
+import time
+
+from chouette_iot_client import ChouetteClient
+from chouette_iot_client._storages import MemoryStorage, NullStorage, Storage
+
+BATCH_SIZE = 100
+
+
+def run_storage(storage: Storage, records: int) -> float:
+    """
+    Stores records in batches directly and returns records per second.
+    """
+    batch = [
+        {"metric": "benchmark", "type": "count", "value": 1, "timestamp": 0, "tags": {}}
+    ] * BATCH_SIZE
+    started = time.perf_counter()
+    for _ in range(records // BATCH_SIZE):
+        storage.store_metrics(batch)
+    return records // BATCH_SIZE * BATCH_SIZE / (time.perf_counter() - started)
+
+
+def run_client(storage: Storage, records: int) -> float:
+    """
+    Sends records by ChouetteClient and returns records per second.
+    """
+    ChouetteClient.storage = storage
+    started = time.perf_counter()
+    for _ in range(records):
+        ChouetteClient.count("benchmark", 1, timestamp=0)
+    ChouetteClient.flush(timeout=60)
+    return records / (time.perf_counter() - started)
+
+
+def main() -> None:
+    records = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    print(f"{'storage':>8} {'storage records/s':>18} {'client records/s':>17}")
+    for name, storage_class in (("memory", MemoryStorage), ("null", NullStorage)):
+        direct = max(run_storage(storage_class(), records) for _ in range(3))
+        client = max(run_client(storage_class(), records // 10) for _ in range(3))
+        print(f"{name:>8} {direct:>18,.0f} {client:>17,.0f}")
+    ChouetteClient.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -5,9 +5,18 @@ from typing import Callable, Dict
 
 from ._chouette_client import ChouetteClient
 from ._chouette_log_handler import ChouetteLogHandler
+from ._compression import decode_record
+from ._tags import set_global_tags, tagged
 from ._timed import TimedContentManagerDecorator
 
-__all__ = ["ChouetteClient", "ChouetteLogHandler", "timed"]
+__all__ = [
+    "ChouetteClient",
+    "ChouetteLogHandler",
+    "decode_record",
+    "set_global_tags",
+    "tagged",
+    "timed",
+]
 
 
 def timed(metric: str, tags: Dict[str, str] = None, use_ms: bool = False) -> Callable:
@@ -0,0 +1,371 @@
+"""
+In-process aggregators that collect data between flushes and turn it into
+a small number of metric records.
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from math import ceil, log
+from typing import (
+    Any,
+    Deque,
+    Dict,
+    Hashable,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+
+__all__ = ["HistogramAggregator", "HyperLogLog", "MonotonicCounter", "SetAccumulator"]
+
+SeriesKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+_MASK64 = (1 << 64) - 1
+
+
+def _mix64(value: int) -> int:
+    """
+    SplitMix64 finalizer. Python hashes of small integers are the integers
+    themselves, so they have to be scrambled before being used by a sketch.
+
+    Args:
+        value: Integer to scramble.
+    Returns: Well distributed 64 bit integer.
+    """
+    value = (value + 0x9E3779B97F4A7C15) & _MASK64
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return value ^ (value >> 31)
+
+
+def series_key(metric: str, tags: Dict[str, str]) -> SeriesKey:
+    """
+    Creates a hashable key that identifies a metric series.
+
+    Args:
+        metric: Metric name.
+        tags: Metric tags as a dict.
+    Returns: Tuple of a metric name and sorted tags.
+    """
+    return metric, tuple(sorted(tags.items()))
+
+
+class HyperLogLog:
+    """
+    HyperLogLog cardinality sketch.
+
+    It uses 2^precision one byte registers, so with a default precision 12
+    it takes 4 KB regardless of the number of added members and has
+    a standard error about 1.6%.
+
+    Members are hashed by Python hash function, so estimations are
+    consistent only within a single process. That's fine here, because
+    a sketch never leaves the process - only its estimation does.
+    """
+
+    def __init__(self, precision: int = 12):
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(self.size)
+        self.shift = 64 - precision
+        self.max_rank = self.shift + 1
+        self.alpha = 0.7213 / (1 + 1.079 / self.size)
+
+    def add(self, member: Hashable) -> None:
+        """
+        Adds a member to the sketch.
+
+        Args:
+            member: Hashable object.
+        """
+        hashed = _mix64(hash(member) & _MASK64)
+        index = hashed >> self.shift
+        remainder = (hashed << self.precision) & _MASK64
+        rank = min(64 - remainder.bit_length() + 1, self.max_rank)
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def update(self, members: Iterable[Hashable]) -> None:
+        """
+        Adds multiple members to the sketch.
+
+        Args:
+            members: Iterable of hashable objects.
+        """
+        for member in members:
+            self.add(member)
+
+    def cardinality(self) -> int:
+        """
+        Estimates the number of unique members added to the sketch.
+
+        Returns: Estimated cardinality.
+        """
+        registers = self.registers
+        estimate = self.alpha * self.size**2 / sum(2.0**-rank for rank in registers)
+        if estimate <= 2.5 * self.size:
+            zeros = registers.count(0)
+            if zeros:
+                estimate = self.size * log(self.size / zeros)
+        return int(round(estimate))
+
+
+class SetAccumulator:
+    """
+    SetAccumulator unions 'set' metric members in-process during a flush
+    window, so instead of a record per call there is one record per series
+    per window.
+
+    While a series has up to sketch_threshold members they are stored as
+    an actual set and flushed as a normal 'set' metric.
+    Above this threshold members are moved into a HyperLogLog sketch and
+    the series is flushed as a 'gauge' with the estimated cardinality.
+    That's exactly what a 'set' metric becomes in Datadog anyway, but memory
+    and bytes written stay bounded regardless of the number of members.
+
+    Every series has a Future per window. All calls during a window get
+    the same Future that is resolved when the window is stored.
+    """
+
+    def __init__(self, sketch_threshold: int = 1000, precision: int = 12):
+        self.sketch_threshold = sketch_threshold
+        self.precision = precision
+        self.series: Dict[SeriesKey, List[Any]] = {}
+        self.lock = threading.Lock()
+
+    def add(
+        self, metric: str, members: Union[List, Set], tags: Dict[str, str]
+    ) -> Future:
+        """
+        Adds members to a series of a current window.
+
+        Unhashable members are replaced with their representations one
+        by one, so a single unhashable element doesn't affect others.
+
+        Args:
+            metric: Metric name.
+            members: Set or list of members.
+            tags: Metric tags as a dict.
+        Returns: Future that is resolved when this window is stored.
+        """
+        key = series_key(metric, tags)
+        with self.lock:
+            entry = self.series.get(key)
+            if entry is None:
+                entry = self.series[key] = [metric, tags, set(), Future()]
+            accumulated = entry[2]
+            try:
+                accumulated.update(members)
+            except TypeError:
+                for member in members:
+                    try:
+                        accumulated.add(member)
+                    except TypeError:
+                        accumulated.add(repr(member))
+            if (
+                isinstance(accumulated, set)
+                and len(accumulated) > self.sketch_threshold
+            ):
+                sketch = HyperLogLog(self.precision)
+                sketch.update(accumulated)
+                entry[2] = sketch
+            return entry[3]
+
+    def flush(self) -> List[Tuple[Dict[str, Any], Future]]:
+        """
+        Takes everything collected during a window and starts a new one.
+
+        Returns: List of tuples of metric records and their windows futures.
+        """
+        with self.lock:
+            series, self.series = self.series, {}
+        timestamp = time.time()
+        records = []
+        value: Union[int, List]
+        for metric, tags, accumulated, future in series.values():
+            if isinstance(accumulated, HyperLogLog):
+                metric_type, value = "gauge", accumulated.cardinality()
+            else:
+                metric_type, value = "set", list(accumulated)
+            record = {
+                "metric": metric,
+                "type": metric_type,
+                "value": value,
+                "timestamp": timestamp,
+                "tags": tags,
+            }
+            records.append((record, future))
+        return records
+
+
+class MonotonicCounter:
+    """
+    MonotonicCounter turns cumulative totals (e.g. bytes sent by an
+    interface) into 'count' deltas.
+
+    It remembers the last seen total of up to max_series series, the least
+    recently updated series are forgotten first. A forgotten or new series
+    needs one observation to get a baseline, so its first total is not sent.
+
+    If a total goes down, it's either a wraparound of a counter with
+    a known wrap_at limit (if it went down by more than a half of it) or
+    a counter reset, when the new total is the delta itself.
+
+    Deltas are summed per flush window, so every series is stored at most
+    once per window and series that didn't change are not stored at all.
+    """
+
+    def __init__(self, max_series: int = 10000):
+        self.max_series = max_series
+        self.totals: "OrderedDict[SeriesKey, float]" = OrderedDict()
+        self.window: Dict[SeriesKey, List[Any]] = {}
+        self.lock = threading.Lock()
+
+    def add(
+        self,
+        metric: str,
+        total: float,
+        tags: Dict[str, str],
+        wrap_at: Optional[float] = None,
+    ) -> Future:
+        """
+        Registers a new total of a series.
+
+        Args:
+            metric: Metric name.
+            total: Cumulative total value.
+            tags: Metric tags as a dict.
+            wrap_at: Value at which the counter wraps around to 0, if known.
+        Returns: Future that is resolved when this window is stored.
+        """
+        key = series_key(metric, tags)
+        with self.lock:
+            last = self.totals.pop(key, None)
+            self.totals[key] = total
+            if len(self.totals) > self.max_series:
+                self.totals.popitem(last=False)
+            entry = self.window.get(key)
+            if entry is None:
+                entry = self.window[key] = [metric, tags, 0, Future()]
+            if last is not None:
+                entry[2] += self.delta(last, total, wrap_at)
+            return entry[3]
+
+    @staticmethod
+    def delta(last: float, total: float, wrap_at: Optional[float]) -> float:
+        """
+        Calculates a difference between two totals.
+
+        Args:
+            last: Previous total.
+            total: New total.
+            wrap_at: Value at which the counter wraps around to 0, if known.
+        Returns: Delta.
+        """
+        if total >= last:
+            return total - last
+        if wrap_at and last - total > wrap_at / 2:
+            return wrap_at - last + total
+        return total
+
+    def flush(self) -> List[Tuple[Optional[Dict[str, Any]], Future]]:
+        """
+        Takes deltas collected during a window and starts a new one.
+
+        Returns: List of tuples of 'count' records or Nones for series that
+                 didn't change and their windows futures.
+        """
+        with self.lock:
+            window, self.window = self.window, {}
+        timestamp = time.time()
+        records: List[Tuple[Optional[Dict[str, Any]], Future]] = []
+        for metric, tags, delta, future in window.values():
+            record = None
+            if delta:
+                record = {
+                    "metric": metric,
+                    "type": "count",
+                    "value": delta,
+                    "timestamp": timestamp,
+                    "tags": tags,
+                }
+            records.append((record, future))
+        return records
+
+
+class HistogramAggregator:
+    """
+    HistogramAggregator summarizes histogram values in-process, so a series
+    is stored as a few records per flush window instead of a record per
+    value.
+
+    Values are appended to a bounded deque without taking any lock, so it
+    can be fed from places where taking a lock is unsafe, e.g. gc callbacks
+    that run in the middle of any code, including code that holds a lock.
+    If more than max_values values arrive during a window, the oldest ones
+    are dropped.
+
+    Every series is summarized the way Datadog summarizes histograms:
+    '<metric>.count' count metric and '<metric>.avg', '<metric>.max',
+    '<metric>.median' and '<metric>.95percentile' gauges.
+    """
+
+    def __init__(self, max_values: int = 100000):
+        self.values: Deque[Tuple[str, Dict[str, str], float]] = deque(maxlen=max_values)
+
+    def add(self, metric: str, value: float, tags: Dict[str, str]) -> None:
+        """
+        Adds a value to a series.
+
+        Args:
+            metric: Metric name.
+            value: Metric value.
+            tags: Metric tags as a dict.
+        """
+        self.values.append((metric, tags, value))
+
+    def flush(self) -> List[Dict[str, Any]]:
+        """
+        Takes values collected during a window and summarizes them.
+
+        Returns: List of summary records.
+        """
+        series: Dict[SeriesKey, Tuple[str, Dict[str, str], List[float]]] = {}
+        popleft = self.values.popleft
+        while True:
+            try:
+                metric, tags, value = popleft()
+            except IndexError:
+                break
+            key = series_key(metric, tags)
+            entry = series.get(key)
+            if entry is None:
+                entry = series[key] = (metric, tags, [])
+            entry[2].append(value)
+        timestamp = time.time()
+        records = []
+        for metric, tags, values in series.values():
+            values.sort()
+            count = len(values)
+            summary = (
+                ("count", "count", count),
+                ("avg", "gauge", sum(values) / count),
+                ("max", "gauge", values[-1]),
+                ("median", "gauge", values[ceil(count * 0.5) - 1]),
+                ("95percentile", "gauge", values[ceil(count * 0.95) - 1]),
+            )
+            for suffix, metric_type, value in summary:
+                records.append(
+                    {
+                        "metric": f"{metric}.{suffix}",
+                        "type": metric_type,
+                        "value": value,
+                        "timestamp": timestamp,
+                        "tags": tags,
+                    }
+                )
+        return records
@@ -0,0 +1,136 @@
+"""
+CardinalityGuard - limits the number of unique series per metric.
+"""
+import os
+import threading
+from typing import Any, Dict, List, Optional, Set
+
+__all__ = ["CardinalityGuard", "OVERFLOW_TAGS", "OVERFLOW_VALUE"]
+
+# Marks a folded series, folded tag values are replaced with OVERFLOW_VALUE.
+OVERFLOW_TAGS = {"chouette_overflow": "true"}
+OVERFLOW_VALUE = "chouette_overflow"
+
+
+class CardinalityGuard:
+    """
+    CardinalityGuard tracks unique tag sets of every metric. When a metric
+    already has 'limit' series, records of its new series are either folded
+    or dropped, depending on a mode.
+
+    Folding replaces only the values that make a series new with
+    'chouette_overflow' and adds a 'chouette_overflow:true' tag: values of
+    a tag that were never seen among the metric's known series or, if
+    a series is a new combination of known values, values of the tag with
+    the most distinct values. Other tags, e.g. global and context tags,
+    are kept, so overflows of different devices or services stay apart.
+
+    Overflows are counted per metric and periodically reported by
+    ChouetteClient as 'chouette.client.cardinality_overflow' count metric
+    tagged by the offending metric name.
+
+    Series and tag values are remembered as hashes, so memory is bounded
+    by 'limit' integers per metric and per its tag. Up to 'max_metrics'
+    metrics are tracked, the oldest tracked metric is forgotten when a new
+    one appears. A check of a known series is a single hash calculation
+    and a set lookup without any lock.
+    """
+
+    def __init__(self, limit: int, mode: str = "fold", max_metrics: int = 10000):
+        self.limit = limit
+        self.drop = mode == "drop"
+        self.max_metrics = max_metrics
+        self.series: Dict[str, Set[int]] = {}
+        self.values: Dict[str, Dict[str, Set[int]]] = {}
+        self.overflows: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> Optional["CardinalityGuard"]:
+        """
+        Creates a CardinalityGuard configured by environment variables:
+        CHOUETTE_CARDINALITY_LIMIT - maximal number of series per metric
+        (default 10000, 0 disables the guard).
+        CHOUETTE_CARDINALITY_MODE - 'fold' or 'drop' (default 'fold').
+        CHOUETTE_CARDINALITY_MAX_METRICS - maximal number of tracked
+        metrics (default 10000).
+
+        Returns: CardinalityGuard instance or None if it's disabled.
+        """
+        limit = int(os.environ.get("CHOUETTE_CARDINALITY_LIMIT", "10000"))
+        if limit <= 0:
+            return None
+        return cls(
+            limit,
+            os.environ.get("CHOUETTE_CARDINALITY_MODE", "fold").lower(),
+            int(os.environ.get("CHOUETTE_CARDINALITY_MAX_METRICS", "10000")),
+        )
+
+    def check(self, metric: str, tags: Dict[str, str]) -> Optional[Dict[str, str]]:
+        """
+        Checks a series of a record.
+
+        Args:
+            metric: Metric name.
+            tags: Record tags.
+        Returns: Tags to use: original ones, folded ones or None if
+                 a record should be dropped.
+        """
+        fingerprint = hash(frozenset(tags.items()))
+        seen = self.series.get(metric)
+        if seen is not None and fingerprint in seen:
+            return tags
+        with self.lock:
+            seen = self.series.get(metric)
+            if seen is None:
+                if len(self.series) >= self.max_metrics:
+                    oldest = next(iter(self.series))
+                    del self.series[oldest]
+                    del self.values[oldest]
+                seen = self.series[metric] = set()
+                self.values[metric] = {}
+            values = self.values[metric]
+            if len(seen) < self.limit:
+                seen.add(fingerprint)
+                for key, value in tags.items():
+                    values.setdefault(key, set()).add(hash(value))
+                return tags
+            self.overflows[metric] = self.overflows.get(metric, 0) + 1
+            if self.drop:
+                return None
+            return self._fold(tags, values)
+
+    @staticmethod
+    def _fold(tags: Dict[str, str], values: Dict[str, Set[int]]) -> Dict[str, str]:
+        """
+        Replaces values that make a series new with an overflow value.
+
+        Args:
+            tags: Record tags.
+            values: Hashes of known values by tag names.
+        Returns: Folded tags.
+        """
+        unknown = [
+            key for key, value in tags.items() if hash(value) not in values.get(key, ())
+        ]
+        if not unknown and tags:
+            unknown = [max(tags, key=lambda key: len(values.get(key, ())))]
+        folded = {
+            key: OVERFLOW_VALUE if key in unknown else value
+            for key, value in tags.items()
+        }
+        folded.update(OVERFLOW_TAGS)
+        return folded
+
+    def collect_report(self) -> List[Dict[str, Any]]:
+        """
+        Takes overflow counters and resets them.
+
+        Returns: List of dicts with 'metric' and 'overflows' keys.
+        """
+        with self.lock:
+            overflows, self.overflows = self.overflows, {}
+        return [
+            {"metric": metric, "overflows": count}
+            for metric, count in overflows.items()
+        ]
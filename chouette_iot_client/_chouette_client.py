@@ -1,48 +1,105 @@
 """
 ChouetteClient - the main object handling metrics sending.
 """
+import asyncio
+import atexit
 import logging
 import os
 import time
-from concurrent.futures import ThreadPoolExecutor, Future
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from threading import Lock, Thread
 from typing import Any, Dict, List, Optional, Set, Union
 
-from ._storages import RedisStorage, StoragesFactory
+from ._aggregators import HistogramAggregator, MonotonicCounter, SetAccumulator
+from ._cardinality import CardinalityGuard
+from ._lanes import Lane, LaneWriter
+from ._load_shedder import LoadShedder
+from ._profiler import SamplingProfiler
+from ._resources import ResourceCollector
+from ._runtime_monitors import GCMonitor, LoopLagMonitor
+from ._sampling import is_sampled
+from ._shared_aggregation import SharedCounterTable, SharedCountsAggregator
+from ._storages import Storage, StoragesFactory
+from ._tags import merge_tags
 
 logger = logging.getLogger("chouette-iot")
 
 __all__ = ["ChouetteClient"]
 
+# Already resolved future returned for records that were not stored at all.
+NOT_STORED: Future = Future()
+NOT_STORED.set_result(result=None)
+
+
+def _resolve_with(target: Future, source: Future) -> None:
+    """
+    Resolves a target future with a result of a finished source future.
+
+    Args:
+        target: Future to resolve.
+        source: Finished future.
+    """
+    target.set_result(source.result())
+
 
 class ChouetteClient:
     """
     ChouetteClient is an object that receives metrics requests and sends them
     to a storage.
 
-    To avoid blocking your code, it uses a ThreadPoolExecutor. Any send metric
-    request returns a future.
+    To avoid blocking your code, it puts records into lanes - bounded queues
+    that are written to a storage in batches by background writer threads.
+    Metrics and logs have separate lanes with their own capacity, batching
+    and flush interval, so a flood of log messages doesn't delay metrics.
+    A storage is chosen by CHOUETTE_STORAGE environment variable: 'redis'
+    (default), 'memory' or 'null'.
+    Any send metric request returns a future.
     In some cases it's necessary to send a metric in a blocking way, in this
     case you could just execute 'future.result()' and it will wait till the
     metric is actually sent. Sometimes it helps to avoid locks when a metric
     is sent while another Redis service (like Dramatiq) is starting.
 
-    It uses an executors dictionary to support multiprocessing. It was found
-    that child processes can't use a ThreadPoolExecutor that was created by
-    their parent if all the slots in an Executor are filled already.
-    While the parent process works fine and is ready to use any of these
-    threads, child processes see these threads as dead threads and can't
-    reuse them or create a new thread (because all the slots are taken).
+    It uses a lanes dictionary to support multiprocessing. It was found
+    that child processes can't use threads that were created by their
+    parent: child processes see these threads as dead threads.
     It was leading to a situation when a multiprocessing application was
     sending metrics for a half of an hour and then was just stopping.
 
-    With this dictionary ChouetteClient creates a separated executor
-    for every process. There is normally no real need for any cleanup, because
-    main process doesn't see executors created by its children and these
-    executors stop when there processes are stopped.
+    With this dictionary ChouetteClient creates separated lanes and writers
+    for every process. There is normally no real need for any cleanup,
+    because main process doesn't see lanes created by its children and their
+    writers stop when there processes are stopped.
     """
 
+    lanes: Dict[int, Dict[str, Lane]] = {}
+    lanes_lock: Lock = Lock()
     executors: Dict[int, ThreadPoolExecutor] = {}
-    storage: Optional[RedisStorage] = StoragesFactory.get_storage("redis")
+    shared_writer: bool = os.environ.get(
+        "CHOUETTE_LANES_SHARED_WRITER", "false"
+    ).lower() in ("1", "true", "yes")
+    storage: Optional[Storage] = StoragesFactory.get_storage(
+        os.environ.get("CHOUETTE_STORAGE", "redis")
+    )
+    shedder: LoadShedder = LoadShedder.from_env()
+    flush_interval: float = float(os.environ.get("CHOUETTE_FLUSH_INTERVAL", "10"))
+    flushers: Dict[int, Thread] = {}
+    flushers_lock: Lock = Lock()
+    resource_collectors: Dict[int, ResourceCollector] = {}
+    profilers: Dict[int, SamplingProfiler] = {}
+    aggregate_sets: bool = os.environ.get(
+        "CHOUETTE_AGGREGATE_SETS", "false"
+    ).lower() in ("1", "true", "yes")
+    set_accumulator: SetAccumulator = SetAccumulator(
+        sketch_threshold=int(os.environ.get("CHOUETTE_SETS_SKETCH_THRESHOLD", "1000"))
+    )
+    monotonic_counter: MonotonicCounter = MonotonicCounter(
+        max_series=int(os.environ.get("CHOUETTE_MONOTONIC_MAX_SERIES", "10000"))
+    )
+    histograms: HistogramAggregator = HistogramAggregator()
+    gc_monitor: Optional[GCMonitor] = None
+    cardinality_guard: Optional[CardinalityGuard] = CardinalityGuard.from_env()
+    shared_counts: Optional[SharedCountsAggregator] = SharedCountsAggregator.from_env()
 
     @classmethod
     def count(
@@ -51,19 +108,36 @@ class ChouetteClient:
         value: float,
         timestamp: float = None,
         tags: Dict[str, str] = None,
+        sample_rate: float = 1.0,
     ) -> Future:
         """
         Handles 'count' metrics.
 
+        If shared aggregation is enabled, counters are summed in shared
+        memory and stored by a single flusher process, so the returned
+        future contains None.
+
         Args:
             metric: Metric name.
             value: Metric value as a float.
             timestamp: Metric collection timestamp.
             tags: Metric tags as a dict.
+            sample_rate: Share of calls that are actually sent, from 0 to 1.
         Return: Future that normally contains this metric's key in a storage.
         """
+        if sample_rate < 1 and not is_sampled(sample_rate):
+            return NOT_STORED
+        if cls.shared_counts:
+            cls._ensure_flusher()
+            cls.shared_counts.add(metric, value / sample_rate, merge_tags(tags))
+            return NOT_STORED
         to_store = cls._prepare_metric(
-            metric=metric, type="count", value=value, timestamp=timestamp, tags=tags
+            metric=metric,
+            type="count",
+            value=value,
+            timestamp=timestamp,
+            tags=tags,
+            sample_rate=sample_rate,
         )
         return cls._store(to_store)
 
@@ -74,6 +148,7 @@ class ChouetteClient:
         value: float,
         timestamp: float = None,
         tags: Dict[str, str] = None,
+        sample_rate: float = 1.0,
     ) -> Future:
         """
         Another way to send a "count" metric in a DogstatsD style. Sends a
@@ -85,9 +160,10 @@ class ChouetteClient:
             value: Metric value as a float.
             timestamp: Metric collection timestamp.
             tags: Metric tags as a dict.
+            sample_rate: Share of calls that are actually sent, from 0 to 1.
         Return: Future that normally contains this metric's key in a storage.
         """
-        return cls.count(metric, value, timestamp, tags)
+        return cls.count(metric, value, timestamp, tags, sample_rate)
 
     @classmethod
     def decrement(
@@ -96,6 +172,7 @@ class ChouetteClient:
         value: float,
         timestamp: float = None,
         tags: Dict[str, str] = None,
+        sample_rate: float = 1.0,
     ) -> Future:
         """
         Another way to send a "count" metric in a DogstatsD style. Sends a
@@ -107,9 +184,37 @@ class ChouetteClient:
             value: Metric value as a float.
             timestamp: Metric collection timestamp.
             tags: Metric tags as a dict.
+            sample_rate: Share of calls that are actually sent, from 0 to 1.
         Return: Future that normally contains this metric's key in a storage.
         """
-        return cls.count(metric, -value, timestamp, tags)
+        return cls.count(metric, -value, timestamp, tags, sample_rate)
+
+    @classmethod
+    def monotonic_count(
+        cls,
+        metric: str,
+        total: float,
+        tags: Dict[str, str] = None,
+        wrap_at: float = None,
+    ) -> Future:
+        """
+        Handles cumulative totals, e.g. bytes sent by a network interface.
+
+        Instead of sending a total as a gauge on every poll, it sends
+        'count' deltas between totals, summed per flush interval. Series that
+        didn't change are not sent at all. The first total of a series is
+        just a baseline. Counter resets and wraparounds are handled.
+
+        Args:
+            metric: Metric name.
+            total: Cumulative total value.
+            tags: Metric tags as a dict.
+            wrap_at: Value at which the counter wraps around to 0, if known,
+                     e.g. 2 ** 32.
+        Return: Future that is resolved when a flush window is stored.
+        """
+        cls._ensure_flusher()
+        return cls.monotonic_counter.add(metric, total, merge_tags(tags), wrap_at)
 
     @classmethod
     def gauge(
@@ -118,6 +223,7 @@ class ChouetteClient:
         value: float,
         timestamp: float = None,
         tags: Dict[str, str] = None,
+        sample_rate: float = 1.0,
     ) -> Future:
         """
         Handles 'gauge' metrics.
@@ -127,10 +233,18 @@ class ChouetteClient:
             value: Metric value as a float.
             timestamp: Metric collection timestamp.
             tags: Metric tags as a dict.
+            sample_rate: Share of calls that are actually sent, from 0 to 1.
         Return: Future that normally contains this metric's key in a storage.
         """
+        if sample_rate < 1 and not is_sampled(sample_rate):
+            return NOT_STORED
         to_store = cls._prepare_metric(
-            metric=metric, type="gauge", value=value, timestamp=timestamp, tags=tags
+            metric=metric,
+            type="gauge",
+            value=value,
+            timestamp=timestamp,
+            tags=tags,
+            sample_rate=sample_rate,
         )
         return cls._store(to_store)
 
@@ -141,6 +255,7 @@ class ChouetteClient:
         value: float,
         timestamp: float = None,
         tags: Dict[str, str] = None,
+        sample_rate: float = 1.0,
     ) -> Future:
         """
         Handles 'rate' metrics.
@@ -150,10 +265,18 @@ class ChouetteClient:
             value: Metric value as a float.
             timestamp: Metric collection timestamp.
             tags: Metric tags as a dict.
+            sample_rate: Share of calls that are actually sent, from 0 to 1.
         Return: Future that normally contains this metric's key in a storage.
         """
+        if sample_rate < 1 and not is_sampled(sample_rate):
+            return NOT_STORED
         to_store = cls._prepare_metric(
-            metric=metric, type="rate", value=value, timestamp=timestamp, tags=tags
+            metric=metric,
+            type="rate",
+            value=value,
+            timestamp=timestamp,
+            tags=tags,
+            sample_rate=sample_rate,
         )
         return cls._store(to_store)
 
@@ -164,6 +287,7 @@ class ChouetteClient:
         value: Union[List, Set],
         timestamp: float = None,
         tags: Dict[str, str] = None,
+        sample_rate: float = 1.0,
     ) -> Future:
         """
         Handles 'set' metrics.
@@ -172,15 +296,33 @@ class ChouetteClient:
         Unhashable case is handled in _prepare_metric, but it's not the best
         solution.
 
+        If CHOUETTE_AGGREGATE_SETS is enabled, members are accumulated
+        in-process by a SetAccumulator and every series is stored once per
+        flush interval. In this case timestamp is ignored and the future
+        is resolved when a whole window is stored.
+
         Args:
             metric: Metric name.
             value: Metric value as a set or list.
             timestamp: Metric collection timestamp.
             tags: Metric tags as a dict.
+            sample_rate: Share of calls that are actually sent, from 0 to 1.
         Return: Future that normally contains this metric's key in a storage.
         """
+        if sample_rate < 1 and not is_sampled(sample_rate):
+            return NOT_STORED
+        if cls.aggregate_sets:
+            cls._ensure_flusher()
+            return cls.set_accumulator.add(metric, value, merge_tags(tags))
+        if not cls.shedder.keep("set"):
+            return NOT_STORED
         to_store = cls._prepare_metric(
-            metric=metric, type="set", value=value, timestamp=timestamp, tags=tags
+            metric=metric,
+            type="set",
+            value=value,
+            timestamp=timestamp,
+            tags=tags,
+            sample_rate=sample_rate,
         )
         return cls._store(to_store)
 
@@ -191,6 +333,7 @@ class ChouetteClient:
         value: float,
         timestamp: float = None,
         tags: Dict[str, str] = None,
+        sample_rate: float = 1.0,
     ) -> Future:
         """
         Handles 'histogram' metrics.
@@ -204,27 +347,445 @@ class ChouetteClient:
             value: Metric value as a float.
             timestamp: Metric collection timestamp.
             tags: Metric tags as a dict.
+            sample_rate: Share of calls that are actually sent, from 0 to 1.
         Return: Future that normally contains this metric's key in a storage.
         """
+        if sample_rate < 1 and not is_sampled(sample_rate):
+            return NOT_STORED
+        if not cls.shedder.keep("histogram"):
+            return NOT_STORED
         to_store = cls._prepare_metric(
-            metric=metric, type="histogram", value=value, timestamp=timestamp, tags=tags
+            metric=metric,
+            type="histogram",
+            value=value,
+            timestamp=timestamp,
+            tags=tags,
+            sample_rate=sample_rate,
         )
         return cls._store(to_store)
 
+    @classmethod
+    def enable_shared_aggregation(
+        cls, name: str = "default", slots: int = 4096
+    ) -> None:
+        """
+        Makes 'count' metrics of this process aggregated in a shared memory
+        table together with all the other processes that use the same name.
+        Only one of these processes, elected automatically, writes combined
+        counters to a storage. If it dies, another process takes over.
+
+        It's supposed to be called before worker processes are forked or
+        by every worker itself. It's the same as setting
+        CHOUETTE_SHARED_AGGREGATION environment variable to a table name.
+
+        Args:
+            name: Shared table name.
+            slots: Maximal number of series in a table.
+        """
+        cls.shared_counts = SharedCountsAggregator(SharedCounterTable(name, slots))
+
+    @classmethod
+    def start_resource_collector(
+        cls, interval: float = None, tags: Dict[str, str] = None
+    ) -> ResourceCollector:
+        """
+        Starts a thread that sends resources usage of this process every
+        interval seconds: CPU time and usage, resident memory, numbers of
+        open file descriptors and threads and garbage collector statistics.
+        All the metrics of a tick are put into the metrics lane at once.
+
+        Just like lanes, collectors work per process, so it should be
+        called by every process that should be monitored. A repeated call
+        returns an already started collector.
+
+        Args:
+            interval: Interval in seconds, by default CHOUETTE_RESOURCES_INTERVAL
+                      environment variable or 10.
+            tags: Metrics tags as a dict.
+        Returns: ResourceCollector instance.
+        """
+        pid = os.getpid()
+        with cls.flushers_lock:
+            collector = cls.resource_collectors.get(pid)
+            if collector:
+                return collector
+            if interval is None:
+                interval = float(os.environ.get("CHOUETTE_RESOURCES_INTERVAL", "10"))
+            collector = ResourceCollector(
+                interval=interval,
+                budget=float(os.environ.get("CHOUETTE_RESOURCES_BUDGET", "0.001")),
+            )
+            Thread(
+                target=cls._collect_resources_periodically,
+                args=(collector, tags),
+                name="chouette-iot-resources",
+                daemon=True,
+            ).start()
+            cls.resource_collectors[pid] = collector
+        return collector
+
+    @classmethod
+    def start_profiler(cls) -> SamplingProfiler:
+        """
+        Starts a sampling profiler thread in this process. It samples stacks
+        of all the threads CHOUETTE_PROFILER_HZ times per second (default 19)
+        and once per flush interval sends the top functions and stacks as
+        'runtime.python.profile.samples' count metrics tagged by 'function'
+        and 'runtime.python.profile.stacks' tagged by 'stack', the total
+        number of samples and its own overhead.
+
+        Like resource collectors, profilers work per process. A repeated
+        call returns an already started profiler.
+
+        Returns: SamplingProfiler instance.
+        """
+        pid = os.getpid()
+        with cls.flushers_lock:
+            profiler = cls.profilers.get(pid)
+            if profiler:
+                return profiler
+            profiler = SamplingProfiler.from_env()
+            Thread(
+                target=cls._profile_periodically,
+                args=(profiler,),
+                name="chouette-iot-profiler",
+                daemon=True,
+            ).start()
+            cls.profilers[pid] = profiler
+        return profiler
+
+    @classmethod
+    def monitor_gc(cls) -> GCMonitor:
+        """
+        Starts timing garbage collections. Their durations are summarized
+        in-process and sent once per flush interval as
+        'runtime.python.gc.pause.<avg|max|median|95percentile|count>'
+        metrics tagged by a generation.
+
+        Returns: GCMonitor instance.
+        """
+        with cls.flushers_lock:
+            if not cls.gc_monitor:
+                cls.gc_monitor = GCMonitor(cls.histograms)
+            cls.gc_monitor.start()
+        cls._ensure_flusher()
+        return cls.gc_monitor
+
+    @classmethod
+    def monitor_event_loop(
+        cls,
+        loop: asyncio.AbstractEventLoop = None,
+        interval: float = 1.0,
+        name: str = "default",
+    ) -> LoopLagMonitor:
+        """
+        Starts measuring lag of an asyncio event loop with a heartbeat every
+        interval seconds. Lags are summarized in-process and sent once per
+        flush interval as
+        'runtime.python.event_loop.lag.<avg|max|median|95percentile|count>'
+        metrics tagged by a loop name.
+
+        Args:
+            loop: Event loop, the current one by default.
+            interval: Heartbeat interval in seconds.
+            name: Loop name for a 'loop' tag.
+        Returns: LoopLagMonitor instance, it can be stopped by its 'stop'.
+        """
+        monitor = LoopLagMonitor(
+            cls.histograms, loop or asyncio.get_event_loop(), interval, name
+        )
+        monitor.start()
+        cls._ensure_flusher()
+        return monitor
+
     @classmethod
     def get_executor(cls) -> ThreadPoolExecutor:
         """
         Gets ThreadPoolExecutor from a dict or creates a new one for this
         process.
 
+        Records are written by lanes now, so ChouetteClient doesn't use
+        this executor itself. It's kept for code that submits its own jobs
+        to it.
+
         Returns: ThreadPoolExecutor.
         """
         pid = os.getpid()
         if pid not in cls.executors:
-            logger.debug("Creating new metrics ThreadPoolExecutor for pid %s.", pid)
+            logger.debug("Creating new ThreadPoolExecutor for pid %s.", pid)
             cls.executors[pid] = ThreadPoolExecutor(thread_name_prefix="chouette-iot")
         return cls.executors[pid]
 
+    @classmethod
+    def get_lanes(cls) -> Dict[str, Lane]:
+        """
+        Gets lanes from a dict or creates new ones for this process.
+
+        Returns: Dict of lanes by their names: 'metrics' and 'logs'.
+        """
+        pid = os.getpid()
+        lanes = cls.lanes.get(pid)
+        if lanes is None:
+            with cls.lanes_lock:
+                if pid not in cls.lanes:
+                    logger.debug("Creating new lanes for pid %s.", pid)
+                    cls.lanes[pid] = cls._create_lanes()
+                lanes = cls.lanes[pid]
+        return lanes
+
+    @classmethod
+    def _create_lanes(cls) -> Dict[str, Lane]:
+        """
+        Creates metrics and logs lanes and starts their writers.
+
+        By default every lane has its own writer. If
+        CHOUETTE_LANES_SHARED_WRITER is enabled, a single writer serves
+        both lanes with a weighted round robin.
+
+        Returns: Dict of lanes by their names.
+        """
+        lanes = {
+            "metrics": Lane.from_env(
+                "metrics", cls._store_metrics, flush_interval=0.01, weight=4
+            ),
+            "logs": Lane.from_env(
+                "logs", cls._store_logs, flush_interval=0.05, weight=1
+            ),
+        }
+        for lane in lanes.values():
+            lane.on_written = cls.shedder.completed
+            cls.shedder.watch(lane.queue)
+        if cls.shared_writer:
+            LaneWriter(list(lanes.values())).start()
+        else:
+            for lane in lanes.values():
+                LaneWriter([lane]).start()
+        if cls.storage and cls.storage.reports:
+            cls._ensure_flusher()
+        return lanes
+
+    @classmethod
+    def flush(cls, timeout: float = 5.0) -> int:
+        """
+        Writes everything this process has collected so far: aggregated
+        metrics and all the records waiting in lanes. Every lane writes all
+        its waiting records in a single batch.
+
+        Args:
+            timeout: Maximal time to wait in seconds.
+        Returns: Number of records that were not written before the timeout.
+        """
+        deadline = time.monotonic() + timeout
+        cls._flush_aggregators()
+        lanes = cls.lanes.get(os.getpid(), {})
+        return sum(
+            lane.drain(max(deadline - time.monotonic(), 0)) for lane in lanes.values()
+        )
+
+    @classmethod
+    def close(cls, timeout: float = None) -> int:
+        """
+        Flushes everything and stops this process lanes writers.
+        If something is sent after that, new lanes are created.
+
+        It's registered with atexit, so metrics sent right before a process
+        exits are not lost. At exit it waits for at most CHOUETTE_EXIT_TIMEOUT
+        seconds (default 2).
+
+        Args:
+            timeout: Maximal time to wait in seconds.
+        Returns: Number of records that were not written before the timeout.
+        """
+        if timeout is None:
+            timeout = float(os.environ.get("CHOUETTE_EXIT_TIMEOUT", "2"))
+        unwritten = cls.flush(timeout)
+        with cls.lanes_lock:
+            lanes = cls.lanes.pop(os.getpid(), {})
+        for lane in lanes.values():
+            cls.shedder.unwatch(lane.queue)
+            if lane.writer:
+                lane.writer.stop()
+        if unwritten:
+            logger.warning("%s records were not stored before closing.", unwritten)
+        return unwritten
+
+    @classmethod
+    def lanes_stats(cls) -> Dict[str, Dict[str, float]]:
+        """
+        Collects statistics of this process lanes: numbers of submitted,
+        stored, failed, dropped and pending records, number of written
+        batches and the latest batch latency. With adaptive batching it also
+        contains a tuning state: measured round trip time and arrival rate,
+        current batch size and flush interval, expected and target latency.
+
+        Returns: Dict of lanes statistics by lanes names.
+        """
+        return {name: lane.get_stats() for name, lane in cls.get_lanes().items()}
+
+    @classmethod
+    def _store_metrics(cls, metrics: List[Dict[str, Any]]) -> List[Optional[str]]:
+        """
+        Stores a batch of metrics. Used by the metrics lane.
+
+        Args:
+            metrics: List of metrics.
+        Returns: List of keys in a storage or Nones.
+        """
+        if not cls.storage:
+            return [None] * len(metrics)
+        return cls.storage.store_metrics(metrics)
+
+    @classmethod
+    def _store_logs(cls, log_messages: List[Dict[str, Any]]) -> List[Optional[str]]:
+        """
+        Stores a batch of log messages. Used by the logs lane.
+
+        Args:
+            log_messages: List of log messages.
+        Returns: List of keys in a storage or Nones.
+        """
+        if not cls.storage:
+            return [None] * len(log_messages)
+        return cls.storage.store_logs(log_messages)
+
+    @classmethod
+    def _ensure_flusher(cls) -> None:
+        """
+        Makes sure that this process has a thread that periodically flushes
+        in-process aggregators. Just like lanes, flushers are created
+        per process, because threads don't survive forking.
+        """
+        pid = os.getpid()
+        if pid in cls.flushers:
+            return
+        with cls.flushers_lock:
+            if pid not in cls.flushers:
+                logger.debug("Creating new aggregators flusher for pid %s.", pid)
+                flusher = Thread(
+                    target=cls._flush_periodically,
+                    name="chouette-iot-flusher",
+                    daemon=True,
+                )
+                flusher.start()
+                cls.flushers[pid] = flusher
+
+    @classmethod
+    def _flush_periodically(cls) -> None:
+        """
+        Flusher thread loop. Flushes aggregators every flush_interval.
+        """
+        while True:
+            time.sleep(cls.flush_interval)
+            try:
+                cls._flush_aggregators()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Could not flush aggregated metrics.")
+
+    @classmethod
+    def _collect_resources_periodically(
+        cls, collector: ResourceCollector, tags: Optional[Dict[str, str]]
+    ) -> None:
+        """
+        Resource collector thread loop.
+
+        Args:
+            collector: ResourceCollector instance.
+            tags: Metrics tags as a dict.
+        """
+        while True:
+            try:
+                readings = collector.collect()
+                timestamp = time.time()
+                cls._store_many(
+                    [
+                        cls._prepare_metric(
+                            metric=metric,
+                            type=metric_type,
+                            value=value,
+                            timestamp=timestamp,
+                            tags=tags,
+                        )
+                        for metric, metric_type, value in readings
+                    ]
+                )
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Could not collect resources usage.")
+            time.sleep(collector.interval)
+
+    @classmethod
+    def _profile_periodically(cls, profiler: SamplingProfiler) -> None:
+        """
+        Profiler thread loop. Samples are taken on a fixed schedule and
+        a report is stored every flush_interval.
+
+        Args:
+            profiler: SamplingProfiler instance.
+        """
+        next_sample = time.monotonic()
+        next_report = next_sample + cls.flush_interval
+        while True:
+            next_sample += profiler.period
+            time.sleep(max(next_sample - time.monotonic(), 0))
+            try:
+                profiler.sample()
+                if time.monotonic() < next_report:
+                    continue
+                next_report += cls.flush_interval
+                timestamp = time.time()
+                cls._store_many(
+                    [
+                        cls._prepare_metric(
+                            metric=metric,
+                            type=metric_type,
+                            value=value,
+                            timestamp=timestamp,
+                            tags=tags,
+                        )
+                        for metric, metric_type, value, tags in profiler.report()
+                    ]
+                )
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Could not profile this process.")
+
+    @classmethod
+    def _flush_aggregators(cls) -> None:
+        """
+        Stores everything that in-process aggregators collected so far and
+        resolves their windows futures with storing results.
+        """
+        for record, window_future in cls.set_accumulator.flush():
+            stored = cls._store(record)
+            stored.add_done_callback(partial(_resolve_with, window_future))
+        for delta, window_future in cls.monotonic_counter.flush():
+            if delta is None:
+                window_future.set_result(None)
+                continue
+            stored = cls._store(delta)
+            stored.add_done_callback(partial(_resolve_with, window_future))
+        if cls.shared_counts:
+            for record in cls.shared_counts.flush():
+                cls._store(record)
+        for record in cls.histograms.flush():
+            record["tags"] = merge_tags(record["tags"])
+            cls._store(record)
+        if cls.cardinality_guard:
+            for report in cls.cardinality_guard.collect_report():
+                cls._store(
+                    cls._prepare_metric(
+                        metric="chouette.client.cardinality_overflow",
+                        type="count",
+                        value=report["overflows"],
+                        tags={"metric": report["metric"]},
+                    )
+                )
+        if cls.storage:
+            for metric, metric_type, value, tags in cls.storage.collect_report():
+                cls._store(
+                    cls._prepare_metric(
+                        metric=metric, type=metric_type, value=value, tags=tags
+                    )
+                )
+
     @classmethod
     def _store(cls, metric: Dict[str, Any]) -> Future:
         """
@@ -236,24 +797,87 @@ class ChouetteClient:
         1. For some reason Storage object wasn't returned.
         2. Storage wasn't able to store data because its broker is down.
 
+        If a metric has too many series, its new series are folded into
+        an overflow series or dropped by the CardinalityGuard.
+
         Args:
             metric: Dictionary that contains a metric prepared for storing.
         Returns: Future.
         """
         if not cls.storage:
-            empty_future: Future = Future()
-            empty_future.set_result(result=None)
-            return empty_future
-        executor = cls.get_executor()
-        future = executor.submit(cls.storage.store_metric, metric)
+            return NOT_STORED
+        if cls.cardinality_guard:
+            tags = cls.cardinality_guard.check(metric["metric"], metric["tags"])
+            if tags is not metric["tags"]:
+                cls._ensure_flusher()
+                if tags is None:
+                    return NOT_STORED
+                metric["tags"] = tags
+        future = cls.get_lanes()["metrics"].put(metric)
+        if cls.shedder.report_due():
+            cls._report_shedding()
         return future
 
+    @classmethod
+    def _store_many(cls, metrics: List[Dict[str, Any]]) -> List[Future]:
+        """
+        Stores metrics at once, so they are written in a single batch.
+        Metrics are checked by the CardinalityGuard one by one, just like
+        in _store.
+
+        Args:
+            metrics: List of dictionaries with metrics prepared for storing.
+        Returns: List of futures of metrics that were not dropped.
+        """
+        if not cls.storage:
+            return []
+        if cls.cardinality_guard:
+            kept = []
+            overflowed = False
+            for metric in metrics:
+                tags = cls.cardinality_guard.check(metric["metric"], metric["tags"])
+                if tags is not metric["tags"]:
+                    overflowed = True
+                    if tags is None:
+                        continue
+                    metric["tags"] = tags
+                kept.append(metric)
+            if overflowed:
+                cls._ensure_flusher()
+            metrics = kept
+        return cls.get_lanes()["metrics"].put_many(metrics)
+
+    @classmethod
+    def _report_shedding(cls) -> None:
+        """
+        Sends shed records counters collected by the LoadShedder.
+        Reports are normal-priority metrics and they are never shed.
+        """
+        for report in cls.shedder.collect_report():
+            tags = {"type": report["kind"]}
+            for metric in (
+                cls._prepare_metric(
+                    metric="chouette.client.shed_records",
+                    type="count",
+                    value=report["shed"],
+                    tags=tags,
+                ),
+                cls._prepare_metric(
+                    metric="chouette.client.effective_sample_rate",
+                    type="gauge",
+                    value=report["rate"],
+                    tags=tags,
+                ),
+            ):
+                cls._store(metric)
+
     @staticmethod
     def _prepare_metric(**kwargs: Any) -> Dict[str, Any]:
         """
         Takes a metric data and created a dict representing this metric.
 
-        If there are no tags specified, it makes it an empty dict.
+        Specified tags are merged with global and context tags. If there are
+        no tags at all, it makes it an empty dict.
         If there is no timestamp specified, it takes actual time.
 
         For a 'set' metric it has 2 workarounds:
@@ -266,6 +890,10 @@ class ChouetteClient:
         Chouette sends a data as a JSON string and sets are not JSON
         compatible.
 
+        Sampled 'count' and 'rate' values are divided by their sample rate,
+        so an aggregated value stays correct after sampling. Other types are
+        not scaled: a sampled gauge, set or histogram is just sent less often.
+
         Args:
             kwargs: Kwargs where we pass all the metric data.
         Returns: Dictionary that represents a metric.
@@ -283,9 +911,10 @@ class ChouetteClient:
         timestamp = kwargs.get("timestamp")
         if not timestamp:
             timestamp = time.time()
-        tags = kwargs.get("tags")
-        if not tags:
-            tags = {}
+        tags = merge_tags(kwargs.get("tags"))
+        sample_rate = kwargs.get("sample_rate", 1.0)
+        if sample_rate < 1 and kwargs.get("type") in ("count", "rate"):
+            value = value / sample_rate
         metric = {
             "metric": kwargs.get("metric"),
             "type": kwargs.get("type"),
@@ -294,3 +923,6 @@ class ChouetteClient:
             "tags": tags,
         }
         return metric
+
+
+atexit.register(ChouetteClient.close)
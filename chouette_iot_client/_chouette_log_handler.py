@@ -3,11 +3,11 @@ ChouetteLogHandler - sends log lines to Chouette to be transferred to Datadog.
 """
 import os
 from datetime import datetime, timezone
-from logging import getLevelName, Formatter, Handler, LogRecord
-from typing import Any, Dict, Optional, Tuple
+from logging import INFO, getLevelName, Formatter, Handler, LogRecord
+from typing import Any, Dict, Tuple
 
-from ._storages import StoragesFactory, RedisStorage
 from ._chouette_client import ChouetteClient
+from ._tags import get_ddtags
 
 
 class ChouetteLogHandler(Handler):
@@ -72,7 +72,6 @@ class ChouetteLogHandler(Handler):
         self.log_level: int = getLevelName(
             os.environ.get("CHOUETTE_LOG_LEVEL", "NOTSET")
         )
-        self.storage: Optional[RedisStorage] = StoragesFactory.get_storage("redis")
         self.service_name = service_name
 
     def emit(self, record: LogRecord) -> None:
@@ -83,17 +82,37 @@ class ChouetteLogHandler(Handler):
         If that's true, message is being formatted and stored to a storage.
         Otherwise nothing happens.
 
-        To store data in a non-blocking manner, it gets an executor from
-        ChouetteClient.
+        To store data in a non-blocking manner, it puts it into ChouetteClient
+        logs lane, that is written independently of metrics. If ChouetteClient
+        falls behind, DEBUG and INFO messages can be shed by its LoadShedder.
 
         Args:
             record: LogRecord instance.
         Returns: None
         """
-        if self.storage and record.levelno >= self.log_level:
-            log_message = self._format_message(record)
-            executor = ChouetteClient.get_executor()
-            executor.submit(self.storage.store_log, log_message)
+        if not ChouetteClient.storage or record.levelno < self.log_level:
+            return
+        if record.levelno <= INFO and not ChouetteClient.shedder.keep("log"):
+            return
+        log_message = self._format_message(record)
+        ChouetteClient.get_lanes()["logs"].put(log_message)
+
+    def flush(self) -> None:
+        """
+        Waits till all the log messages waiting in ChouetteClient logs lane
+        are stored, but not longer than CHOUETTE_EXIT_TIMEOUT seconds.
+        It's called by logging.shutdown at exit.
+        """
+        lanes = ChouetteClient.lanes.get(os.getpid())
+        if lanes:
+            lanes["logs"].drain(float(os.environ.get("CHOUETTE_EXIT_TIMEOUT", "2")))
+
+    def close(self) -> None:
+        """
+        Flushes waiting log messages and closes the handler.
+        """
+        self.flush()
+        super().close()
 
     def _format_message(self, record: LogRecord) -> Dict[str, Any]:
         """
@@ -106,10 +125,8 @@ class ChouetteLogHandler(Handler):
             record: LogRecord instance.
         Returns: Dict representing a suitable message for Datadog.
         """
-        # Tags:
-        ddtags = record.__dict__.get("tags", [])
-        if isinstance(ddtags, dict):
-            ddtags = [f"{key}:{value}" for key, value in ddtags.items()]
+        # Tags, including global and context ones:
+        ddtags = get_ddtags(record.__dict__.get("tags"))
 
         # Base message structure:
         log_message = {
@@ -0,0 +1,10 @@
+"""
+Compatibility helpers for older Python versions.
+"""
+import time
+
+__all__ = ["thread_time"]
+
+# time.thread_time is available since Python 3.7. Process CPU time is close
+# enough for code that holds the GIL while its own CPU time is measured.
+thread_time = getattr(time, "thread_time", time.process_time)
@@ -0,0 +1,126 @@
+"""
+Optional compression of large records stored to Redis.
+"""
+import json
+import logging
+import os
+import threading
+import zlib
+from typing import Any, Callable, Dict, Optional, Union
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None  # type: ignore
+
+logger = logging.getLogger("chouette-iot")
+
+__all__ = ["Compressor", "decode_record"]
+
+# Compressed values start with a codec marker. Plain values are JSON objects
+# that always start with '{', so they are never mistaken for compressed ones.
+ZLIB_MARKER = b"zlib:"
+ZSTD_MARKER = b"zstd:"
+
+
+class Compressor:
+    """
+    Compressor compresses records that are longer than a threshold with
+    zlib or zstd and prefixes them with a codec marker, so a consumer can
+    tell compressed and plain records apart. Records that don't get
+    smaller are left as they are.
+
+    zstd requires the 'zstandard' package: pip install chouette-iot-client[zstd]
+    zstd compressors are not thread safe and a storage is shared by lanes
+    writers, so every thread gets its own compressor.
+    """
+
+    def __init__(self, codec: str = "zlib", threshold: int = 1024, level: int = None):
+        self.threshold = threshold
+        self.compress_bytes: Callable[[bytes], bytes]
+        if codec == "zstd":
+            if zstandard is None:
+                raise RuntimeError("zstd compression requires 'zstandard' package.")
+            self.zstd_level = 3 if level is None else level
+            self.zstd_compressors = threading.local()
+            self.marker = ZSTD_MARKER
+            self.compress_bytes = self._zstd_compress
+        elif codec == "zlib":
+            zlib_level = 1 if level is None else level
+            self.marker = ZLIB_MARKER
+            self.compress_bytes = lambda data: zlib.compress(data, zlib_level)
+        else:
+            raise ValueError(f"Unknown compression codec: {codec}.")
+
+    @classmethod
+    def from_env(cls) -> Optional["Compressor"]:
+        """
+        Creates a Compressor if CHOUETTE_COMPRESSION is 'zlib' or 'zstd'.
+        Records shorter than CHOUETTE_COMPRESSION_THRESHOLD bytes
+        (default 1024) are not compressed. CHOUETTE_COMPRESSION_LEVEL
+        overrides a codec compression level (default 1 for zlib and 3 for
+        zstd). If zstd is not available, zlib is used.
+
+        Returns: Compressor instance or None if compression is disabled.
+        """
+        codec = os.environ.get("CHOUETTE_COMPRESSION", "none").lower()
+        if codec not in ("zlib", "zstd"):
+            return None
+        if codec == "zstd" and zstandard is None:
+            logger.warning("zstandard package is not installed, using zlib.")
+            codec = "zlib"
+        level = os.environ.get("CHOUETTE_COMPRESSION_LEVEL")
+        return cls(
+            codec=codec,
+            threshold=int(os.environ.get("CHOUETTE_COMPRESSION_THRESHOLD", "1024")),
+            level=int(level) if level else None,
+        )
+
+    def _zstd_compress(self, data: bytes) -> bytes:
+        """
+        Compresses data by a zstd compressor of the calling thread.
+
+        Args:
+            data: Bytes to compress.
+        Returns: Compressed bytes.
+        """
+        compressor = getattr(self.zstd_compressors, "compressor", None)
+        if compressor is None:
+            compressor = zstandard.ZstdCompressor(level=self.zstd_level)
+            self.zstd_compressors.compressor = compressor
+        return compressor.compress(data)
+
+    def compress(self, value: str) -> Union[str, bytes]:
+        """
+        Compresses a value if it's long enough and compressible.
+
+        Args:
+            value: Encoded record.
+        Returns: Marked compressed bytes or the original value.
+        """
+        if len(value) < self.threshold:
+            return value
+        data = value.encode()
+        compressed = self.compress_bytes(data)
+        if len(compressed) + len(self.marker) >= len(data):
+            return value
+        return self.marker + compressed
+
+
+def decode_record(value: Union[str, bytes]) -> Dict[str, Any]:
+    """
+    Decodes a record read from a Chouette-IoT queue values hash, whether it
+    was compressed or not.
+
+    Args:
+        value: Hash value as it was read from Redis.
+    Returns: Record as a dict.
+    """
+    if isinstance(value, bytes):
+        if value.startswith(ZLIB_MARKER):
+            value = zlib.decompress(value[len(ZLIB_MARKER) :])
+        elif value.startswith(ZSTD_MARKER):
+            if zstandard is None:
+                raise RuntimeError("zstd records require 'zstandard' package.")
+            value = zstandard.ZstdDecompressor().decompress(value[len(ZSTD_MARKER) :])
+    return json.loads(value)
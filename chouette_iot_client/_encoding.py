@@ -0,0 +1,227 @@
+"""
+LogEncoder - safe JSON encoding of log messages with size limits.
+"""
+import json
+import os
+import reprlib
+import sys
+from collections.abc import Mapping, Sequence, Set
+from datetime import date, time
+from typing import Any, Callable, Dict, Iterable, List, Tuple, Type
+
+__all__ = ["LogEncoder", "TRUNCATED"]
+
+TRUNCATED = "...[truncated]"
+MAX_DEPTH = 32
+
+
+# Bounds a value to a budget at a nesting depth.
+Converter = Callable[[Any, int, int], Tuple[Any, int]]
+
+
+class LogEncoder:
+    """
+    LogEncoder casts log messages into JSON strings. It never fails on
+    values that are not JSON serializable and it limits sizes of every
+    top level field and of a whole message in bytes.
+
+    Unknown types are converted by a converter that is chosen once per type
+    and cached: mappings become dicts, sequences and sets become lists,
+    dates become ISO strings, bytes are decoded and everything else is
+    represented by its repr.
+
+    Limits are enforced while values are walked before encoding: long
+    strings are cut, containers of any type are iterated only till a budget
+    is spent, only a budget sized prefix of bytes is decoded and reprs are
+    capped by reprlib, so a huge extra is never copied as a whole and costs
+    about its budget. A custom object's own __repr__ can still be as slow
+    as it is written. Cut values end with
+    a '...[truncated]' marker. Fields that don't fit into a message limit
+    at all are dropped and counted in a 'chouette_dropped_fields' field.
+    """
+
+    def __init__(self, field_limit: int = 16384, record_limit: int = 65536):
+        self.field_limit = field_limit or sys.maxsize
+        self.record_limit = record_limit or sys.maxsize
+        self.converters: Dict[Type, Converter] = {}
+        self.repr = reprlib.Repr()
+        self.repr.maxother = min(self.field_limit, self.record_limit)
+        self.repr.maxstring = self.repr.maxother
+
+    @classmethod
+    def from_env(cls) -> "LogEncoder":
+        """
+        Creates a LogEncoder configured by environment variables:
+        CHOUETTE_LOG_FIELD_LIMIT - maximal size of a field in bytes
+        (default 16384) and CHOUETTE_LOG_RECORD_LIMIT - maximal size of
+        a message in bytes (default 65536). 0 means no limit.
+
+        Returns: LogEncoder instance.
+        """
+        return cls(
+            field_limit=int(os.environ.get("CHOUETTE_LOG_FIELD_LIMIT", "16384")),
+            record_limit=int(os.environ.get("CHOUETTE_LOG_RECORD_LIMIT", "65536")),
+        )
+
+    def encode(self, log_message: Dict[str, Any]) -> str:
+        """
+        Encodes a log message field by field in its order, so base fields
+        that go first are never dropped.
+
+        Args:
+            log_message: Log message as a dict.
+        Returns: JSON string.
+        """
+        parts = []
+        used = 2
+        dropped = 0
+        for key, value in log_message.items():
+            name = json.dumps(key if type(key) is str else str(key))
+            budget = min(self.field_limit, self.record_limit - used - len(name) - 4)
+            if budget < len(TRUNCATED) + 2:
+                dropped += 1
+                continue
+            encoded = self._encode_field(value, budget)
+            parts.append(f"{name}: {encoded}")
+            used += len(name) + len(encoded) + 4
+        if dropped:
+            parts.append(f'"chouette_dropped_fields": {dropped}')
+        return "{" + ", ".join(parts) + "}"
+
+    def _encode_field(self, value: Any, budget: int) -> str:
+        """
+        Encodes a single value within a budget. Escaped characters can make
+        an encoded value up to 6 times longer than it was estimated, so
+        a value that turns out to be too long is walked again with a smaller
+        budget and replaced with a marker if it's still too long or it
+        can't be encoded at all.
+
+        Args:
+            value: Any value.
+            budget: Maximal size in bytes.
+        Returns: JSON string.
+        """
+        for divider in (1, 6):
+            bounded, _ = self._bound(value, budget // divider, 0)
+            try:
+                encoded = json.dumps(bounded, default=repr)
+            except ValueError:  # E.g. an integer that is too long to print.
+                break
+            if len(encoded) <= budget:
+                return encoded
+        return json.dumps(TRUNCATED)
+
+    def _bound(self, value: Any, budget: int, depth: int) -> Tuple[Any, int]:
+        """
+        Makes a JSON serializable copy of a value cut to a budget.
+
+        Args:
+            value: Any value.
+            budget: Maximal estimated size in characters.
+            depth: Nesting depth.
+        Returns: Tuple of a cut value and its estimated size.
+        """
+        kind = type(value)
+        if kind is str:
+            if len(value) + 2 > budget:
+                cut = max(budget - len(TRUNCATED) - 2, 0)
+                return value[:cut] + TRUNCATED, cut + len(TRUNCATED) + 2
+            return value, len(value) + 2
+        if kind is int or kind is float or kind is bool or value is None:
+            return value, 8
+        if depth >= MAX_DEPTH:
+            return TRUNCATED, len(TRUNCATED) + 2
+        if kind is dict:
+            return self._bound_dict(value, budget, depth)
+        if kind is list or kind is tuple:
+            return self._bound_list(value, budget, depth)
+        converter = self.converters.get(kind)
+        if converter is None:
+            converter = self.converters[kind] = self._get_converter(kind)
+        return converter(value, budget, depth)
+
+    def _bound_dict(
+        self, value: Mapping, budget: int, depth: int
+    ) -> Tuple[Dict[str, Any], int]:
+        """
+        Makes a cut dict copy of a mapping. If the budget is spent, the rest
+        of items is replaced by a single marker item.
+        """
+        result: Dict[str, Any] = {}
+        size = 2
+        for key, item in value.items():
+            key = key if type(key) is str else str(key)
+            if size + len(key) + len(TRUNCATED) + 8 > budget:
+                result[TRUNCATED] = TRUNCATED
+                size += len(TRUNCATED) * 2 + 8
+                break
+            item, item_size = self._bound(item, budget - size - len(key) - 4, depth + 1)
+            result[key] = item
+            size += len(key) + item_size + 6
+        return result, size
+
+    def _bound_list(
+        self, value: Iterable, budget: int, depth: int
+    ) -> Tuple[List[Any], int]:
+        """
+        Makes a cut list copy of a sequence or a set. If the budget is spent,
+        the rest of elements is replaced by a single marker element.
+        """
+        result: List[Any] = []
+        size = 2
+        for item in value:
+            if size + len(TRUNCATED) + 4 > budget:
+                result.append(TRUNCATED)
+                size += len(TRUNCATED) + 4
+                break
+            item, item_size = self._bound(item, budget - size, depth + 1)
+            result.append(item)
+            size += item_size + 2
+        return result, size
+
+    def _bound_bytes(self, value: bytes, budget: int, depth: int) -> Tuple[str, int]:
+        """
+        Decodes a budget sized prefix of bytes, a character takes at least
+        a byte, so it's enough to fill the budget.
+        """
+        text = bytes(value[:budget]).decode("utf-8", "replace")
+        if len(value) <= budget:
+            return self._bound(text, budget, depth)
+        cut = max(min(len(text), budget - len(TRUNCATED) - 2), 0)
+        return text[:cut] + TRUNCATED, cut + len(TRUNCATED) + 2
+
+    def _get_converter(self, kind: Type) -> Converter:
+        """
+        Chooses a conversion of values of a type to JSON serializable values
+        cut to a budget.
+
+        Args:
+            kind: Value type.
+        Returns: Converter function.
+        """
+        if issubclass(kind, bool):
+            return lambda value, budget, depth: (bool(value), 8)
+        if issubclass(kind, str):
+            # Slicing returns a plain str prefix without copying the rest.
+            return lambda value, budget, depth: self._bound(
+                str.__getitem__(value, slice(budget + 1)), budget, depth
+            )
+        if issubclass(kind, int):
+            return lambda value, budget, depth: (int(value), 8)
+        if issubclass(kind, float):
+            return lambda value, budget, depth: (float(value), 8)
+        if issubclass(kind, Mapping):
+            return self._bound_dict
+        if issubclass(kind, (Sequence, Set)) and not issubclass(
+            kind, (bytes, bytearray)
+        ):
+            return self._bound_list
+        if issubclass(kind, (date, time)):
+            return lambda value, budget, depth: self._bound(
+                value.isoformat(), budget, depth
+            )
+        if issubclass(kind, (bytes, bytearray)):
+            return self._bound_bytes
+        return lambda value, budget, depth: self._bound(
+            self.repr.repr(value), budget, depth
+        )
@@ -0,0 +1,582 @@
+"""
+Lanes - independent bounded queues of records with their own writers.
+"""
+import logging
+import math
+import os
+import time
+from collections import deque
+from concurrent.futures import Future
+from threading import Condition, Lock, Thread, enumerate as threads, get_ident
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("chouette-iot")
+
+__all__ = ["BatchTuner", "Lane", "LaneWriter", "ThreadBuffers"]
+
+Item = Tuple[Dict[str, Any], Future]
+
+
+class BatchTuner:
+    """
+    BatchTuner adapts a lane batch size and flush interval to a measured
+    storage round trip time and records arrival rate.
+
+    End-to-end latency of a record is roughly the time it waits in a lane
+    plus a round trip, so a lane may wait for latency_target minus
+    a round trip time to gather as many records per round trip as possible.
+    A writer writes a batch per wait and round trip, so batch size is set
+    to the number of records that are expected to arrive during both of
+    them: a batch is written as soon as it's gathered and the writer keeps
+    up with the arrival rate. If a round trip alone is above the latency
+    target, a lane doesn't wait at all, but its batches still grow with
+    the arrival rate. If less than 2 records are expected during a wait,
+    waiting can't make a batch and only adds latency, so an idle lane
+    writes records almost immediately.
+
+    Round trip time and arrival rate are exponentially weighted moving
+    averages that are updated after every written batch. Results are
+    always kept within configured bounds.
+    """
+
+    def __init__(
+        self,
+        latency_target: float,
+        min_batch_size: int,
+        max_batch_size: int,
+        min_flush_interval: float,
+        max_flush_interval: float,
+        smoothing: float = 0.2,
+    ):
+        self.latency_target = latency_target
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.min_flush_interval = min_flush_interval
+        self.max_flush_interval = max_flush_interval
+        self.smoothing = smoothing
+        self.rtt = 0.0
+        self.arrival_rate = 0.0
+        self.measured_at = time.monotonic()
+        self.measured_submitted = 0.0
+
+    @classmethod
+    def from_env(cls, name: str) -> Optional["BatchTuner"]:
+        """
+        Creates a BatchTuner if CHOUETTE_ADAPTIVE_BATCHING is enabled.
+        It's configured by environment variables
+        CHOUETTE_<NAME>_LATENCY_TARGET (in seconds, default 0.1),
+        CHOUETTE_<NAME>_MIN_BATCH_SIZE (default 1),
+        CHOUETTE_<NAME>_MAX_BATCH_SIZE (default 1000),
+        CHOUETTE_<NAME>_MIN_FLUSH_INTERVAL (default 0.001) and
+        CHOUETTE_<NAME>_MAX_FLUSH_INTERVAL (default 1).
+
+        Args:
+            name: Lane name, e.g. 'metrics'.
+        Returns: BatchTuner instance or None if it's disabled.
+        """
+        enabled = os.environ.get("CHOUETTE_ADAPTIVE_BATCHING", "false")
+        if enabled.lower() not in ("1", "true", "yes"):
+            return None
+        prefix = f"CHOUETTE_{name.upper()}"
+        return cls(
+            latency_target=float(os.environ.get(f"{prefix}_LATENCY_TARGET", "0.1")),
+            min_batch_size=int(os.environ.get(f"{prefix}_MIN_BATCH_SIZE", "1")),
+            max_batch_size=int(os.environ.get(f"{prefix}_MAX_BATCH_SIZE", "1000")),
+            min_flush_interval=float(
+                os.environ.get(f"{prefix}_MIN_FLUSH_INTERVAL", "0.001")
+            ),
+            max_flush_interval=float(
+                os.environ.get(f"{prefix}_MAX_FLUSH_INTERVAL", "1")
+            ),
+        )
+
+    def tune(self, lane: "Lane", rtt: float) -> None:
+        """
+        Updates measurements and sets a new batch size and flush interval
+        of a lane. Called by a lane after every written batch.
+
+        Args:
+            lane: Tuned lane.
+            rtt: Round trip time of the latest batch in seconds.
+        """
+        now = time.monotonic()
+        elapsed = now - self.measured_at
+        submitted = lane.stats["submitted"]
+        if elapsed > 0:
+            rate = (submitted - self.measured_submitted) / elapsed
+            self.arrival_rate += self.smoothing * (rate - self.arrival_rate)
+        self.measured_at = now
+        self.measured_submitted = submitted
+        if self.rtt:
+            self.rtt += self.smoothing * (rtt - self.rtt)
+        else:
+            self.rtt = rtt
+        wait = min(self.latency_target - self.rtt, self.max_flush_interval)
+        if self.arrival_rate * wait < 2:
+            wait = self.min_flush_interval
+        lane.flush_interval = max(wait, self.min_flush_interval)
+        expected = math.ceil(self.arrival_rate * (lane.flush_interval + self.rtt))
+        lane.batch_size = min(max(expected, self.min_batch_size), self.max_batch_size)
+
+    def get_state(self, lane: "Lane") -> Dict[str, float]:
+        """
+        Args:
+            lane: Tuned lane.
+        Returns: Current tuning state: measured round trip time and arrival
+                 rate, chosen batch size and flush interval, expected and
+                 target latency.
+        """
+        return {
+            "rtt": self.rtt,
+            "arrival_rate": self.arrival_rate,
+            "batch_size": lane.batch_size,
+            "flush_interval": lane.flush_interval,
+            "expected_latency": lane.flush_interval + self.rtt,
+            "latency_target": self.latency_target,
+        }
+
+
+class ThreadBuffers:
+    """
+    ThreadBuffers let many producer threads put records into a lane without
+    contending on a shared lock.
+
+    Every thread appends records to its own deque that is found in
+    a registry by a thread id. The registry is copied on write, so it's
+    never changed while it's read, and a new registry is taken only when
+    a new thread puts its first record. An append to a deque that only one
+    thread appends to doesn't contend with other producers, even on
+    free-threaded builds where deques have their own per-object locks.
+
+    A lane writer collects all the buffers every 'interval' seconds and
+    puts their records into its lane at once. Buffers of dead threads are
+    retired periodically and collected one more time before they are
+    forgotten, so a record put right before a thread exits is not lost.
+    """
+
+    retire_every = 100
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.registry: Dict[int, Deque[Item]] = {}
+        self.retired: List[Deque[Item]] = []
+        self.lock = Lock()
+        self.collects = 0
+
+    @classmethod
+    def from_env(cls) -> Optional["ThreadBuffers"]:
+        """
+        Creates ThreadBuffers if CHOUETTE_THREAD_BUFFERS is enabled.
+        Collection interval is configured by CHOUETTE_THREAD_BUFFERS_INTERVAL
+        (in seconds, default 0.01).
+
+        Returns: ThreadBuffers instance or None if they are disabled.
+        """
+        enabled = os.environ.get("CHOUETTE_THREAD_BUFFERS", "false")
+        if enabled.lower() not in ("1", "true", "yes"):
+            return None
+        return cls(float(os.environ.get("CHOUETTE_THREAD_BUFFERS_INTERVAL", "0.01")))
+
+    def put(self, record: Dict[str, Any]) -> Future:
+        """
+        Puts a record into the current thread buffer.
+
+        Args:
+            record: Record to store.
+        Returns: Future that contains a record key in a storage or None.
+        """
+        buffer = self.registry.get(get_ident())
+        if buffer is None:
+            buffer = self._register()
+        future: Future = Future()
+        buffer.append((record, future))
+        return future
+
+    def _register(self) -> Deque[Item]:
+        """
+        Creates a buffer of the current thread.
+
+        Returns: New buffer.
+        """
+        buffer: Deque[Item] = deque()
+        with self.lock:
+            self.registry = {**self.registry, get_ident(): buffer}
+        return buffer
+
+    def collect(self) -> List[Item]:
+        """
+        Takes records from all the buffers. It must never be called by two
+        threads at once, normally it's called under a lane condition.
+
+        Returns: List of records and their futures.
+        """
+        items: List[Item] = []
+        for buffer in self.retired + list(self.registry.values()):
+            popleft = buffer.popleft
+            items.extend(popleft() for _ in range(len(buffer)))
+        self.collects += 1
+        if not self.collects % self.retire_every:
+            self._retire()
+        return items
+
+    def _retire(self) -> None:
+        """
+        Removes buffers of dead threads from the registry.
+        """
+        alive = {thread.ident for thread in threads()}
+        with self.lock:
+            registry = self.registry
+            self.retired = [
+                buffer for ident, buffer in registry.items() if ident not in alive
+            ]
+            if self.retired:
+                self.registry = {
+                    ident: buffer
+                    for ident, buffer in registry.items()
+                    if ident in alive
+                }
+
+
+class Lane:
+    """
+    Lane is a bounded queue of records of a single kind (e.g. metrics or
+    logs) with its own batching settings and statistics.
+
+    Records are written in batches of up to batch_size records. A partial
+    batch is written when its oldest record has been waiting for
+    flush_interval seconds, so an idle lane adds almost no latency while
+    a busy lane writes big batches.
+
+    If a lane has 'capacity' records waiting already, new records are
+    dropped and their futures contain None. So a flood of one kind of
+    records can neither consume all the memory, nor delay records of
+    other lanes.
+
+    If a lane has a BatchTuner, its batch size and flush interval are
+    adapted to measured storage latency and records arrival rate.
+
+    If a lane has ThreadBuffers, records are put into per-thread buffers
+    that are periodically collected by the lane writer, so producers never
+    take the lane lock. A collected record waits for up to the buffers
+    interval in addition to the lane flush interval.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        store: Callable[[List[Dict[str, Any]]], List[Optional[str]]],
+        capacity: int,
+        batch_size: int,
+        flush_interval: float,
+        weight: int = 1,
+    ):
+        self.name = name
+        self.store = store
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.weight = weight
+        self.queue: Deque[Item] = deque()
+        self.due = 0.0
+        self.writing = 0
+        self.flushing = 0
+        self.condition = Condition()
+        self.writer: Optional["LaneWriter"] = None
+        self.on_written: Optional[Callable[[float], None]] = None
+        self.tuner: Optional[BatchTuner] = None
+        self.buffers: Optional[ThreadBuffers] = None
+        self.stats: Dict[str, float] = {
+            "submitted": 0,
+            "stored": 0,
+            "failed": 0,
+            "dropped": 0,
+            "batches": 0,
+            "last_batch_latency": 0.0,
+        }
+
+    @classmethod
+    def from_env(
+        cls,
+        name: str,
+        store: Callable[[List[Dict[str, Any]]], List[Optional[str]]],
+        flush_interval: float,
+        weight: int,
+    ) -> "Lane":
+        """
+        Creates a Lane configured by environment variables
+        CHOUETTE_<NAME>_CAPACITY (default 100000),
+        CHOUETTE_<NAME>_BATCH_SIZE (default 100),
+        CHOUETTE_<NAME>_FLUSH_INTERVAL (in seconds) and
+        CHOUETTE_<NAME>_WEIGHT. If CHOUETTE_ADAPTIVE_BATCHING is enabled,
+        batch size and flush interval are initial values for a BatchTuner.
+        If CHOUETTE_THREAD_BUFFERS is enabled, the lane has ThreadBuffers.
+
+        Args:
+            name: Lane name, e.g. 'metrics'.
+            store: Function that stores a batch of records.
+            flush_interval: Default flush interval.
+            weight: Default weight.
+        Returns: Lane instance.
+        """
+        prefix = f"CHOUETTE_{name.upper()}"
+        lane = cls(
+            name=name,
+            store=store,
+            capacity=int(os.environ.get(f"{prefix}_CAPACITY", "100000")),
+            batch_size=int(os.environ.get(f"{prefix}_BATCH_SIZE", "100")),
+            flush_interval=float(
+                os.environ.get(f"{prefix}_FLUSH_INTERVAL", str(flush_interval))
+            ),
+            weight=int(os.environ.get(f"{prefix}_WEIGHT", str(weight))),
+        )
+        lane.tuner = BatchTuner.from_env(name)
+        lane.buffers = ThreadBuffers.from_env()
+        return lane
+
+    def put(self, record: Dict[str, Any]) -> Future:
+        """
+        Puts a record into the lane.
+
+        Args:
+            record: Record to store.
+        Returns: Future that contains a record key in a storage or None.
+        """
+        if self.buffers:
+            return self.buffers.put(record)
+        future: Future = Future()
+        with self.condition:
+            self.stats["submitted"] += 1
+            queue = self.queue
+            if len(queue) >= self.capacity:
+                self.stats["dropped"] += 1
+                future.set_result(None)
+                return future
+            if not queue:
+                self.due = time.monotonic() + self.flush_interval
+                queue.append((record, future))
+                self.condition.notify_all()
+                return future
+            queue.append((record, future))
+            if len(queue) == self.batch_size:
+                self.condition.notify_all()
+        return future
+
+    def put_many(self, records: List[Dict[str, Any]]) -> List[Future]:
+        """
+        Puts records into the lane at once, so they are normally written
+        in the same batch.
+
+        Args:
+            records: Records to store.
+        Returns: List of futures that contain records keys in a storage or Nones.
+        """
+        if self.buffers:
+            return [self.buffers.put(record) for record in records]
+        items: List[Item] = [(record, Future()) for record in records]
+        with self.condition:
+            self._extend(items)
+            self.condition.notify_all()
+        return [future for _, future in items]
+
+    def collect(self) -> None:
+        """
+        Moves records from thread buffers into the lane. Must be called
+        under the lane condition.
+        """
+        if not self.buffers:
+            return
+        items = self.buffers.collect()
+        if items:
+            self._extend(items)
+
+    def _extend(self, items: List[Item]) -> None:
+        """
+        Appends records to the lane. Records above the lane capacity are
+        dropped. Must be called under the lane condition.
+
+        Args:
+            items: List of records and their futures.
+        """
+        self.stats["submitted"] += len(items)
+        free = max(self.capacity - len(self.queue), 0)
+        for _, future in items[free:]:
+            self.stats["dropped"] += 1
+            future.set_result(None)
+        if not self.queue:
+            self.due = time.monotonic() + self.flush_interval
+        self.queue.extend(items[:free])
+
+    def ready(self, now: float) -> bool:
+        """
+        Checks whether a batch should be written. Must be called under
+        the lane condition.
+
+        Args:
+            now: Monotonic time.
+        Returns: True if the lane has a full batch or a due partial batch
+                 or if it's being flushed.
+        """
+        return len(self.queue) >= self.batch_size or (
+            bool(self.queue) and (now >= self.due or bool(self.flushing))
+        )
+
+    def take(self) -> List[Item]:
+        """
+        Takes up to batch_size * weight records from the lane. Must be
+        called under the lane condition.
+
+        While the lane is being flushed, it takes all the records at once,
+        so they are written in a single round trip.
+
+        Returns: List of records and their futures.
+        """
+        queue = self.queue
+        if self.flushing:
+            count = len(queue)
+        else:
+            count = min(len(queue), self.batch_size * self.weight)
+        batch = [queue.popleft() for _ in range(count)]
+        self.writing += count
+        if queue:
+            self.due = time.monotonic() + self.flush_interval
+        return batch
+
+    def write(self, batch: List[Item]) -> None:
+        """
+        Stores a batch and resolves its futures.
+
+        Args:
+            batch: List of records and their futures.
+        """
+        started = time.monotonic()
+        try:
+            keys = self.store([record for record, _ in batch])
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Could not store a batch to %s lane.", self.name)
+            keys = [None] * len(batch)
+        latency = time.monotonic() - started
+        stored = sum(1 for key in keys if key)
+        self.stats["batches"] += 1
+        self.stats["stored"] += stored
+        self.stats["failed"] += len(batch) - stored
+        self.stats["last_batch_latency"] = latency
+        if self.on_written:
+            self.on_written(latency)
+        if self.tuner:
+            self.tuner.tune(self, latency)
+        for (_, future), key in zip(batch, keys):
+            future.set_result(key)
+
+    def drain(self, timeout: float) -> int:
+        """
+        Makes the lane writer write all the waiting records immediately
+        and waits till they are written or till the timeout expires.
+
+        Args:
+            timeout: Maximal waiting time in seconds.
+        Returns: Number of records that were not written in time.
+        """
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            self.collect()
+            self.flushing += 1
+            self.condition.notify_all()
+            try:
+                while self.queue or self.writing:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or not self.writer:
+                        break
+                    self.condition.wait(remaining)
+                return len(self.queue) + self.writing
+            finally:
+                self.flushing -= 1
+
+    def get_stats(self) -> Dict[str, float]:
+        """
+        Returns: Lane statistics including a number of pending records and
+                 a tuning state if a lane has a BatchTuner.
+        """
+        stats = dict(self.stats)
+        stats["pending"] = len(self.queue)
+        if self.tuner:
+            stats.update(self.tuner.get_state(self))
+        return stats
+
+
+class LaneWriter(Thread):
+    """
+    LaneWriter is a daemon thread that writes batches of one or more lanes.
+
+    By default every lane has its own writer, so lanes never wait for
+    each other. If a single writer serves multiple lanes, they share
+    its condition and it writes up to batch_size * weight records of every
+    lane per round - a weighted round robin, so a flooded lane gets only
+    its share of a writer's time.
+
+    Thread buffers of its lanes are collected every time it wakes up, and
+    it wakes up at least every buffers interval.
+    """
+
+    def __init__(self, lanes: List[Lane]):
+        super().__init__(name=f"chouette-iot-{'-'.join(lane.name for lane in lanes)}")
+        self.daemon = True
+        self.lanes = lanes
+        self.stopped = False
+        self.condition = Condition()
+        for lane in lanes:
+            lane.condition = self.condition
+            lane.writer = self
+
+    def run(self) -> None:
+        """
+        Waits for ready batches and writes them.
+        After the writer is stopped, it writes everything that is left and
+        exits.
+        """
+        while True:
+            with self.condition:
+                batches = self._wait_for_batches()
+            if not batches:
+                return
+            for lane, batch in batches:
+                lane.write(batch)
+            with self.condition:
+                for lane, batch in batches:
+                    lane.writing -= len(batch)
+                self.condition.notify_all()
+
+    def stop(self) -> None:
+        """
+        Stops the writer after it writes all the waiting records.
+        """
+        with self.condition:
+            self.stopped = True
+            for lane in self.lanes:
+                lane.flushing += 1
+            self.condition.notify_all()
+
+    def _wait_for_batches(self) -> List[Tuple[Lane, List[Item]]]:
+        """
+        Waits until at least one lane is ready and takes batches from all
+        the ready lanes. Must be called under the writer condition.
+
+        Returns: List of lanes and their batches. Empty if the writer is
+                 stopped and there is nothing to write.
+        """
+        while True:
+            now = time.monotonic()
+            timeout: Optional[float] = None
+            batches = []
+            for lane in self.lanes:
+                if lane.buffers:
+                    lane.collect()
+                    poll = lane.buffers.interval
+                    timeout = poll if timeout is None else min(timeout, poll)
+                if lane.ready(now):
+                    batches.append((lane, lane.take()))
+                elif lane.queue:
+                    wait = lane.due - now
+                    timeout = wait if timeout is None else min(timeout, wait)
+            if batches or self.stopped:
+                return batches
+            self.condition.wait(timeout)
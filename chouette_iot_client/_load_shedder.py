@@ -0,0 +1,201 @@
+"""
+LoadShedder - watches ChouetteClient backlog and sheds low priority records.
+"""
+import os
+import threading
+import time
+from typing import Any, Dict, List, Sized
+
+from ._sampling import is_sampled
+
+__all__ = ["LoadShedder"]
+
+
+class LoadShedder:
+    """
+    LoadShedder tracks how many records are waiting in ChouetteClient lanes
+    and how long it takes to store a batch of them.
+
+    While the backlog is below its low watermark, everything is kept.
+    Between low and high watermarks the effective sample rate of low
+    priority records (histograms, sets, DEBUG and INFO logs) goes down
+    linearly from 1 to min_rate. Above the high watermark only min_rate
+    of them is kept.
+    Storing latency is an independent trigger: if storing a batch takes
+    longer than latency_watermark, the rate is reduced proportionally to
+    the excess, even if there is no backlog yet, and both reductions are
+    combined when both watermarks are crossed.
+
+    As soon as the backlog clears, the rate returns to 1 by itself, because
+    it's always calculated from the actual backlog state.
+
+    Shed records are counted per type and periodically reported by
+    ChouetteClient as 'chouette.client.shed_records' count metric together
+    with 'chouette.client.effective_sample_rate' gauge, so sampled data can
+    still be interpreted.
+    """
+
+    def __init__(
+        self,
+        low_watermark: int,
+        high_watermark: int,
+        latency_watermark: float,
+        min_rate: float,
+        report_interval: float,
+    ):
+        self.low_watermark = low_watermark
+        self.high_watermark = max(high_watermark, low_watermark + 1)
+        self.latency_watermark = latency_watermark
+        self.min_rate = min_rate
+        self.report_interval = report_interval
+        self.queues: List[Sized] = []
+        self.latency = 0.0
+        self.shed: Dict[str, int] = {}
+        self.rates: Dict[str, float] = {}
+        self.next_report = time.monotonic() + report_interval
+        self.lock = threading.Lock()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self.reset)
+
+    @classmethod
+    def from_env(cls) -> "LoadShedder":
+        """
+        Creates a LoadShedder configured by environment variables:
+        CHOUETTE_SHEDDING_LOW_WATERMARK - pending records count when
+        shedding starts (default 1000).
+        CHOUETTE_SHEDDING_HIGH_WATERMARK - pending records count when
+        shedding reaches its maximum (default 10000).
+        CHOUETTE_SHEDDING_LATENCY - store latency in seconds above which
+        records are shed (default 0.5).
+        CHOUETTE_SHEDDING_MIN_RATE - minimal effective sample rate
+        (default 0.01).
+        CHOUETTE_SHEDDING_REPORT_INTERVAL - how often shed records counters
+        are reported, in seconds (default 10).
+
+        Returns: LoadShedder instance.
+        """
+        return cls(
+            low_watermark=int(
+                os.environ.get("CHOUETTE_SHEDDING_LOW_WATERMARK", "1000")
+            ),
+            high_watermark=int(
+                os.environ.get("CHOUETTE_SHEDDING_HIGH_WATERMARK", "10000")
+            ),
+            latency_watermark=float(os.environ.get("CHOUETTE_SHEDDING_LATENCY", "0.5")),
+            min_rate=float(os.environ.get("CHOUETTE_SHEDDING_MIN_RATE", "0.01")),
+            report_interval=float(
+                os.environ.get("CHOUETTE_SHEDDING_REPORT_INTERVAL", "10")
+            ),
+        )
+
+    def reset(self) -> None:
+        """
+        Forgets the backlog state. It's used in child processes, because
+        they create their own lanes and parent's lanes are never written
+        there.
+        """
+        self.lock = threading.Lock()
+        self.queues = []
+        self.latency = 0.0
+        self.shed = {}
+        self.rates = {}
+
+    def effective_rate(self) -> float:
+        """
+        Calculates a share of low priority records that should be kept
+        at the moment.
+
+        Returns: Rate between min_rate and 1.
+        """
+        rate = 1.0
+        pending = self.pending
+        if pending > self.low_watermark:
+            overflow = (pending - self.low_watermark) / (
+                self.high_watermark - self.low_watermark
+            )
+            rate -= min(overflow, 1.0) * (1.0 - self.min_rate)
+        if self.slow:
+            rate *= self.latency_watermark / self.latency
+        return max(rate, self.min_rate)
+
+    @property
+    def slow(self) -> bool:
+        """
+        Returns: Whether storing latency is above the latency watermark.
+        """
+        return self.latency > self.latency_watermark > 0
+
+    def keep(self, kind: str) -> bool:
+        """
+        Decides whether a low priority record should be kept.
+
+        Args:
+            kind: Record kind, e.g. 'histogram' or 'log'. Used for reporting.
+        Returns: True if a record should be stored.
+        """
+        if self.pending <= self.low_watermark and not self.slow:
+            return True
+        rate = self.effective_rate()
+        if is_sampled(rate):
+            return True
+        with self.lock:
+            self.shed[kind] = self.shed.get(kind, 0) + 1
+            self.rates[kind] = rate
+        return False
+
+    def watch(self, queue: Sized) -> None:
+        """
+        Adds a queue whose length is a part of the backlog.
+
+        Args:
+            queue: Any sized queue, e.g. a Lane queue.
+        """
+        self.queues.append(queue)
+
+    def unwatch(self, queue: Sized) -> None:
+        """
+        Removes a queue from the backlog.
+
+        Args:
+            queue: Previously watched queue.
+        """
+        self.queues = [watched for watched in self.queues if watched is not queue]
+
+    @property
+    def pending(self) -> int:
+        """
+        Returns: Number of records waiting in all the watched queues.
+        """
+        return sum(len(queue) for queue in self.queues)
+
+    def completed(self, latency: float) -> None:
+        """
+        Updates an exponentially weighted storing latency.
+
+        Args:
+            latency: How long it took to store a batch, in seconds.
+        """
+        self.latency += (latency - self.latency) * 0.1
+
+    def report_due(self) -> bool:
+        """
+        Checks whether it's time to report shed records.
+
+        Returns: True if collected counters should be reported.
+        """
+        return time.monotonic() >= self.next_report
+
+    def collect_report(self) -> List[Dict[str, Any]]:
+        """
+        Takes shed records counters and resets them.
+
+        Returns: List of dicts with 'kind', 'shed' and 'rate' keys.
+        """
+        with self.lock:
+            self.next_report = time.monotonic() + self.report_interval
+            shed, self.shed = self.shed, {}
+            rates, self.rates = self.rates, {}
+        return [
+            {"kind": kind, "shed": count, "rate": rates[kind]}
+            for kind, count in shed.items()
+        ]
@@ -0,0 +1,186 @@
+"""
+SamplingProfiler - statistical profiler that finds hot functions.
+"""
+import heapq
+import os
+import sys
+import threading
+import time
+from operator import itemgetter
+from types import CodeType, FrameType
+from typing import Dict, List, Optional, Set, Tuple, Union
+
+from ._compat import thread_time
+
+__all__ = ["SamplingProfiler"]
+
+# Metric name, metric type, value and tags.
+Reading = Tuple[str, str, float, Dict[str, str]]
+
+CLIENT_THREADS_PREFIX = "chouette-iot"
+OTHER = "other"
+# Datadog truncates longer tag values.
+MAX_TAG_LENGTH = 200
+
+
+class SamplingProfiler:
+    """
+    SamplingProfiler takes stacks of all the application threads with
+    sys._current_frames and counts samples by a top frame function and by
+    a stack fingerprint - names of up to 'depth' top frames functions,
+    innermost first, truncated to a tag value length limit. Its own thread
+    and other ChouetteClient threads named 'chouette-iot-*' (lane writers,
+    flusher, collectors) mostly wait, so they are not sampled.
+
+    Both tables are bounded by max_entries. When a table is full, samples
+    of new functions or stacks are counted as 'other'. Function labels are
+    cached per code object, so a sample costs a dict lookup per frame.
+
+    On every report the top-N functions and stacks are returned together
+    with the total number of samples and the profiler overhead - a share
+    of CPU time the profiler used since the previous report. Tables are
+    reset after a report.
+    """
+
+    def __init__(
+        self,
+        hz: float = 19,
+        top: int = 20,
+        depth: int = 5,
+        max_entries: int = 1000,
+    ):
+        self.period = 1 / hz
+        self.top = top
+        self.depth = depth
+        self.max_entries = max_entries
+        self.labels: Dict[CodeType, str] = {}
+        self.functions: Dict[str, int] = {}
+        self.stacks: Dict[Union[str, Tuple[str, ...]], int] = {}
+        self.samples = 0
+        self.cpu_time = 0.0
+        self.started = time.monotonic()
+
+    @classmethod
+    def from_env(cls) -> "SamplingProfiler":
+        """
+        Creates a SamplingProfiler configured by environment variables:
+        CHOUETTE_PROFILER_HZ - samples per second (default 19),
+        CHOUETTE_PROFILER_TOP - number of reported functions and stacks
+        (default 20), CHOUETTE_PROFILER_DEPTH - frames in a stack
+        fingerprint (default 5) and CHOUETTE_PROFILER_MAX_ENTRIES - size of
+        tables (default 1000).
+
+        Returns: SamplingProfiler instance.
+        """
+        return cls(
+            hz=float(os.environ.get("CHOUETTE_PROFILER_HZ", "19")),
+            top=int(os.environ.get("CHOUETTE_PROFILER_TOP", "20")),
+            depth=int(os.environ.get("CHOUETTE_PROFILER_DEPTH", "5")),
+            max_entries=int(os.environ.get("CHOUETTE_PROFILER_MAX_ENTRIES", "1000")),
+        )
+
+    def sample(self) -> None:
+        """
+        Takes a sample of every thread except the calling one, that is
+        supposed to be the profiler thread, and ChouetteClient threads.
+        """
+        started = thread_time()
+        skipped: Set[Optional[int]] = {threading.get_ident()}
+        skipped.update(
+            thread.ident
+            for thread in threading.enumerate()
+            if thread.name.startswith(CLIENT_THREADS_PREFIX)
+        )
+        for ident, frame in sys._current_frames().items():
+            if ident in skipped:
+                continue
+            labels: List[str] = []
+            current: Optional[FrameType] = frame
+            while current is not None and len(labels) < self.depth:
+                labels.append(self._label(current))
+                current = current.f_back
+            self._count(self.functions, labels[0])
+            self._count(self.stacks, tuple(labels))
+            self.samples += 1
+        self.cpu_time += thread_time() - started
+
+    def _label(self, frame: FrameType) -> str:
+        """
+        Args:
+            frame: Stack frame.
+        Returns: Function label as 'module.function', cached per code object.
+        """
+        code = frame.f_code
+        label = self.labels.get(code)
+        if label is None:
+            module = frame.f_globals.get("__name__", "?")
+            name = getattr(code, "co_qualname", code.co_name)
+            label = self.labels[code] = f"{module}.{name}"
+        return label
+
+    def _count(self, table: Dict, key: object) -> None:
+        """
+        Counts a sample in a table, as 'other' if the table is full.
+
+        Args:
+            table: Functions or stacks table.
+            key: Function label or stack fingerprint.
+        """
+        if key in table:
+            table[key] += 1
+        elif len(table) < self.max_entries:
+            table[key] = 1
+        else:
+            table[OTHER] = table.get(OTHER, 0) + 1
+
+    def report(self) -> List[Reading]:
+        """
+        Takes the top functions and stacks and resets the tables.
+
+        Returns: List of readings: metric name, metric type, value and tags.
+        """
+        now = time.monotonic()
+        elapsed = now - self.started
+        functions, self.functions = self.functions, {}
+        stacks, self.stacks = self.stacks, {}
+        readings: List[Reading] = [
+            ("runtime.python.profile.total_samples", "count", self.samples, {}),
+            (
+                "chouette.client.profiler.overhead",
+                "gauge",
+                self.cpu_time / elapsed if elapsed > 0 else 0.0,
+                {},
+            ),
+        ]
+        self.samples = 0
+        self.cpu_time = 0.0
+        self.started = now
+        for function, count in self._top(functions):
+            readings.append(
+                (
+                    "runtime.python.profile.samples",
+                    "count",
+                    count,
+                    {"function": function},
+                )
+            )
+        for stack, count in self._top(stacks):
+            fingerprint = stack if isinstance(stack, str) else " < ".join(stack)
+            fingerprint = fingerprint[:MAX_TAG_LENGTH]
+            readings.append(
+                (
+                    "runtime.python.profile.stacks",
+                    "count",
+                    count,
+                    {"stack": fingerprint},
+                )
+            )
+        return readings
+
+    def _top(self, table: Dict) -> List[Tuple]:
+        """
+        Args:
+            table: Functions or stacks table.
+        Returns: Top-N table entries by number of samples.
+        """
+        return heapq.nlargest(self.top, table.items(), key=itemgetter(1))
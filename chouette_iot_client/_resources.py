@@ -0,0 +1,159 @@
+"""
+ResourceCollector - low overhead process resources metrics.
+"""
+import gc
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+from ._compat import thread_time
+
+logger = logging.getLogger("chouette-iot")
+
+__all__ = ["ResourceCollector"]
+
+# Metric name, metric type and value.
+Reading = Tuple[str, str, float]
+
+# Zero based positions of /proc/<pid>/stat fields after a process name.
+UTIME, STIME, NUM_THREADS = 11, 12, 17
+
+
+class ResourceCollector:
+    """
+    ResourceCollector reads resources usage of the current process: CPU time
+    and usage, resident memory, number of open file descriptors and
+    threads, and garbage collector statistics.
+
+    /proc/self/stat and /proc/self/statm are opened once and re-read by
+    os.pread on every tick, so a tick doesn't open files except the
+    /proc/self/fd directory, and they are parsed by plain splits.
+    Descriptors are reopened in forked children, because /proc/self is
+    resolved to a process id when a file is opened.
+
+    Collector's own CPU time is measured on every tick and sent as
+    'chouette.client.resource_collector.cpu_time' gauge. If it's above
+    'budget' share of the interval, the interval is doubled, up to
+    max_backoff times the configured interval, and it's shrunk back when
+    the cost is low again.
+    """
+
+    def __init__(self, interval: float = 10, budget: float = 0.001):
+        if not os.path.exists("/proc/self/stat"):
+            raise RuntimeError("Resource collector requires Linux /proc.")
+        self.base_interval = interval
+        self.interval = interval
+        self.budget = budget
+        self.max_backoff = 16
+        self.ticks_per_second = os.sysconf("SC_CLK_TCK")
+        self.page_size = os.sysconf("SC_PAGE_SIZE")
+        self.pid = 0
+        self.stat_fd = -1
+        self.statm_fd = -1
+        self.previous_cpu: Optional[Tuple[float, float, float]] = None
+        self.previous_collections: List[int] = []
+        self.last_cost = 0.0
+
+    def _ensure_process(self) -> None:
+        """
+        Opens /proc files of the current process, if they are not opened yet
+        or were opened by a parent process.
+        """
+        pid = os.getpid()
+        if pid == self.pid:
+            return
+        for inherited_fd in (self.stat_fd, self.statm_fd):
+            if inherited_fd >= 0:
+                os.close(inherited_fd)
+        self.stat_fd = os.open("/proc/self/stat", os.O_RDONLY)
+        self.statm_fd = os.open("/proc/self/statm", os.O_RDONLY)
+        self.pid = pid
+        self.previous_cpu = None
+        self.previous_collections = []
+
+    def collect(self) -> List[Reading]:
+        """
+        Reads all the resources once. CPU usage and collections numbers
+        are deltas since the previous call, so they are sent starting from
+        the second call.
+
+        Returns: List of readings: metric name, metric type and value.
+        """
+        started = thread_time()
+        self._ensure_process()
+        stat = os.pread(self.stat_fd, 4096, 0)
+        # Process name can contain spaces and parentheses, so fields are
+        # counted from its closing parenthesis.
+        fields = stat[stat.rindex(b")") + 2 :].split()
+        utime = int(fields[UTIME]) / self.ticks_per_second
+        stime = int(fields[STIME]) / self.ticks_per_second
+        resident = int(os.pread(self.statm_fd, 256, 0).split()[1])
+        # Listing opens the directory itself, so it's not counted.
+        open_fds = len(os.listdir("/proc/self/fd")) - 1
+        readings: List[Reading] = [
+            ("runtime.python.mem.rss", "gauge", resident * self.page_size),
+            ("runtime.python.thread_count", "gauge", int(fields[NUM_THREADS])),
+            ("runtime.python.open_fds", "gauge", open_fds),
+        ]
+        now = time.monotonic()
+        if self.previous_cpu:
+            previous_utime, previous_stime, previous_now = self.previous_cpu
+            used = utime - previous_utime + stime - previous_stime
+            readings += [
+                ("runtime.python.cpu.time.user", "count", utime - previous_utime),
+                ("runtime.python.cpu.time.sys", "count", stime - previous_stime),
+                (
+                    "runtime.python.cpu.percent",
+                    "gauge",
+                    used / (now - previous_now) * 100,
+                ),
+            ]
+        self.previous_cpu = (utime, stime, now)
+        for generation, count in enumerate(gc.get_count()):
+            readings.append(
+                (f"runtime.python.gc.count.gen{generation}", "gauge", count)
+            )
+        collections = [stats["collections"] for stats in gc.get_stats()]
+        for generation, (total, previous) in enumerate(
+            zip(collections, self.previous_collections)
+        ):
+            readings.append(
+                (
+                    f"runtime.python.gc.collections.gen{generation}",
+                    "count",
+                    total - previous,
+                )
+            )
+        self.previous_collections = collections
+        self.last_cost = thread_time() - started
+        readings.append(
+            ("chouette.client.resource_collector.cpu_time", "gauge", self.last_cost)
+        )
+        self._adapt_interval()
+        return readings
+
+    def _adapt_interval(self) -> None:
+        """
+        Backs off if the last tick cost more than the budget and returns
+        to the configured interval when it's cheap again.
+        """
+        if self.last_cost > self.budget * self.interval:
+            if self.interval < self.base_interval * self.max_backoff:
+                self.interval *= 2
+                logger.warning(
+                    "Resource collector took %.6fs, interval is %ss now.",
+                    self.last_cost,
+                    self.interval,
+                )
+        elif (
+            self.interval > self.base_interval
+            and self.last_cost * 4 < self.budget * self.interval
+        ):
+            self.interval /= 2
+
+    def get_stats(self) -> Dict[str, float]:
+        """
+        Returns: Current interval and CPU time of the last tick in seconds.
+        """
+        return {"interval": self.interval, "last_cost": self.last_cost}
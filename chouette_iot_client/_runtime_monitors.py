@@ -0,0 +1,121 @@
+"""
+Runtime monitors: garbage collector pauses and asyncio event loop lag.
+"""
+import asyncio
+import gc
+import time
+from typing import Any, Dict, Optional
+
+from ._aggregators import HistogramAggregator
+
+__all__ = ["GCMonitor", "LoopLagMonitor"]
+
+
+class GCMonitor:
+    """
+    GCMonitor times every garbage collection with gc.callbacks and adds its
+    duration to a HistogramAggregator as 'runtime.python.gc.pause' tagged
+    by a generation.
+
+    Its callback only runs when a collection happens, it doesn't take any
+    locks and tags of every generation are created once.
+    """
+
+    metric = "runtime.python.gc.pause"
+
+    def __init__(self, histograms: HistogramAggregator):
+        self.histograms = histograms
+        self.started = 0.0
+        self.tags: Dict[int, Dict[str, str]] = {
+            generation: {"generation": str(generation)} for generation in range(3)
+        }
+
+    def start(self) -> None:
+        """
+        Installs the callback, if it's not installed yet.
+        """
+        if self.callback not in gc.callbacks:
+            gc.callbacks.append(self.callback)
+
+    def stop(self) -> None:
+        """
+        Removes the callback.
+        """
+        if self.callback in gc.callbacks:
+            gc.callbacks.remove(self.callback)
+
+    def callback(self, phase: str, info: Dict[str, Any]) -> None:
+        """
+        gc callback: remembers a start time and adds a duration on stop.
+
+        Args:
+            phase: 'start' or 'stop'.
+            info: Collection info with a 'generation' key.
+        """
+        if phase == "start":
+            self.started = time.perf_counter()
+            return
+        generation = info["generation"]
+        tags = self.tags.get(generation) or {"generation": str(generation)}
+        self.histograms.add(self.metric, time.perf_counter() - self.started, tags)
+
+
+class LoopLagMonitor:
+    """
+    LoopLagMonitor schedules a heartbeat callback on an asyncio event loop
+    every interval seconds and adds its delay to a HistogramAggregator as
+    'runtime.python.event_loop.lag' tagged by a loop name.
+
+    A heartbeat is a single timer callback, so a monitored loop does one
+    cheap call per interval. If a loop is blocked, the next heartbeat
+    runs late and its lag shows for how long the loop was blocked.
+    """
+
+    metric = "runtime.python.event_loop.lag"
+
+    def __init__(
+        self,
+        histograms: HistogramAggregator,
+        loop: asyncio.AbstractEventLoop,
+        interval: float = 1.0,
+        name: str = "default",
+    ):
+        self.histograms = histograms
+        self.loop = loop
+        self.interval = interval
+        self.tags = {"loop": name}
+        self.expected = 0.0
+        self.handle: Optional[asyncio.TimerHandle] = None
+        self.stopped = False
+
+    def start(self) -> None:
+        """
+        Starts heartbeats. Can be called from any thread.
+        """
+        self.stopped = False
+        self.loop.call_soon_threadsafe(self._schedule)
+
+    def stop(self) -> None:
+        """
+        Stops heartbeats. Can be called from any thread.
+        """
+        self.stopped = True
+        if self.handle:
+            self.loop.call_soon_threadsafe(self.handle.cancel)
+
+    def _schedule(self) -> None:
+        """
+        Schedules the next heartbeat.
+        """
+        if self.stopped:
+            return
+        self.expected = self.loop.time() + self.interval
+        self.handle = self.loop.call_at(self.expected, self._beat)
+
+    def _beat(self) -> None:
+        """
+        Measures how late the heartbeat is and schedules the next one.
+        """
+        lag = max(self.loop.time() - self.expected, 0.0)
+        self.histograms.add(self.metric, lag, self.tags)
+        self._schedule()
@@ -0,0 +1,27 @@
+"""
+Sampling helpers shared by ChouetteClient and its companions.
+"""
+import threading
+from random import Random
+
+__all__ = ["is_sampled"]
+
+_local = threading.local()
+
+
+def is_sampled(sample_rate: float) -> bool:
+    """
+    Decides whether a record with a specified sample rate should be sent.
+
+    Every thread gets its own Random instance, so threads never share
+    a generator state and sampling decision is just a single method call.
+
+    Args:
+        sample_rate: Sample rate between 0 and 1.
+    Returns: Whether a record was sampled and should be sent.
+    """
+    try:
+        random = _local.random
+    except AttributeError:
+        random = _local.random = Random().random
+    return random() < sample_rate
@@ -0,0 +1,352 @@
+"""
+Cross-process 'count' metrics aggregation in shared memory.
+"""
+import json
+import logging
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+from hashlib import blake2b
+from typing import Any, Dict, List, Optional, Tuple
+
+from ._aggregators import SeriesKey, series_key
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None  # type: ignore
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:  # pragma: no cover
+    shared_memory = None  # type: ignore
+
+logger = logging.getLogger("chouette-iot")
+
+__all__ = ["SharedCounterTable", "SharedCountsAggregator"]
+
+# Slot: series key hash, accumulated value, series key length, series key.
+SLOT = struct.Struct("<QdH")
+SLOT_SIZE = 256
+MAX_KEY_SIZE = SLOT_SIZE - SLOT.size
+
+
+class SharedCounterTable:
+    """
+    SharedCounterTable is an open addressing hash table of counters that
+    lives in a named shared memory segment, so every process on a box that
+    uses the same name sees the same table.
+
+    Access to the table is serialized by flock on a lock file. Kernel
+    releases flock locks of a process when it dies, so a crashed worker
+    never leaves the table locked.
+
+    One of processes is elected as a flusher by a non-blocking exclusive
+    flock on another file. A flusher keeps this lock till its death, then
+    any other process takes it over on its next flush.
+
+    Draining takes the whole table content and zeroes it, so slots never
+    need to be deleted one by one and probing chains are never broken.
+    """
+
+    def __init__(self, name: str, slots: int = 4096, directory: str = None):
+        if shared_memory is None or fcntl is None:
+            raise RuntimeError(
+                "Shared aggregation requires Python 3.8+ on a POSIX system."
+            )
+        self.name = name
+        self.slots = slots
+        self.directory = directory or tempfile.gettempdir()
+        self.pid = 0
+        self.lock_fd = -1
+        self.leader_fd = -1
+        self.leading = False
+        self._open_locks()
+        with self._locked():
+            self.memory = self._attach()
+
+    def _open_locks(self) -> None:
+        """
+        Opens lock files for this process. Forked children have to reopen
+        them, because flock is bound to an open file description and
+        a child would share its parent's locks otherwise. Inherited
+        descriptors are closed, so a parent's flusher lock is released
+        when the parent dies.
+        """
+        for inherited_fd in (self.lock_fd, self.leader_fd):
+            if inherited_fd >= 0:
+                os.close(inherited_fd)
+        self.pid = os.getpid()
+        self.leading = False
+        base = os.path.join(self.directory, f"chouette-{self.name}")
+        self.lock_fd = os.open(f"{base}.lock", os.O_RDWR | os.O_CREAT, 0o666)
+        self.leader_fd = os.open(f"{base}.flusher", os.O_RDWR | os.O_CREAT, 0o666)
+
+    def _ensure_process(self) -> None:
+        """
+        Reopens lock files if the table is used by a forked child.
+        """
+        if self.pid != os.getpid():
+            self._open_locks()
+
+    def _attach(self) -> Any:
+        """
+        Attaches to an existing segment or creates a new zeroed one.
+        It's executed under the table lock, so nobody can attach to
+        a segment that is not truncated to its size yet.
+
+        Segments are not tracked by multiprocessing resource tracker,
+        otherwise it would unlink a segment when its creator exits.
+
+        Returns: SharedMemory instance.
+        """
+        name = f"chouette_{self.name}"
+        size = self.slots * SLOT_SIZE
+        try:
+            memory = _shared_memory(name, create=True, size=size)
+        except FileExistsError:
+            memory = _shared_memory(name, create=False, size=0)
+            if memory.size < size:
+                raise RuntimeError(
+                    f"Shared memory segment {name} is smaller than {size} bytes."
+                )
+        return memory
+
+    def _locked(self) -> "_FileLock":
+        """
+        Returns: Context manager holding the table lock.
+        """
+        return _FileLock(self.lock_fd)
+
+    def add_many(self, deltas: Dict[bytes, float]) -> Dict[bytes, float]:
+        """
+        Adds values to counters in a single critical section.
+
+        Args:
+            deltas: Dict of encoded series keys and values to add.
+        Returns: Deltas that didn't fit into the table.
+        """
+        self._ensure_process()
+        leftovers = {}
+        buffer = self.memory.buf
+        with self._locked():
+            for key, delta in deltas.items():
+                offset = self._find(buffer, key)
+                if offset is None:
+                    leftovers[key] = delta
+                    continue
+                key_hash, value, length = SLOT.unpack_from(buffer, offset)
+                SLOT.pack_into(buffer, offset, key_hash, value + delta, length)
+        return leftovers
+
+    def _find(self, buffer: memoryview, key: bytes) -> Optional[int]:
+        """
+        Finds a slot of a series or claims an empty one.
+        A slot hash is written last, so a slot is never visible half-written.
+
+        Args:
+            buffer: Shared memory buffer.
+            key: Encoded series key.
+        Returns: Slot offset or None if a key is too long or the table is full.
+        """
+        if len(key) > MAX_KEY_SIZE:
+            return None
+        key_hash = int.from_bytes(blake2b(key, digest_size=8).digest(), "little")
+        key_hash = key_hash or 1
+        start = key_hash % self.slots
+        for probe in range(self.slots):
+            offset = ((start + probe) % self.slots) * SLOT_SIZE
+            stored_hash = SLOT.unpack_from(buffer, offset)[0]
+            if stored_hash == key_hash:
+                return offset
+            if not stored_hash:
+                key_offset = offset + SLOT.size
+                buffer[key_offset : key_offset + len(key)] = key
+                SLOT.pack_into(buffer, offset, key_hash, 0.0, len(key))
+                return offset
+        return None
+
+    def try_lead(self) -> bool:
+        """
+        Tries to become a flusher if there is no alive flusher.
+
+        Returns: Whether this process is a flusher.
+        """
+        self._ensure_process()
+        if not self.leading:
+            try:
+                fcntl.flock(self.leader_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return False
+            logger.info("Process %s became a shared metrics flusher.", self.pid)
+            self.leading = True
+        return True
+
+    def drain(self) -> List[Tuple[bytes, float]]:
+        """
+        Takes all non-zero counters and zeroes the whole table.
+
+        Returns: List of tuples of encoded series keys and their values.
+        """
+        self._ensure_process()
+        buffer = self.memory.buf
+        size = self.slots * SLOT_SIZE
+        counters = []
+        with self._locked():
+            for offset in range(0, size, SLOT_SIZE):
+                key_hash, value, length = SLOT.unpack_from(buffer, offset)
+                if key_hash and value:
+                    key_offset = offset + SLOT.size
+                    key = bytes(buffer[key_offset : key_offset + length])
+                    counters.append((key, value))
+            buffer[:size] = bytes(size)
+        return counters
+
+    def unlink(self) -> None:
+        """
+        Removes the shared memory segment. Normally it's not necessary,
+        because the segment is reused by the next generation of workers.
+        """
+        self.memory.close()
+        if sys.version_info < (3, 13):
+            # SharedMemory.unlink unregisters a segment it doesn't track.
+            resource_tracker.register(self.memory._name, "shared_memory")  # type: ignore
+        self.memory.unlink()
+
+
+class _FileLock:
+    """
+    Exclusive flock context manager.
+    """
+
+    def __init__(self, fd: int):
+        self.fd = fd
+
+    def __enter__(self) -> None:
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+
+    def __exit__(self, *args: Any) -> None:
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+
+def _shared_memory(name: str, create: bool, size: int) -> Any:
+    """
+    Opens a shared memory segment that is not tracked by the resource
+    tracker. Python 3.13 has a parameter for that, older versions need
+    to unregister a segment manually.
+
+    Args:
+        name: Segment name.
+        create: Whether a segment should be created.
+        size: Segment size.
+    Returns: SharedMemory instance.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(
+            name=name, create=create, size=size, track=False  # type: ignore
+        )
+    memory = shared_memory.SharedMemory(name=name, create=create, size=size)
+    resource_tracker.unregister(memory._name, "shared_memory")  # type: ignore
+    return memory
+
+
+class SharedCountsAggregator:
+    """
+    SharedCountsAggregator sums 'count' metrics of a process locally and
+    publishes these sums to a SharedCounterTable once per flush.
+
+    A process that is elected as a flusher also drains the table and gets
+    combined counters of all the processes as metric records, so only this
+    process writes counters to a storage.
+
+    Counters that don't fit into the table are returned to be stored by
+    the publishing process itself, so they are never lost.
+    If a flusher dies between draining and storing, a single window of
+    counters is lost.
+
+    Local counters are reset in forked children, so counters that a parent
+    hasn't published yet are published only once, by the parent.
+    """
+
+    def __init__(self, table: SharedCounterTable):
+        self.table = table
+        self.local: Dict[SeriesKey, float] = {}
+        self.lock = threading.Lock()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self.reset)
+
+    @classmethod
+    def from_env(cls) -> Optional["SharedCountsAggregator"]:
+        """
+        Creates a SharedCountsAggregator if CHOUETTE_SHARED_AGGREGATION
+        environment variable contains a shared table name. Table size is
+        configured by CHOUETTE_SHARED_AGGREGATION_SLOTS (default 4096).
+
+        Returns: SharedCountsAggregator or None if it's not configured or
+                 not supported.
+        """
+        name = os.environ.get("CHOUETTE_SHARED_AGGREGATION")
+        if not name:
+            return None
+        slots = int(os.environ.get("CHOUETTE_SHARED_AGGREGATION_SLOTS", "4096"))
+        try:
+            return cls(SharedCounterTable(name, slots))
+        except RuntimeError as error:
+            logger.warning("Shared aggregation is disabled: %s", error)
+            return None
+
+    def reset(self) -> None:
+        """
+        Forgets local counters. It's used in child processes, because
+        these counters are published by their parent.
+        """
+        self.lock = threading.Lock()
+        self.local = {}
+
+    def add(self, metric: str, value: float, tags: Dict[str, str]) -> None:
+        """
+        Adds a value to a local counter.
+
+        Args:
+            metric: Metric name.
+            value: Metric value.
+            tags: Metric tags as a dict.
+        """
+        key = series_key(metric, tags)
+        with self.lock:
+            self.local[key] = self.local.get(key, 0) + value
+
+    def flush(self) -> List[Dict[str, Any]]:
+        """
+        Publishes local counters to the shared table and, if this process
+        is a flusher, drains the table.
+
+        Returns: List of 'count' metric records to store.
+        """
+        with self.lock:
+            local, self.local = self.local, {}
+        deltas = {
+            json.dumps([metric, tags]).encode(): value
+            for (metric, tags), value in local.items()
+        }
+        leftovers = self.table.add_many(deltas) if deltas else {}
+        counters = list(leftovers.items())
+        if self.table.try_lead():
+            counters.extend(self.table.drain())
+        timestamp = time.time()
+        records = []
+        for key, value in counters:
+            metric, tags = json.loads(key)
+            records.append(
+                {
+                    "metric": metric,
+                    "type": "count",
+                    "value": value,
+                    "timestamp": timestamp,
+                    "tags": {name: tag for name, tag in tags},
+                }
+            )
+        return records
@@ -1,111 +1,752 @@
 """
 Chouette storages file.
-For now it's just a RedisStorage.
-It could be made more enterprise-y with a Storage interface, but it'll
-work for now as is.
+Storage is an interface of everything ChouetteClient writes records to:
+RedisStorage and RedisEndpoints write to Redis, MemoryStorage and
+NullStorage keep records in process for tests and benchmarks.
 """
 import json
 import logging
 import os
 import re
+import time
+from abc import ABC, abstractmethod
+from collections import deque
 from datetime import datetime
-from typing import Any, Dict, Optional
+from threading import Lock, local
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 from uuid import uuid4
 
 from redis import Redis, RedisError
 
+from ._compression import Compressor
+from ._encoding import LogEncoder
+
 logger = logging.getLogger("chouette-iot")
 
-__all__ = ["RedisStorage", "StoragesFactory"]
+__all__ = [
+    "MemoryStorage",
+    "NullStorage",
+    "RedisEndpoints",
+    "RedisStorage",
+    "Storage",
+    "StoragesFactory",
+]
+
+# Metric name, metric type, value and tags of a storage report.
+Reading = Tuple[str, str, float, Dict[str, str]]
+
+# Removes the oldest records of a queue from both its keys sorted set and
+# its values hash: everything older than a minimal score (if it's not 0)
+# and then everything above a maximal number of records (if it's not 0).
+# Hash fields are deleted in chunks to stay within Lua stack limits.
+TRIM_SCRIPT = """
+local keys, values = KEYS[1], KEYS[2]
+local max_records, min_score = tonumber(ARGV[1]), tonumber(ARGV[2])
+local trimmed = 0
+local function drop(members)
+    for i = 1, #members, 1000 do
+        redis.call('HDEL', values, unpack(members, i, math.min(i + 999, #members)))
+    end
+    trimmed = trimmed + #members
+end
+if min_score > 0 then
+    drop(redis.call('ZRANGEBYSCORE', keys, '-inf', '(' .. min_score))
+    redis.call('ZREMRANGEBYSCORE', keys, '-inf', '(' .. min_score)
+end
+if max_records > 0 then
+    local excess = redis.call('ZCARD', keys) - max_records
+    if excess > 0 then
+        drop(redis.call('ZRANGE', keys, 0, excess - 1))
+        redis.call('ZREMRANGEBYRANK', keys, 0, excess - 1)
+    end
+end
+return trimmed
+"""
+
+
+class Storage(ABC):
+    """
+    Storage is an interface of a destination of records. A storage stores
+    batches of metrics and log messages and returns their keys or Nones for
+    records that were not stored. Single record methods store batches of
+    one record.
+
+    A storage that has something to report periodically, e.g. its own
+    statistics, returns True from 'reports' and its readings from
+    'collect_report', so ChouetteClient sends them as metrics.
+    """
+
+    metrics_queue = "chouette:metrics:raw"
+    logs_queue = "chouette:logs:wrapped"
+
+    def store_metric(self, metric: Dict[str, Any]) -> Optional[str]:
+        """
+        Stores a metric.
+
+        Args:
+            metric: Metric as a dictionary.
+        Return: Message key or None if message was not stored successfully.
+        """
+        return self.store_metrics([metric])[0]
+
+    @abstractmethod
+    def store_metrics(self, metrics: List[Dict[str, Any]]) -> List[Optional[str]]:
+        """
+        Stores a batch of metrics.
+
+        Args:
+            metrics: List of metrics as dictionaries.
+        Return: List of message keys or Nones if messages were not stored.
+        """
+
+    def store_log(self, log_message: Dict[str, Any]) -> Optional[str]:
+        """
+        Stores a log message.
+
+        Args:
+            log_message: Log message as a dictionary.
+        Return: Message key or None if message was not stored successfully.
+        """
+        return self.store_logs([log_message])[0]
+
+    @abstractmethod
+    def store_logs(self, log_messages: List[Dict[str, Any]]) -> List[Optional[str]]:
+        """
+        Stores a batch of log messages.
+
+        Args:
+            log_messages: List of log messages as dictionaries.
+        Return: List of message keys or Nones if messages were not stored.
+        """
+
+    @property
+    def reports(self) -> bool:
+        """
+        Returns: Whether the storage has anything to report periodically.
+        """
+        return False
+
+    def collect_report(self) -> List[Reading]:
+        """
+        Returns: List of readings: metric name, metric type, value and tags.
+        """
+        return []
 
 
 class StoragesFactory:
     """
-    Storages factory that creates a storage of a desired type.
-    At the moment there is a single storage type that is Redis.
+    Storages factory that creates a storage of a desired type:
+    'redis', 'memory' or 'null'.
     """
 
     @staticmethod
-    def get_storage(storage_type: str):
+    def get_storage(storage_type: str) -> Optional[Storage]:
         """
         Generates a storage.
 
-        Returns: RedisStorage instance or None if redis is not reachable.
+        MemoryStorage keeps up to CHOUETTE_MEMORY_STORAGE_CAPACITY (default
+        100000) last records of every queue, NullStorage only counts them.
+
+        Redis is configured by REDIS_HOST and REDIS_PORT environment
+        variables or by REDIS_ENDPOINTS as "host:port,host:port". With
+        multiple endpoints, records are written to the fastest healthy one
+        or, if CHOUETTE_ENDPOINTS_MODE is 'spread', to all the healthy
+        endpoints in turns. CHOUETTE_REDIS_TIMEOUT sets Redis socket
+        timeouts in seconds (default 1 for multiple endpoints, no timeout
+        for a single one).
+
+        Redis backlog caps are configured per queue by environment variables
+        CHOUETTE_METRICS_BACKLOG_MAX_RECORDS, CHOUETTE_METRICS_BACKLOG_MAX_AGE,
+        CHOUETTE_LOGS_BACKLOG_MAX_RECORDS and CHOUETTE_LOGS_BACKLOG_MAX_AGE
+        (in seconds, 0 means no limit) and checked every
+        CHOUETTE_BACKLOG_CHECK_EVERY batches (default 100).
+
+        Returns: Storage instance or None if a storage type is unknown.
         """
-        if storage_type.lower() == "redis":
-            redis_host = os.environ.get("REDIS_HOST", "redis")
-            redis_port = int(os.environ.get("REDIS_PORT", "6379"))
-            redis_storage = RedisStorage(host=redis_host, port=redis_port)
-            return redis_storage
+        storage_type = storage_type.lower()
+        if storage_type == "memory":
+            capacity = os.environ.get("CHOUETTE_MEMORY_STORAGE_CAPACITY", "100000")
+            return MemoryStorage(int(capacity))
+        if storage_type == "null":
+            return NullStorage()
+        if storage_type == "redis":
+            endpoints = []
+            for endpoint in os.environ.get("REDIS_ENDPOINTS", "").split(","):
+                host, _, port = endpoint.strip().partition(":")
+                if host:
+                    endpoints.append((host, port or "6379"))
+            if not endpoints:
+                redis_host = os.environ.get("REDIS_HOST", "redis")
+                redis_port = os.environ.get("REDIS_PORT", "6379")
+                endpoints = [(redis_host, redis_port)]
+            timeout = os.environ.get("CHOUETTE_REDIS_TIMEOUT")
+            if timeout is None and len(endpoints) > 1:
+                timeout = "1"
+            storages = [
+                StoragesFactory._get_redis_storage(
+                    host, int(port), float(timeout) if timeout else None
+                )
+                for host, port in endpoints
+            ]
+            if len(storages) == 1:
+                return storages[0]
+            mode = os.environ.get("CHOUETTE_ENDPOINTS_MODE", "failover").lower()
+            return RedisEndpoints(storages, spread=mode == "spread")
         return None
 
+    @staticmethod
+    def _get_redis_storage(
+        host: str, port: int, timeout: Optional[float]
+    ) -> "RedisStorage":
+        """
+        Creates a RedisStorage with backlog caps configured by environment
+        variables.
 
-class RedisStorage(Redis):
+        Args:
+            host: Redis host.
+            port: Redis port.
+            timeout: Socket timeout in seconds or None.
+        Returns: RedisStorage instance.
+        """
+        caps = {}
+        for name, queue in (
+            ("METRICS", RedisStorage.metrics_queue),
+            ("LOGS", RedisStorage.logs_queue),
+        ):
+            prefix = f"CHOUETTE_{name}_BACKLOG"
+            max_records = int(os.environ.get(f"{prefix}_MAX_RECORDS", "0"))
+            max_age = float(os.environ.get(f"{prefix}_MAX_AGE", "0"))
+            if max_records > 0 or max_age > 0:
+                caps[queue] = (max_records, max_age)
+        return RedisStorage(
+            host=host,
+            port=port,
+            socket_timeout=timeout,
+            socket_connect_timeout=timeout,
+            caps=caps,
+            cap_check_every=int(os.environ.get("CHOUETTE_BACKLOG_CHECK_EVERY", "100")),
+        )
+
+
+class RedisStorage(Redis, Storage):
     """
     RedisStorage is a wrapper around Redis that stores data into
     its queues.
+
+    If Chouette-IoT is not collecting records, queues grow till Redis runs
+    out of memory. To prevent this, a queue can have a cap: a maximal
+    number of records and/or a maximal age of records by their collection
+    timestamps. Caps are checked after every cap_check_every stored batches
+    of a queue and the oldest records are trimmed from both the keys sorted
+    set and the values hash by a single Lua script, so it's atomic and
+    takes a single round trip. Numbers of trimmed records are counted
+    per queue.
+
+    Log messages are encoded by a LogEncoder, so they never fail to be
+    stored because of unserializable extras and their size is limited.
+
+    If a Compressor is configured, long records are compressed before
+    they are stored.
     """
 
-    metrics_queue = "chouette:metrics:raw"
-    logs_queue = "chouette:logs:wrapped"
+    def __init__(
+        self,
+        *args: Any,
+        caps: Dict[str, Tuple[int, float]] = None,
+        cap_check_every: int = 100,
+        log_encoder: LogEncoder = None,
+        compressor: Compressor = None,
+        **kwargs: Any,
+    ):
+        super().__init__(*args, **kwargs)
+        self.log_encoder = log_encoder or LogEncoder.from_env()
+        self.compressor = compressor or Compressor.from_env()
+        self.caps = caps or {}
+        self.cap_check_every = max(cap_check_every, 1)
+        self.batches: Dict[str, int] = {}
+        self.trimmed: Dict[str, int] = {}
+        self.trimmed_lock = Lock()
+        self.trim_script = self.register_script(TRIM_SCRIPT)
+        # Whether the latest batch of a calling thread failed to reach Redis.
+        self.last_batch = local()
 
-    def store_metric(self, metric: Dict[str, Any]) -> Optional[str]:
+    def store_metrics(self, metrics: List[Dict[str, Any]]) -> List[Optional[str]]:
         """
-        Stores a metric to Redis.
+        Stores a batch of metrics to Redis in a single round trip.
 
         Args:
-            metric: Metric as a dictionary.
-        Return: Message key or None if message was not stored successfully.
+            metrics: List of metrics as dictionaries.
+        Return: List of message keys or Nones if messages were not stored.
         """
-        collected_at = metric["timestamp"]
-        return self._store(metric, self.metrics_queue, collected_at)
+        timestamps = [metric["timestamp"] for metric in metrics]
+        return self._store(metrics, self.metrics_queue, timestamps)
 
-    def store_log(self, log_message: Dict[str, Any]) -> Optional[str]:
+    def store_logs(self, log_messages: List[Dict[str, Any]]) -> List[Optional[str]]:
         """
-        Stores a log message to Redis.
+        Stores a batch of log messages to Redis in a single round trip.
 
         Args:
-            log_message: Log message as a dictionary.
-        Return: Message key or None if message was not stored successfully.
+            log_messages: List of log messages as dictionaries.
+        Return: List of message keys or Nones if messages were not stored.
         """
-        py36_date = re.sub(r"\+(\d{2}):(\d{2})", r"+\1\2", log_message["date"])
-        collected_at = datetime.strptime(
-            py36_date, "%Y-%m-%dT%H:%M:%S.%f%z"
-        ).timestamp()
-        return self._store(log_message, self.logs_queue, collected_at)
+        timestamps = []
+        for log_message in log_messages:
+            py36_date = re.sub(r"\+(\d{2}):(\d{2})", r"+\1\2", log_message["date"])
+            collected_at = datetime.strptime(
+                py36_date, "%Y-%m-%dT%H:%M:%S.%f%z"
+            ).timestamp()
+            timestamps.append(collected_at)
+        return self._store(
+            log_messages, self.logs_queue, timestamps, self.log_encoder.encode
+        )
 
     def _store(
-        self, record: Dict[str, Any], queue: str, timestamp: float
-    ) -> Optional[str]:
+        self,
+        records: List[Dict[str, Any]],
+        queue: str,
+        timestamps: List[float],
+        encode: Callable[[Dict[str, Any]], str] = json.dumps,
+    ) -> List[Optional[str]]:
         """
-        Actually stores a message to Redis.
+        Actually stores messages to Redis.
 
-        It generates a key as a unique string, casts a record into json and
-        stores it to a specified queue in Redis under a specified timestamp.
+        It generates a key as a unique string for every record, casts records
+        into json (or encodes them by a specified function), compresses long
+        ones if compression is enabled and stores them to a specified queue in Redis under
+        specified timestamps. All the records are sent in a single pipeline,
+        so a batch takes a single round trip. A record that can't be encoded
+        gets a None key, but it doesn't fail the rest of its batch.
 
         Args:
-            record: Record to store as a dict.
+            records: Records to store as dicts.
             queue: Queue name.
-            timestamp: Unix timestamp for a keys sorted set.
-        Return: Message key or None if message was not stored successfully.
+            timestamps: Unix timestamps for a keys sorted set.
+            encode: Function that casts a record into a string.
+        Return: List of message keys or Nones if messages were not stored.
         """
-        key = str(uuid4())
-        value = json.dumps(record)
+        if not records:
+            return []
+        keys: List[Optional[str]] = []
+        encoded: Dict[str, Union[str, bytes]] = {}
+        scores: Dict[str, float] = {}
+        compress = self.compressor.compress if self.compressor else None
+        for record, timestamp in zip(records, timestamps):
+            try:
+                value = encode(record)
+            except (TypeError, ValueError) as error:
+                logger.warning("Could not encode a record %r. Error: %s", record, error)
+                keys.append(None)
+                continue
+            key = str(uuid4())
+            encoded[key] = compress(value) if compress else value
+            scores[key] = timestamp
+            keys.append(key)
+        if not encoded:
+            return keys
         pipeline = self.pipeline()
-        pipeline.zadd(f"{queue}.keys", {key: timestamp})
-        pipeline.hset(f"{queue}.values", key, value)
+        pipeline.zadd(f"{queue}.keys", scores)
+        for key, stored in encoded.items():
+            pipeline.hset(f"{queue}.values", key, stored)
         try:
             pipeline.execute()
         except (RedisError, OSError) as error:
+            self.last_batch.failed = True
             logger.warning(
-                "Could not store a record %s: %s to queue %s. Error: %s",
-                key,
-                value,
+                "Could not store %s records to queue %s. Error: %s",
+                len(encoded),
                 queue,
                 error,
             )
-            return None
-        logger.debug(
-            "Successfully stored a record %s: %s to queue %s.", key, value, queue
+            return [None] * len(records)
+        logger.debug("Successfully stored %s records to queue %s.", len(encoded), queue)
+        cap = self.caps.get(queue)
+        if cap:
+            batches = self.batches.get(queue, 0)
+            self.batches[queue] = batches + 1
+            if not batches % self.cap_check_every:
+                self.trim(queue, *cap)
+        return keys
+
+    def trim(self, queue: str, max_records: int = 0, max_age: float = 0) -> int:
+        """
+        Trims the oldest records of a queue in a single atomic operation.
+
+        Args:
+            queue: Queue name.
+            max_records: Maximal number of records to keep, 0 for no limit.
+            max_age: Maximal records age in seconds, 0 for no limit.
+        Return: Number of trimmed records.
+        """
+        min_score = time.time() - max_age if max_age > 0 else 0
+        try:
+            trimmed = self.trim_script(
+                keys=[f"{queue}.keys", f"{queue}.values"],
+                args=[max_records, repr(min_score)],
+            )
+        except (RedisError, OSError) as error:
+            logger.warning("Could not trim queue %s. Error: %s", queue, error)
+            return 0
+        if trimmed:
+            logger.warning("Trimmed %s oldest records of queue %s.", trimmed, queue)
+            with self.trimmed_lock:
+                self.trimmed[queue] = self.trimmed.get(queue, 0) + trimmed
+        return trimmed
+
+    @property
+    def reports(self) -> bool:
+        """
+        Returns: Whether the storage has anything to report periodically.
+        """
+        return bool(self.caps)
+
+    def collect_report(self) -> List[Reading]:
+        """
+        Takes numbers of trimmed records as 'chouette.client.trimmed_records'
+        count metrics tagged by queue names.
+
+        Returns: List of readings: metric name, metric type, value and tags.
+        """
+        return [
+            ("chouette.client.trimmed_records", "count", trimmed, {"queue": queue})
+            for queue, trimmed in self.collect_trimmed().items()
+        ]
+
+    def collect_trimmed(self) -> Dict[str, int]:
+        """
+        Takes trimmed records counters and resets them.
+
+        Returns: Dict of numbers of trimmed records by queue names.
+        """
+        with self.trimmed_lock:
+            trimmed, self.trimmed = self.trimmed, {}
+        return trimmed
+
+
+class RedisEndpoint:
+    """
+    RedisEndpoint is a RedisStorage with its health and statistics.
+
+    An endpoint that failed to store a batch is unhealthy and it's not used
+    till its backoff expires. Backoff starts with min_backoff seconds and
+    doubles with every consecutive failure up to max_backoff seconds.
+
+    Lanes writers update an endpoint concurrently, so its state is changed
+    under a lock. Latency is None till the first successful batch.
+    """
+
+    def __init__(
+        self, storage: RedisStorage, min_backoff: float = 0.5, max_backoff: float = 30
+    ):
+        kwargs = storage.connection_pool.connection_kwargs
+        self.name = f"{kwargs.get('host')}:{kwargs.get('port')}"
+        self.storage = storage
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.failures = 0
+        self.retry_at = 0.0
+        self.latency: Optional[float] = None
+        self.stats: Dict[str, float] = {"stored": 0, "failed": 0, "failovers": 0}
+        self.lock = Lock()
+
+    def available(self, now: float) -> bool:
+        """
+        Args:
+            now: Monotonic time.
+        Returns: Whether the endpoint is healthy or its backoff has expired.
+        """
+        return now >= self.retry_at
+
+    def succeeded(self, latency: float, records: int, failover: bool = False) -> None:
+        """
+        Marks the endpoint healthy and updates its average latency.
+
+        Args:
+            latency: Batch latency in seconds.
+            records: Number of stored records.
+            failover: Whether the batch failed on another endpoint first.
+        """
+        with self.lock:
+            self.failures = 0
+            self.retry_at = 0.0
+            if self.latency is None:
+                self.latency = latency
+            else:
+                self.latency = 0.8 * self.latency + 0.2 * latency
+            self.stats["stored"] += records
+            if failover:
+                self.stats["failovers"] += 1
+
+    def failed(self, records: int) -> None:
+        """
+        Marks the endpoint unhealthy for a backoff period.
+
+        Args:
+            records: Number of records that were not stored.
+        """
+        with self.lock:
+            backoff = min(self.min_backoff * 2**self.failures, self.max_backoff)
+            self.failures += 1
+            self.retry_at = time.monotonic() + backoff
+            self.stats["failed"] += records
+        logger.warning(
+            "Redis endpoint %s is unhealthy, retrying in %ss.", self.name, backoff
         )
-        return key
+
+    def get_stats(self) -> Dict[str, float]:
+        """
+        Returns: Numbers of stored and failed records and failovers from
+                 this endpoint, whether it's healthy and its average latency.
+        """
+        with self.lock:
+            stats = dict(self.stats)
+            stats["healthy"] = int(not self.failures)
+            stats["latency"] = self.latency or 0.0
+        return stats
+
+
+class RedisEndpoints(Storage):
+    """
+    RedisEndpoints is a storage that writes to multiple Redis instances.
+
+    By default every batch is written to a healthy endpoint with the lowest
+    average latency. In 'spread' mode batches are written to healthy
+    endpoints in turns to share load.
+
+    If an endpoint fails, the same batch is immediately written to the
+    next endpoint and the failed one is skipped till its backoff expires,
+    so only a single batch per backoff period waits for a dead endpoint's
+    socket timeout. Every endpoint has its own backlog caps and its own
+    queues that Chouette-IoT instances should collect.
+
+    An endpoint that has never stored a batch is ranked by the average
+    latency of measured endpoints and after them, so an endpoint that has
+    been dead since the start doesn't go first whenever its backoff expires.
+    """
+
+    def __init__(self, storages: List[RedisStorage], spread: bool = False):
+        self.endpoints = [RedisEndpoint(storage) for storage in storages]
+        self.spread = spread
+        self.turn = 0
+        self.turn_lock = Lock()
+
+    @property
+    def storages(self) -> List[RedisStorage]:
+        """
+        Returns: Storages of all the endpoints.
+        """
+        return [endpoint.storage for endpoint in self.endpoints]
+
+    @property
+    def caps(self) -> Dict[str, Tuple[int, float]]:
+        """
+        Returns: Backlog caps of the first endpoint, all of them have
+                 the same caps when they are created by StoragesFactory.
+        """
+        return self.endpoints[0].storage.caps
+
+    @property
+    def reports(self) -> bool:
+        """
+        Returns: Always True, endpoints statistics are reported.
+        """
+        return True
+
+    def store_metrics(self, metrics: List[Dict[str, Any]]) -> List[Optional[str]]:
+        """
+        Stores a batch of metrics to an endpoint.
+
+        Args:
+            metrics: List of metrics as dictionaries.
+        Return: List of message keys or Nones if messages were not stored.
+        """
+        return self._store(metrics, RedisStorage.store_metrics)
+
+    def store_logs(self, log_messages: List[Dict[str, Any]]) -> List[Optional[str]]:
+        """
+        Stores a batch of log messages to an endpoint.
+
+        Args:
+            log_messages: List of log messages as dictionaries.
+        Return: List of message keys or Nones if messages were not stored.
+        """
+        return self._store(log_messages, RedisStorage.store_logs)
+
+    def _store(
+        self,
+        records: List[Dict[str, Any]],
+        store: Callable[[RedisStorage, List[Dict[str, Any]]], List[Optional[str]]],
+    ) -> List[Optional[str]]:
+        """
+        Stores a batch to the first endpoint that accepts it.
+
+        Args:
+            records: Records to store as dicts.
+            store: RedisStorage method that stores records.
+        Return: List of message keys or Nones if messages were not stored.
+        """
+        if not records:
+            return []
+        for attempt, endpoint in enumerate(self._candidates()):
+            started = time.monotonic()
+            # Records that can't be encoded get None keys on any endpoint,
+            # so only a failed Redis call fails an endpoint.
+            endpoint.storage.last_batch.failed = False
+            keys = store(endpoint.storage, records)
+            if not endpoint.storage.last_batch.failed:
+                endpoint.succeeded(
+                    time.monotonic() - started, len(records), attempt > 0
+                )
+                return keys
+            endpoint.failed(len(records))
+        return [None] * len(records)
+
+    def _candidates(self) -> List[RedisEndpoint]:
+        """
+        Returns: Available endpoints in order they should be tried.
+        """
+        now = time.monotonic()
+        available = [endpoint for endpoint in self.endpoints if endpoint.available(now)]
+        if self.spread and available:
+            with self.turn_lock:
+                self.turn = turn = (self.turn + 1) % len(available)
+            return available[turn:] + available[:turn]
+        measured = [
+            endpoint.latency for endpoint in available if endpoint.latency is not None
+        ]
+        neutral = sum(measured) / len(measured) if measured else 0.0
+
+        def rank(endpoint: RedisEndpoint) -> Tuple[float, bool]:
+            if endpoint.latency is None:
+                return neutral, True
+            return endpoint.latency, False
+
+        return sorted(available, key=rank)
+
+    def get_stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        Returns: Dict of endpoints statistics by endpoints names.
+        """
+        return {endpoint.name: endpoint.get_stats() for endpoint in self.endpoints}
+
+    def collect_report(self) -> List[Reading]:
+        """
+        Collects trimmed records of all the endpoints and endpoints
+        statistics as 'chouette.client.endpoint.<stat>' gauges tagged by
+        an endpoint name.
+
+        Returns: List of readings: metric name, metric type, value and tags.
+        """
+        readings: List[Reading] = []
+        for endpoint in self.endpoints:
+            tags = {"endpoint": endpoint.name}
+            for (
+                metric,
+                metric_type,
+                value,
+                queue_tags,
+            ) in endpoint.storage.collect_report():
+                readings.append((metric, metric_type, value, {**queue_tags, **tags}))
+            for name, value in endpoint.get_stats().items():
+                readings.append(
+                    (f"chouette.client.endpoint.{name}", "gauge", value, tags)
+                )
+        return readings
+
+
+class MemoryStorage(Storage):
+    """
+    MemoryStorage keeps records in process, so tests and benchmarks can run
+    without Redis and measure the client without broker latency.
+
+    Every queue is a ring buffer of the last 'capacity' records with their
+    keys: a bounded deque, that drops its oldest records when it's full.
+    Deque appends are atomic in CPython, so records are appended without
+    a lock. Keys are sequence numbers: a batch reserves a range of them by
+    a single increment of an integer counter under a lock, so the number
+    of stored records is exact no matter how many of them the ring buffer
+    kept, and a lock is taken once per batch, not per record.
+
+    Records are kept as they are, without encoding.
+    """
+
+    def __init__(self, capacity: int = 100000):
+        self.capacity = capacity
+        self.queues: Dict[str, deque] = {
+            self.metrics_queue: deque(maxlen=capacity),
+            self.logs_queue: deque(maxlen=capacity),
+        }
+        self.counts = {self.metrics_queue: 0, self.logs_queue: 0}
+        self.counts_lock = Lock()
+
+    def store_metrics(self, metrics: List[Dict[str, Any]]) -> List[Optional[str]]:
+        """
+        Stores a batch of metrics to the metrics ring buffer.
+
+        Args:
+            metrics: List of metrics as dictionaries.
+        Return: List of message keys.
+        """
+        return self._store(metrics, self.metrics_queue)
+
+    def store_logs(self, log_messages: List[Dict[str, Any]]) -> List[Optional[str]]:
+        """
+        Stores a batch of log messages to the logs ring buffer.
+
+        Args:
+            log_messages: List of log messages as dictionaries.
+        Return: List of message keys.
+        """
+        return self._store(log_messages, self.logs_queue)
+
+    def _store(self, records: List[Dict[str, Any]], queue: str) -> List[Optional[str]]:
+        """
+        Numbers records and appends them to a ring buffer.
+
+        Args:
+            records: Records to store as dicts.
+            queue: Queue name.
+        Return: List of message keys.
+        """
+        with self.counts_lock:
+            first = self.counts[queue]
+            self.counts[queue] = first + len(records)
+        keys: List[Optional[str]] = [
+            str(number) for number in range(first + 1, first + len(records) + 1)
+        ]
+        self.queues[queue].extend(zip(keys, records))
+        return keys
+
+    def get_records(self, queue: str) -> List[Dict[str, Any]]:
+        """
+        Args:
+            queue: Queue name.
+        Returns: Records kept in a queue ring buffer, the oldest first.
+        """
+        return [record for _, record in list(self.queues[queue])]
+
+    def get_stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        Returns: Dict of numbers of stored and kept records by queue names.
+        """
+        return {
+            queue: {"stored": self.counts[queue], "kept": len(records)}
+            for queue, records in self.queues.items()
+        }
+
+    def clear(self) -> None:
+        """
+        Removes all the records and resets counters.
+        """
+        with self.counts_lock:
+            for queue in self.queues:
+                self.queues[queue] = deque(maxlen=self.capacity)
+                self.counts[queue] = 0
+
+
+class NullStorage(MemoryStorage):
+    """
+    NullStorage accepts and counts records, but doesn't keep them.
+    """
+
+    def __init__(self) -> None:
+        super().__init__(capacity=0)
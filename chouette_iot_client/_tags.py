@@ -0,0 +1,135 @@
+"""
+Default tags: global constant tags and context-scoped tags that are applied
+to every metric and log message automatically.
+"""
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Union
+
+__all__ = ["get_ddtags", "merge_tags", "set_global_tags", "tagged"]
+
+
+class TagsFrame:
+    """
+    TagsFrame is a single level of a context tags stack.
+
+    It keeps its own tags and a reference to its parent frame, and caches
+    both merged tags and their Datadog representation ["key:value"].
+    The cache is recalculated only when global tags were changed since
+    the last calculation, so in a common case applying default tags costs
+    a single context variable lookup.
+    """
+
+    generation = 0
+    global_tags: Dict[str, str] = {}
+
+    def __init__(self, parent: Optional["TagsFrame"], tags: Dict[str, str]):
+        self.parent = parent
+        self.tags = tags
+        self.cached_generation = -1
+        self.merged: Dict[str, str] = {}
+        self.ddtags: List[str] = []
+
+    def resolve(self) -> "TagsFrame":
+        """
+        Makes sure that cached merged tags are up to date.
+
+        Returns: The frame itself.
+        """
+        if self.cached_generation != TagsFrame.generation:
+            base = self.parent.resolve().merged if self.parent else self.global_tags
+            self.merged = {**base, **self.tags}
+            self.ddtags = [f"{key}:{value}" for key, value in self.merged.items()]
+            self.cached_generation = TagsFrame.generation
+        return self
+
+
+def _parse_tags(tags: str) -> Dict[str, str]:
+    """
+    Parses tags from a "key:value,key:value" string.
+
+    Args:
+        tags: Tags string.
+    Returns: Tags as a dict.
+    """
+    parsed = {}
+    for tag in tags.split(","):
+        key, _, value = tag.strip().partition(":")
+        if key:
+            parsed[key] = value
+    return parsed
+
+
+TagsFrame.global_tags = _parse_tags(os.environ.get("CHOUETTE_TAGS", ""))
+_ROOT = TagsFrame(None, {})
+_current: ContextVar[TagsFrame] = ContextVar("chouette_tags", default=_ROOT)
+
+
+def set_global_tags(tags: Dict[str, str]) -> None:
+    """
+    Sets constant tags that are added to every metric and log message.
+    They can also be set by CHOUETTE_TAGS environment variable as
+    "key:value,key:value".
+
+    Args:
+        tags: Tags as a dict.
+    """
+    TagsFrame.global_tags = dict(tags)
+    TagsFrame.generation += 1
+
+
+@contextmanager
+def tagged(tags: Dict[str, str]) -> Iterator[None]:
+    """
+    Context manager that adds tags to every metric and log message sent
+    inside it. Contexts can be nested, inner tags override outer ones.
+    Context is propagated by contextvars, so it works for both threads and
+    asyncio tasks.
+
+    Args:
+        tags: Tags as a dict.
+    """
+    token = _current.set(TagsFrame(_current.get(), dict(tags)))
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def merge_tags(tags: Optional[Dict[str, str]]) -> Dict[str, str]:
+    """
+    Merges default tags with call specific tags.
+
+    If there are no call specific tags, a cached dict is returned, so it
+    must never be modified.
+
+    Args:
+        tags: Call specific tags or None.
+    Returns: Merged tags.
+    """
+    merged = _current.get().resolve().merged
+    if not tags:
+        return merged
+    if not merged:
+        return tags
+    return {**merged, **tags}
+
+
+def get_ddtags(tags: Union[Dict[str, str], List[str], None]) -> List[str]:
+    """
+    Merges default tags with log record tags in a Datadog format.
+
+    If there are no record tags, a cached list is returned, so it must never
+    be modified.
+
+    Args:
+        tags: Record tags as a dict, a list of "key:value" strings or None.
+    Returns: List of "key:value" strings.
+    """
+    frame = _current.get().resolve()
+    if not tags:
+        return frame.ddtags
+    if isinstance(tags, dict):
+        return [f"{key}:{value}" for key, value in merge_tags(tags).items()]
+    return frame.ddtags + list(tags)
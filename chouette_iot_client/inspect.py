@@ -0,0 +1,170 @@
+"""
+Backlog inspector - shows how far behind Chouette-IoT is.
+
+Usage:
+    python -m chouette_iot_client.inspect [--interval SECONDS] [--json]
+"""
+import argparse
+import json
+import logging
+import random
+import time
+from typing import Any, Dict, List, Optional
+
+from redis import Redis
+
+from ._chouette_client import ChouetteClient
+from ._storages import RedisEndpoints, RedisStorage, StoragesFactory
+
+logger = logging.getLogger("chouette-iot")
+
+__all__ = ["BacklogInspector"]
+
+
+class BacklogInspector:
+    """
+    BacklogInspector calculates backlog statistics of Chouette-IoT queues:
+    number of records, age of the oldest record and total size of records.
+
+    It never scans a whole queue. Number of records is a ZCARD, the oldest
+    record is the first element of a keys sorted set, and total size is
+    estimated by HSTRLEN of up to sample_size records at random positions.
+    A queue takes up to three pipelines, because every step needs results
+    of the previous one: ZCARD with the oldest record, keys at sampled
+    positions and their HSTRLENs.
+
+    If an endpoint name is specified, published gauges are also tagged by it.
+    """
+
+    queues = (RedisStorage.metrics_queue, RedisStorage.logs_queue)
+
+    def __init__(self, redis: Redis, sample_size: int = 20, endpoint: str = None):
+        self.redis = redis
+        self.sample_size = sample_size
+        self.endpoint = endpoint
+
+    def inspect_queue(self, queue: str) -> Dict[str, Any]:
+        """
+        Calculates statistics of a single queue.
+
+        Args:
+            queue: Queue name, e.g. 'chouette:metrics:raw'.
+        Returns: Dict with 'records', 'oldest_age' (seconds, None for
+                 an empty queue) and 'bytes' (estimated) keys.
+        """
+        keys, values = f"{queue}.keys", f"{queue}.values"
+        pipeline = self.redis.pipeline(transaction=False)
+        pipeline.zcard(keys)
+        pipeline.zrange(keys, 0, 0, withscores=True)
+        records, oldest = pipeline.execute()
+        now = time.time()
+        stats: Dict[str, Any] = {"records": records, "oldest_age": None, "bytes": 0}
+        if not records:
+            return stats
+        if oldest:
+            stats["oldest_age"] = max(now - oldest[0][1], 0.0)
+        pipeline = self.redis.pipeline(transaction=False)
+        if records <= self.sample_size:
+            pipeline.zrange(keys, 0, -1)
+        else:
+            for rank in random.sample(range(records), self.sample_size):
+                pipeline.zrange(keys, rank, rank)
+        sampled = [key for found in pipeline.execute() for key in found]
+        if not sampled:
+            return stats
+        pipeline = self.redis.pipeline(transaction=False)
+        for key in sampled:
+            pipeline.hstrlen(values, key)
+        sizes = pipeline.execute()
+        stats["bytes"] = int(sum(sizes) / len(sizes) * records)
+        return stats
+
+    def inspect(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Calculates statistics of all Chouette-IoT queues.
+
+        Returns: Dict of queues statistics by queue names.
+        """
+        return {queue: self.inspect_queue(queue) for queue in self.queues}
+
+    def publish(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Calculates statistics and sends them as gauges
+        'chouette.backlog.records', 'chouette.backlog.oldest_age' and
+        'chouette.backlog.bytes' tagged by queue name.
+
+        Returns: Dict of queues statistics by queue names.
+        """
+        statistics = self.inspect()
+        for queue, stats in statistics.items():
+            tags = {"queue": queue}
+            if self.endpoint:
+                tags["endpoint"] = self.endpoint
+            for name, value in stats.items():
+                if value is not None:
+                    ChouetteClient.gauge(f"chouette.backlog.{name}", value, tags=tags)
+        return statistics
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """
+    Module entry point. Prints backlog statistics of a Redis configured by
+    REDIS_HOST and REDIS_PORT environment variables (or of every Redis of
+    REDIS_ENDPOINTS) by endpoint names or publishes them as gauges on
+    an interval.
+
+    Args:
+        argv: Command line arguments.
+    """
+    parser = argparse.ArgumentParser(
+        prog="python -m chouette_iot_client.inspect",
+        description="Shows Chouette-IoT queues backlog.",
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        help="Publish statistics as gauges every INTERVAL seconds.",
+    )
+    parser.add_argument("--json", action="store_true", help="Print as JSON.")
+    parser.add_argument(
+        "--sample-size", type=int, default=20, help="Records sampled for sizes."
+    )
+    args = parser.parse_args(argv)
+    storage = StoragesFactory.get_storage("redis")
+    if isinstance(storage, RedisEndpoints):
+        inspectors = [
+            BacklogInspector(endpoint.storage, args.sample_size, endpoint.name)
+            for endpoint in storage.endpoints
+        ]
+        names = [inspector.endpoint for inspector in inspectors]
+    elif isinstance(storage, RedisStorage):
+        inspectors = [BacklogInspector(storage, args.sample_size)]
+        kwargs = storage.connection_pool.connection_kwargs
+        names = [f"{kwargs.get('host')}:{kwargs.get('port')}"]
+    else:
+        parser.error("Backlog inspection requires Redis.")
+    if args.interval:
+        while True:
+            for inspector in inspectors:
+                try:
+                    inspector.publish()
+                except Exception:  # pylint: disable=broad-except
+                    logger.exception("Could not publish backlog statistics.")
+            time.sleep(args.interval)
+    statistics = {
+        name: inspector.inspect() for name, inspector in zip(names, inspectors)
+    }
+    if args.json:
+        print(json.dumps(statistics))
+        return
+    for name, queues in statistics.items():
+        for queue, stats in queues.items():
+            age = "-" if stats["oldest_age"] is None else f"{stats['oldest_age']:.1f}s"
+            print(
+                f"{name} {queue}: {stats['records']} records, oldest {age} ago, "
+                f"~{stats['bytes']} bytes"
+            )
+
+
+if __name__ == "__main__":
+    main()
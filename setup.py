@@ -14,7 +14,8 @@ setuptools.setup(
     long_description_content_type="text/markdown",
     url="https://github.com/akatashev/chouette-iot-client",
     packages=setuptools.find_packages(),
-    install_requires=["redis"],
+    install_requires=["redis", "contextvars; python_version < '3.7'"],
+    extras_require={"zstd": ["zstandard"]},
     classifiers=[
         "Intended Audience :: Developers",
         "License :: OSI Approved :: Apache Software License",
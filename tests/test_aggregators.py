@@ -0,0 +1,169 @@
+import pytest
+
+from chouette_iot_client._aggregators import (
+    HistogramAggregator,
+    HyperLogLog,
+    MonotonicCounter,
+    SetAccumulator,
+)
+
+
+@pytest.mark.parametrize("cardinality", (10, 1000, 100000))
+def test_hyperloglog_cardinality(cardinality):
+    """
+    GIVEN: There is a HyperLogLog sketch of a default precision.
+    WHEN: A number of unique members is added to it multiple times.
+    THEN: Its estimated cardinality is within 5% of the actual one.
+          Small cardinalities can be off by one due to registers collisions.
+    """
+    sketch = HyperLogLog()
+    for _ in range(2):
+        sketch.update(f"device-{number}" for number in range(cardinality))
+    assert sketch.cardinality() == pytest.approx(cardinality, rel=0.05, abs=1)
+
+
+def test_set_accumulator_unions_members():
+    """
+    GIVEN: There is a SetAccumulator.
+    WHEN: Members of the same series are added multiple times.
+    THEN: The same future is returned for every call.
+    AND: A single 'set' record with a union of members is flushed.
+    AND: The next flush is empty.
+    """
+    accumulator = SetAccumulator()
+    first = accumulator.add("test.set", ["a", "b"], {"producer": "test"})
+    second = accumulator.add("test.set", {"b", "c"}, {"producer": "test"})
+    assert first is second
+    records = accumulator.flush()
+    assert len(records) == 1
+    record, future = records.pop()
+    assert future is first
+    assert record["type"] == "set"
+    assert sorted(record["value"]) == ["a", "b", "c"]
+    assert record["tags"] == {"producer": "test"}
+    assert accumulator.flush() == []
+
+
+def test_set_accumulator_handles_unhashable_members():
+    """
+    GIVEN: There is a SetAccumulator.
+    WHEN: A list with hashable and unhashable members is added.
+    THEN: Only unhashable members are replaced with their representations.
+    """
+    accumulator = SetAccumulator()
+    accumulator.add("test.set", [1, {"a": "b"}], {})
+    record, _ = accumulator.flush().pop()
+    assert sorted(record["value"], key=str) == [1, "{'a': 'b'}"]
+
+
+def test_set_accumulator_switches_to_sketch():
+    """
+    GIVEN: There is a SetAccumulator with a sketch threshold 100.
+    WHEN: 5000 unique members are added to a series.
+    THEN: The series is flushed as a 'gauge' with estimated cardinality.
+    """
+    accumulator = SetAccumulator(sketch_threshold=100)
+    for number in range(5000):
+        accumulator.add("test.set", [number], {})
+    record, _ = accumulator.flush().pop()
+    assert record["type"] == "gauge"
+    assert record["value"] == pytest.approx(5000, rel=0.05)
+
+
+def test_monotonic_counter_sends_deltas():
+    """
+    GIVEN: There is a MonotonicCounter.
+    WHEN: Totals 100, 150 and 180 of the same series are added.
+    THEN: A single 'count' record with delta 80 is flushed.
+    AND: When the total doesn't change, nothing is flushed.
+    """
+    counter = MonotonicCounter()
+    for total in (100, 150, 180):
+        future = counter.add("test.bytes", total, {"interface": "eth0"})
+    record, window_future = counter.flush().pop()
+    assert window_future is future
+    assert record["type"] == "count"
+    assert record["value"] == 80
+    assert record["tags"] == {"interface": "eth0"}
+    counter.add("test.bytes", 180, {"interface": "eth0"})
+    assert counter.flush()[0][0] is None
+
+
+@pytest.mark.parametrize(
+    "last, total, wrap_at, expected_delta",
+    (
+        (10, 15, None, 5),
+        (1000, 20, None, 20),  # Reset.
+        (2**32 - 10, 5, 2**32, 15),  # Wraparound.
+        (1000, 20, 2**32, 20),  # Reset of a wrapping counter.
+    ),
+)
+def test_monotonic_counter_delta(last, total, wrap_at, expected_delta):
+    """
+    GIVEN: A counter had a total 'last'.
+    WHEN: A new total is received.
+    THEN: Counter resets and wraparounds are handled.
+    """
+    assert MonotonicCounter.delta(last, total, wrap_at) == expected_delta
+
+
+def test_monotonic_counter_is_bounded():
+    """
+    GIVEN: There is a MonotonicCounter that remembers 2 series.
+    WHEN: Totals of 3 series are added.
+    THEN: The least recently updated series is forgotten and its next
+          total is just a new baseline.
+    """
+    counter = MonotonicCounter(max_series=2)
+    for metric in ("first", "second", "third"):
+        counter.add(metric, 10, {})
+    counter.flush()
+    for metric in ("second", "third", "first"):
+        counter.add(metric, 20, {})
+    deltas = {
+        record["metric"]: record["value"] for record, _ in counter.flush() if record
+    }
+    assert deltas == {"second": 10, "third": 10}
+
+
+def test_histogram_aggregator_summarizes_series():
+    """
+    GIVEN: There is a HistogramAggregator.
+    WHEN: Values 1 to 100 of a series and a value of another series are added.
+    THEN: Flush returns count, avg, max, median and 95percentile of both series.
+    AND: The next flush is empty.
+    """
+    aggregator = HistogramAggregator()
+    for value in range(100, 0, -1):
+        aggregator.add("lag", value, {"loop": "main"})
+    aggregator.add("lag", 5, {"loop": "other"})
+    records = aggregator.flush()
+    main = {
+        record["metric"]: record["value"]
+        for record in records
+        if record["tags"] == {"loop": "main"}
+    }
+    assert main == {
+        "lag.count": 100,
+        "lag.avg": 50.5,
+        "lag.max": 100,
+        "lag.median": 50,
+        "lag.95percentile": 95,
+    }
+    assert len(records) == 10
+    assert aggregator.flush() == []
+
+
+def test_histogram_aggregator_is_bounded():
+    """
+    GIVEN: There is a HistogramAggregator with max_values 10.
+    WHEN: 20 values are added.
+    THEN: Only the last 10 values are summarized.
+    """
+    aggregator = HistogramAggregator(max_values=10)
+    for value in range(20):
+        aggregator.add("lag", value, {})
+    summary = {record["metric"]: record["value"] for record in aggregator.flush()}
+    assert summary["lag.count"] == 10
+    assert summary["lag.max"] == 19
+    assert summary["lag.avg"] == 14.5
@@ -0,0 +1,119 @@
+from unittest.mock import patch
+
+from chouette_iot_client import ChouetteClient
+from chouette_iot_client._cardinality import OVERFLOW_VALUE, CardinalityGuard
+
+
+def test_known_series_are_kept():
+    """
+    GIVEN: There is a CardinalityGuard with a limit of 2 series per metric.
+    WHEN: The same 2 series are checked repeatedly.
+    THEN: Their tags are returned as they are.
+    AND: Nothing is reported.
+    """
+    guard = CardinalityGuard(limit=2)
+    for _ in range(3):
+        for request in ("a", "b"):
+            tags = {"request": request}
+            assert guard.check("test.metric", tags) is tags
+    assert guard.collect_report() == []
+
+
+def test_new_series_are_folded_above_limit():
+    """
+    GIVEN: There is a CardinalityGuard in a 'fold' mode with a limit of
+           2 series per metric.
+    WHEN: 5 series of one metric and 1 series of another one are checked.
+    THEN: The last 3 series of the first metric get a folded request tag.
+    AND: Another metric is not affected.
+    AND: 3 overflows of the first metric are reported.
+    """
+    guard = CardinalityGuard(limit=2)
+    results = [guard.check("test.metric", {"request": str(n)}) for n in range(5)]
+    folded = {"request": OVERFLOW_VALUE, "chouette_overflow": "true"}
+    assert results[2:] == [folded] * 3
+    assert guard.check("test.other", {"request": "4"}) == {"request": "4"}
+    assert guard.collect_report() == [{"metric": "test.metric", "overflows": 3}]
+
+
+def test_new_series_are_dropped_above_limit():
+    """
+    GIVEN: There is a CardinalityGuard in a 'drop' mode with a limit of
+           1 series per metric.
+    WHEN: A second series is checked.
+    THEN: It should be dropped.
+    """
+    guard = CardinalityGuard(limit=1, mode="drop")
+    guard.check("test.metric", {"request": "1"})
+    assert guard.check("test.metric", {"request": "2"}) is None
+
+
+def test_client_folds_overflowing_series(monkeypatch):
+    """
+    GIVEN: ChouetteClient has a CardinalityGuard with a limit of 1 series.
+    WHEN: Two series of the same metric are sent.
+    THEN: The second one is stored with a folded request tag.
+    AND: The overflow is reported on the next aggregators flush.
+    """
+    monkeypatch.setattr(ChouetteClient, "cardinality_guard", CardinalityGuard(1))
+    monkeypatch.setattr(ChouetteClient, "flushers", {0: None})
+    monkeypatch.setattr(ChouetteClient, "lanes", {})
+    monkeypatch.setattr("os.getpid", lambda: 0)
+    lane = ChouetteClient.get_lanes()["metrics"]
+    with patch.object(lane, "put") as put:
+        ChouetteClient.gauge("test.guarded", 1, tags={"request": "1"})
+        ChouetteClient.gauge("test.guarded", 1, tags={"request": "2"})
+        ChouetteClient._flush_aggregators()
+    stored = [call[0][0] for call in put.call_args_list]
+    assert stored[1]["tags"]["request"] == OVERFLOW_VALUE
+    assert stored[1]["tags"]["chouette_overflow"] == "true"
+    assert stored[2]["metric"] == "chouette.client.cardinality_overflow"
+    assert stored[2]["tags"] == {"metric": "test.guarded"}
+    assert stored[2]["value"] == 1
+
+
+def test_folding_keeps_tags_that_are_not_overflowing():
+    """
+    GIVEN: There is a CardinalityGuard with a limit of 2 series per metric.
+    AND: Series have a device tag and a request tag.
+    WHEN: New requests of known devices are checked above the limit.
+    THEN: Only request values are folded, device tags are kept.
+    """
+    guard = CardinalityGuard(limit=2)
+    guard.check("test.metric", {"device": "a", "request": "1"})
+    guard.check("test.metric", {"device": "b", "request": "2"})
+    for device in ("a", "b"):
+        tags = guard.check("test.metric", {"device": device, "request": "3"})
+        assert tags == {
+            "device": device,
+            "request": OVERFLOW_VALUE,
+            "chouette_overflow": "true",
+        }
+
+
+def test_new_combination_of_known_values_folds_widest_tag():
+    """
+    GIVEN: There is a CardinalityGuard with a limit of 3 series per metric.
+    AND: Known series have 2 service and 3 request values.
+    WHEN: A new series combines known values.
+    THEN: The request tag with the most distinct values is folded.
+    """
+    guard = CardinalityGuard(limit=3)
+    for service, request in (("api", "1"), ("api", "2"), ("web", "3")):
+        guard.check("test.metric", {"service": service, "request": request})
+    tags = guard.check("test.metric", {"service": "web", "request": "1"})
+    assert tags["service"] == "web"
+    assert tags["request"] == OVERFLOW_VALUE
+
+
+def test_oldest_metric_is_forgotten_above_max_metrics():
+    """
+    GIVEN: There is a CardinalityGuard that tracks up to 2 metrics.
+    WHEN: Series of 3 metrics are checked.
+    THEN: Only the last 2 metrics are tracked.
+    """
+    guard = CardinalityGuard(limit=1, max_metrics=2)
+    for metric in ("test.a", "test.b", "test.c"):
+        guard.check(metric, {"request": "1"})
+    assert list(guard.series) == ["test.b", "test.c"]
+    assert list(guard.values) == ["test.b", "test.c"]
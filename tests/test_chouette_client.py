@@ -1,11 +1,15 @@
 import json
+import os
+import subprocess
+import sys
 import time
 from concurrent.futures import Future
 
 import pytest
 
 from chouette_iot_client import ChouetteClient
-from chouette_iot_client._storages import StoragesFactory
+from chouette_iot_client._chouette_client import NOT_STORED
+from chouette_iot_client._storages import MemoryStorage, StoragesFactory
 from unittest.mock import patch
 
 
@@ -145,3 +149,144 @@ def test_future_returns_none_on_no_storage(monkeypatch):
     with patch.object(StoragesFactory, "get_storage", return_value=None):
         execution_future = ChouetteClient.count("test", 1)
     assert execution_future.result() is None
+
+
+@pytest.mark.parametrize(
+    "method",
+    (
+        ChouetteClient.count,
+        ChouetteClient.increment,
+        ChouetteClient.decrement,
+        ChouetteClient.gauge,
+        ChouetteClient.histogram,
+        ChouetteClient.rate,
+        ChouetteClient.set,
+    ),
+)
+def test_not_sampled_metric_is_not_stored(method):
+    """
+    Tests that unsampled metrics are dropped before storing.
+
+    GIVEN: A metric is sent with sample_rate 0.
+    WHEN: A corresponding method is called.
+    THEN: Nothing is passed to a storage.
+    AND: Returned future's result is None.
+    """
+    with patch.object(ChouetteClient, "_store") as store:
+        execution_future = method("test.sampled.metric", 1, sample_rate=0)
+    store.assert_not_called()
+    assert execution_future.result() is None
+
+
+@pytest.mark.parametrize(
+    "metric_type, expected_value",
+    (("count", 40), ("rate", 40), ("gauge", 10), ("histogram", 10)),
+)
+def test_sampled_metric_scaling(metric_type, expected_value):
+    """
+    Tests that sampled counters are scaled on the client side.
+
+    GIVEN: A metric with value 10 is sent with sample_rate 0.25.
+    WHEN: It's prepared for storing.
+    THEN: 'count' and 'rate' values are divided by the sample rate.
+    AND: Other metric values are sent as they are.
+    """
+    metric = ChouetteClient._prepare_metric(
+        metric="test.sampled.metric", type=metric_type, value=10, sample_rate=0.25
+    )
+    assert metric["value"] == expected_value
+
+
+def test_aggregated_set_metric(monkeypatch):
+    """
+    Tests 'set' metric aggregation.
+
+    GIVEN: Sets aggregation is enabled.
+    WHEN: 'set' metric is sent twice.
+    THEN: Nothing is stored until aggregators are flushed.
+    AND: After a flush a single record with all the members is stored.
+    AND: Both calls futures are resolved with its storing result.
+    """
+    monkeypatch.setattr(ChouetteClient, "aggregate_sets", True)
+    monkeypatch.setattr(ChouetteClient, "flushers", {0: None})
+    monkeypatch.setattr(os, "getpid", lambda: 0)
+    with patch.object(ChouetteClient, "_store", return_value=NOT_STORED) as store:
+        first = ChouetteClient.set("test.aggregated.set", ["a"])
+        second = ChouetteClient.set("test.aggregated.set", ["b"])
+        store.assert_not_called()
+        ChouetteClient._flush_aggregators()
+    store.assert_called_once()
+    assert sorted(store.call_args[0][0]["value"]) == ["a", "b"]
+    assert first is second
+    assert first.result() is None
+
+
+def test_metrics_are_stored_at_exit(redis_client, metrics_queue):
+    """
+    Tests that records waiting in lanes are stored when a process exits.
+
+    GIVEN: Metrics lane waits a minute before writing a partial batch.
+    WHEN: A process sends a metric and exits immediately.
+    THEN: The metric is stored anyway.
+    """
+    redis_client.flushall()
+    env = dict(os.environ, CHOUETTE_METRICS_FLUSH_INTERVAL="60")
+    subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "from chouette_iot_client import ChouetteClient;"
+            "ChouetteClient.count('test.exit.metric', 1, timestamp=3600)",
+        ],
+        env=env,
+        check=True,
+        timeout=10,
+    )
+    keys = redis_client.zrange(f"{metrics_queue}.keys", 0, -1)
+    assert len(keys) == 1
+    record = json.loads(redis_client.hget(f"{metrics_queue}.values", keys.pop()))
+    assert record["metric"] == "test.exit.metric"
+
+
+def test_flush_returns_number_of_unwritten_records(monkeypatch):
+    """
+    Tests flush deadline.
+
+    GIVEN: Storing a batch of metrics takes a second.
+    WHEN: A metric is sent and ChouetteClient is flushed with a short timeout.
+    THEN: Flush returns 1 - the number of records that were not stored.
+    """
+    monkeypatch.setattr(ChouetteClient, "lanes", {})
+    monkeypatch.setattr(
+        ChouetteClient, "_store_metrics", lambda metrics: time.sleep(1) or [None]
+    )
+    ChouetteClient.count("test.slow.metric", 1)
+    assert ChouetteClient.flush(0.1) == 1
+    assert ChouetteClient.close(2) == 0
+
+
+def test_metrics_are_stored_to_memory_storage(monkeypatch, metrics_queue):
+    """
+    Tests that the client works without Redis.
+
+    GIVEN: ChouetteClient uses MemoryStorage.
+    WHEN: A metric is sent.
+    THEN: The metric is captured by the storage under a returned key.
+    """
+    storage = MemoryStorage()
+    monkeypatch.setattr(ChouetteClient, "storage", storage)
+    key = ChouetteClient.gauge("test.memory.metric", 3, timestamp=3600).result()
+    assert key == "1"
+    (record,) = storage.get_records(metrics_queue)
+    assert record["metric"] == "test.memory.metric"
+    assert record["value"] == 3
+
+
+def test_get_executor_returns_process_executor():
+    """
+    WHEN: get_executor is called twice.
+    THEN: The same ThreadPoolExecutor of this process is returned.
+    """
+    executor = ChouetteClient.get_executor()
+    assert executor is ChouetteClient.get_executor()
+    assert executor.submit(sum, [1, 2]).result(1) == 3
@@ -0,0 +1,91 @@
+import json
+import threading
+
+import pytest
+
+from chouette_iot_client import decode_record
+from chouette_iot_client._compression import Compressor, zstandard
+from chouette_iot_client._storages import StoragesFactory
+
+LONG_RECORD = {"message": {"msg": "Traceback " * 500}, "level": "ERROR"}
+
+
+@pytest.mark.parametrize(
+    "codec",
+    [
+        "zlib",
+        pytest.param(
+            "zstd",
+            marks=pytest.mark.skipif(
+                zstandard is None, reason="zstandard is not installed."
+            ),
+        ),
+    ],
+)
+def test_compressor_compresses_long_records(codec):
+    """
+    GIVEN: Compressor with a threshold of 1024 bytes.
+    WHEN: A long record is compressed.
+    THEN: It becomes shorter and starts with a codec marker.
+    AND: decode_record restores it.
+    """
+    value = json.dumps(LONG_RECORD)
+    compressed = Compressor(codec, threshold=1024).compress(value)
+    assert compressed.startswith(codec.encode() + b":")
+    assert len(compressed) < len(value)
+    assert decode_record(compressed) == LONG_RECORD
+
+
+def test_compressor_leaves_short_records():
+    """
+    GIVEN: Compressors with thresholds of 100 and 1 bytes.
+    WHEN: A short record is compressed.
+    THEN: It's left as it is by both compressors.
+    AND: decode_record decodes it as plain JSON.
+    """
+    short = json.dumps({"msg": "short"})
+    assert Compressor("zlib", threshold=100).compress(short) == short
+    assert Compressor("zlib", threshold=1).compress(short) == short
+    assert decode_record(short.encode()) == {"msg": "short"}
+
+
+def test_redis_storage_compresses_long_log_messages(redis_client, logs_queue):
+    """
+    GIVEN: RedisStorage with zlib compression.
+    WHEN: A long log message is stored.
+    THEN: It's stored compressed and can be decoded.
+    """
+    redis_client.flushall()
+    storage = StoragesFactory.get_storage("redis")
+    storage.compressor = Compressor("zlib")
+    log_message = {"date": "2020-01-01T00:00:00.000000+00:00", **LONG_RECORD}
+    key = storage.store_log(log_message)
+    value = redis_client.hget(f"{logs_queue}.values", key)
+    assert value.startswith(b"zlib:")
+    assert decode_record(value) == log_message
+
+
+@pytest.mark.skipif(zstandard is None, reason="zstandard is not installed.")
+def test_zstd_compressor_is_thread_safe():
+    """
+    GIVEN: A zstd Compressor shared by 4 threads.
+    WHEN: Every thread compresses different records concurrently.
+    THEN: Every compressed record is decoded back to its original.
+    """
+    compressor = Compressor("zstd", threshold=1)
+    errors = []
+
+    def compress(thread):
+        for number in range(100):
+            record = {"message": f"{thread}-{number} " * 20000, "n": number}
+            try:
+                assert decode_record(compressor.compress(json.dumps(record))) == record
+            except Exception as error:  # pylint: disable=broad-except
+                errors.append(error)
+
+    threads = [threading.Thread(target=compress, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
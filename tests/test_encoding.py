@@ -0,0 +1,138 @@
+import json
+from collections import deque
+from collections.abc import Mapping
+from datetime import datetime
+
+from chouette_iot_client._encoding import LogEncoder, TRUNCATED
+
+
+class Unserializable:
+    def __repr__(self):
+        return "<Unserializable>"
+
+
+def test_log_encoder_encodes_like_json():
+    """
+    GIVEN: A log message with JSON serializable small values.
+    WHEN: It's encoded by LogEncoder.
+    THEN: The result is the same as json.dumps result.
+    """
+    message = {"level": "INFO", "message": {"msg": "test"}, "ddtags": ["a:b"], "n": 1}
+    assert LogEncoder().encode(message) == json.dumps(message)
+
+
+def test_log_encoder_converts_unknown_types():
+    """
+    GIVEN: A log message with values that are not JSON serializable.
+    WHEN: It's encoded by LogEncoder.
+    THEN: Known types are converted and others are represented by repr.
+    AND: Converters are cached by type.
+    """
+    encoder = LogEncoder()
+    message = {
+        "object": Unserializable(),
+        "when": datetime(2020, 1, 1),
+        "members": {1},
+        "raw": b"bytes",
+    }
+    assert json.loads(encoder.encode(message)) == {
+        "object": "<Unserializable>",
+        "when": "2020-01-01T00:00:00",
+        "members": [1],
+        "raw": "bytes",
+    }
+    assert Unserializable in encoder.converters
+
+
+def test_log_encoder_truncates_long_fields():
+    """
+    GIVEN: LogEncoder with a field limit of 100 bytes.
+    WHEN: A message with a 5 MB string and a huge list is encoded.
+    THEN: Every field is at most 100 bytes and ends with a marker.
+    """
+    encoder = LogEncoder(field_limit=100, record_limit=0)
+    message = {"payload": "x" * 5000000, "items": list(range(1000000))}
+    decoded = json.loads(encoder.encode(message))
+    assert len(json.dumps(decoded["payload"])) <= 100
+    assert decoded["payload"].endswith(TRUNCATED)
+    assert len(json.dumps(decoded["items"])) <= 100
+    assert decoded["items"][-1] == TRUNCATED
+
+
+def test_log_encoder_respects_escaping_in_limits():
+    """
+    GIVEN: LogEncoder with a field limit of 120 bytes.
+    WHEN: A message with a long non ASCII string is encoded.
+    THEN: Its encoded field is still at most 120 bytes.
+    """
+    encoder = LogEncoder(field_limit=120, record_limit=0)
+    encoded = json.loads(encoder.encode({"text": "é" * 1000}))["text"]
+    assert len(json.dumps(encoded)) <= 120
+    assert encoded.endswith(TRUNCATED)
+
+
+def test_log_encoder_drops_fields_above_record_limit():
+    """
+    GIVEN: LogEncoder with a record limit of 200 bytes.
+    WHEN: A message with base fields and many long extras is encoded.
+    THEN: The message is at most 200 bytes plus a dropped fields counter.
+    AND: Base fields are kept.
+    """
+    encoder = LogEncoder(field_limit=100, record_limit=200)
+    message = {"level": "ERROR", "message": {"msg": "test"}}
+    message.update({f"extra_{number}": "y" * 100 for number in range(10)})
+    encoded = encoder.encode(message)
+    decoded = json.loads(encoded)
+    assert decoded["level"] == "ERROR"
+    assert decoded["message"] == {"msg": "test"}
+    assert decoded["chouette_dropped_fields"] > 0
+    assert len(encoded) <= 200 + len(', "chouette_dropped_fields": 10')
+
+
+class CountingMapping(Mapping):
+    """
+    Mapping of a million items that counts how many of them were read.
+    """
+
+    def __init__(self):
+        self.read = 0
+
+    def __getitem__(self, key):
+        return key
+
+    def __iter__(self):
+        for key in range(1000000):
+            self.read += 1
+            yield str(key)
+
+    def __len__(self):
+        return 1000000
+
+
+class LongRepr:
+    def __repr__(self):
+        return "x" * 1000000
+
+
+def test_log_encoder_does_not_copy_huge_values():
+    """
+    GIVEN: LogEncoder with a field limit of 100 bytes.
+    WHEN: A message with a huge custom mapping, set, deque, bytes and
+          an object with a huge repr is encoded.
+    THEN: Every field is at most 100 bytes and ends with a marker.
+    AND: Only a few items of the mapping are read.
+    """
+    encoder = LogEncoder(field_limit=100, record_limit=0)
+    mapping = CountingMapping()
+    message = {
+        "mapping": mapping,
+        "set": set(range(1000000)),
+        "deque": deque(range(1000000)),
+        "bytes": b"x" * 5000000,
+        "object": LongRepr(),
+    }
+    decoded = json.loads(encoder.encode(message))
+    assert mapping.read < 100
+    for value in decoded.values():
+        assert len(json.dumps(value)) <= 100
+        assert TRUNCATED in json.dumps(value)
@@ -0,0 +1,65 @@
+import json
+import time
+
+import pytest
+
+from chouette_iot_client import ChouetteClient
+from chouette_iot_client.inspect import BacklogInspector, main
+
+
+@pytest.fixture
+def inspector(redis_client):
+    """
+    BacklogInspector with a small sample size.
+    """
+    return BacklogInspector(redis_client, sample_size=5)
+
+
+def test_empty_queue(inspector, redis_client, logs_queue):
+    """
+    GIVEN: A queue is empty.
+    WHEN: It's inspected.
+    THEN: It has no records, no oldest record age and no bytes.
+    """
+    redis_client.flushall()
+    assert inspector.inspect_queue(logs_queue) == {
+        "records": 0,
+        "oldest_age": None,
+        "bytes": 0,
+    }
+
+
+def test_queue_backlog(inspector, redis_client, metrics_queue):
+    """
+    GIVEN: A queue has 20 records of about the same size, the oldest one was
+           collected 100 seconds ago.
+    WHEN: It's inspected.
+    THEN: It has 20 records.
+    AND: Its oldest record age is about 100 seconds.
+    AND: Its estimated size is close to the total size of records.
+    """
+    redis_client.flushall()
+    now = time.time()
+    for number in range(20):
+        ChouetteClient.gauge("test.backlog", 1, timestamp=now - 100 + number)
+    ChouetteClient.flush(1)
+    values = redis_client.hvals(f"{metrics_queue}.values")
+    stats = inspector.inspect_queue(metrics_queue)
+    assert stats["records"] == 20
+    assert stats["oldest_age"] == pytest.approx(100, abs=1)
+    assert stats["bytes"] == pytest.approx(sum(map(len, values)), rel=0.05)
+
+
+def test_inspect_entry_point(redis_client, metrics_queue, logs_queue, capsys):
+    """
+    GIVEN: Metrics queue has a record.
+    WHEN: Inspector entry point is called with --json.
+    THEN: Both queues statistics are printed as JSON by an endpoint name.
+    """
+    redis_client.flushall()
+    ChouetteClient.gauge("test.backlog", 1)
+    ChouetteClient.flush(1)
+    main(["--json"])
+    (statistics,) = json.loads(capsys.readouterr().out).values()
+    assert statistics[metrics_queue]["records"] == 1
+    assert statistics[logs_queue]["records"] == 0
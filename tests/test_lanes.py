@@ -0,0 +1,306 @@
+import threading
+import time
+
+import pytest
+
+from chouette_iot_client._lanes import BatchTuner, Lane, LaneWriter, ThreadBuffers
+
+
+class RecordingStore:
+    """
+    Store function that remembers written batches and returns records
+    'key' values as their storage keys.
+    """
+
+    def __init__(self, delay: float = 0):
+        self.batches = []
+        self.delay = delay
+        self.release = threading.Event()
+        self.release.set()
+
+    def __call__(self, records):
+        self.release.wait(5)
+        time.sleep(self.delay)
+        self.batches.append([record["key"] for record in records])
+        return [record["key"] for record in records]
+
+
+def make_lane(name, store, **kwargs):
+    """
+    Creates a lane with test defaults.
+    """
+    settings = {"capacity": 1000, "batch_size": 10, "flush_interval": 0.01}
+    settings.update(kwargs)
+    return Lane(name, store, **settings)
+
+
+def test_lane_writes_records_in_batches():
+    """
+    GIVEN: There is a lane with batch size 10 and its writer.
+    WHEN: 25 records are put while the writer is blocked.
+    THEN: Every future contains its record key.
+    AND: Records are written in batches of up to 10 records.
+    AND: Lane statistics are correct.
+    """
+    store = RecordingStore()
+    store.release.clear()
+    lane = make_lane("metrics", store)
+    LaneWriter([lane]).start()
+    futures = [lane.put({"key": f"key-{number}"}) for number in range(25)]
+    store.release.set()
+    assert [future.result(1) for future in futures] == [
+        f"key-{number}" for number in range(25)
+    ]
+    assert max(len(batch) for batch in store.batches) == 10
+    stats = lane.get_stats()
+    assert stats["submitted"] == 25
+    assert stats["stored"] == 25
+    assert stats["pending"] == 0
+    assert stats["batches"] == len(store.batches)
+
+
+def test_lane_drops_records_above_capacity():
+    """
+    GIVEN: There is a lane with capacity 5 and without a writer.
+    WHEN: 7 records are put.
+    THEN: The last 2 records are dropped and their futures contain None.
+    """
+    lane = make_lane("logs", RecordingStore(), capacity=5)
+    futures = [lane.put({"key": number}) for number in range(7)]
+    assert [future.done() for future in futures] == [False] * 5 + [True] * 2
+    assert futures[-1].result() is None
+    assert lane.get_stats()["dropped"] == 2
+
+
+def test_lanes_are_independent():
+    """
+    GIVEN: Metrics and logs lanes have their own writers.
+    AND: Writing logs is blocked.
+    WHEN: A metric is put.
+    THEN: It's stored without waiting for logs.
+    """
+    logs_store = RecordingStore()
+    logs_store.release.clear()
+    metrics = make_lane("metrics", RecordingStore())
+    logs = make_lane("logs", logs_store)
+    LaneWriter([metrics]).start()
+    LaneWriter([logs]).start()
+    for number in range(100):
+        logs.put({"key": number})
+    assert metrics.put({"key": "metric"}).result(1) == "metric"
+    logs_store.release.set()
+
+
+def test_shared_writer_uses_weights():
+    """
+    GIVEN: A single writer serves metrics lane with weight 3 and logs lane
+           with weight 1, both with batch size 10.
+    WHEN: Both lanes are full of records.
+    THEN: Every round writes 30 metrics and 10 logs.
+    """
+    metrics_store = RecordingStore()
+    logs_store = RecordingStore()
+    metrics = make_lane("metrics", metrics_store, weight=3)
+    logs = make_lane("logs", logs_store)
+    writer = LaneWriter([metrics, logs])
+    for number in range(90):
+        metrics.put({"key": number})
+        logs.put({"key": number})
+    writer.start()
+    logs.put({"key": "last"}).result(1)
+    assert [len(batch) for batch in metrics_store.batches] == [30, 30, 30]
+    assert [len(batch) for batch in logs_store.batches[:3]] == [10, 10, 10]
+
+
+def test_drain_writes_everything_in_one_batch():
+    """
+    GIVEN: There is a lane with a long flush interval and 25 records in it.
+    WHEN: The lane is drained.
+    THEN: All the records are written in a single batch.
+    AND: Nothing is left unwritten.
+    """
+    store = RecordingStore()
+    lane = make_lane("metrics", store, batch_size=100, flush_interval=60)
+    LaneWriter([lane]).start()
+    futures = [lane.put({"key": number}) for number in range(25)]
+    assert lane.drain(1) == 0
+    assert all(future.done() for future in futures)
+    assert [len(batch) for batch in store.batches] == [25]
+
+
+def test_drain_returns_unwritten_records_on_timeout():
+    """
+    GIVEN: There is a lane whose storage is blocked.
+    WHEN: The lane is drained with a short timeout.
+    THEN: The number of records that were not written is returned.
+    """
+    store = RecordingStore()
+    store.release.clear()
+    lane = make_lane("logs", store, flush_interval=60)
+    LaneWriter([lane]).start()
+    for number in range(5):
+        lane.put({"key": number})
+    assert lane.drain(0.05) == 5
+    store.release.set()
+    assert lane.drain(1) == 0
+
+
+def test_stopped_writer_writes_everything_and_exits():
+    """
+    GIVEN: There is a lane with a long flush interval and records in it.
+    WHEN: Its writer is stopped.
+    THEN: All the records are written and the writer thread exits.
+    """
+    store = RecordingStore()
+    lane = make_lane("metrics", store, flush_interval=60)
+    writer = LaneWriter([lane])
+    writer.start()
+    futures = [lane.put({"key": number}) for number in range(5)]
+    writer.stop()
+    writer.join(1)
+    assert not writer.is_alive()
+    assert [future.result() for future in futures] == list(range(5))
+
+
+def make_tuner(**kwargs):
+    """
+    Creates a BatchTuner with test defaults.
+    """
+    settings = {
+        "latency_target": 0.1,
+        "min_batch_size": 1,
+        "max_batch_size": 500,
+        "min_flush_interval": 0.001,
+        "max_flush_interval": 1,
+        "smoothing": 1,
+    }
+    settings.update(kwargs)
+    return BatchTuner(**settings)
+
+
+def test_batch_tuner_writes_immediately_when_idle():
+    """
+    GIVEN: A tuned lane receives a record per second.
+    WHEN: A batch is written.
+    THEN: The lane doesn't wait for more records.
+    """
+    lane = make_lane("metrics", RecordingStore())
+    tuner = make_tuner()
+    tuner.measured_at -= 1
+    lane.stats["submitted"] = 1
+    tuner.tune(lane, 0.002)
+    assert lane.flush_interval == 0.001
+    assert lane.batch_size == 1
+
+
+def test_batch_tuner_waits_within_latency_target_under_load():
+    """
+    GIVEN: A tuned lane receives 1000 records per second.
+    AND: Round trip takes 20ms and latency target is 100ms.
+    WHEN: A batch is written.
+    THEN: The lane waits for up to 80ms gathering up to 100 records:
+          the ones that arrive during a wait and a round trip.
+    AND: Tuning state is exposed in lane statistics.
+    """
+    lane = make_lane("metrics", RecordingStore())
+    lane.tuner = tuner = make_tuner()
+    tuner.measured_at -= 1
+    lane.stats["submitted"] = 1000
+    tuner.tune(lane, 0.02)
+    assert lane.flush_interval == pytest.approx(0.08, rel=0.01)
+    assert lane.batch_size == pytest.approx(100, abs=1)
+    stats = lane.get_stats()
+    assert stats["batch_size"] == lane.batch_size
+    assert stats["expected_latency"] == pytest.approx(0.1, rel=0.01)
+
+
+def test_batch_tuner_keeps_bounds():
+    """
+    GIVEN: A tuned lane receives a million records per second.
+    AND: Round trip is slower than the latency target.
+    WHEN: A batch is written.
+    THEN: Batch size and flush interval stay within bounds.
+    """
+    lane = make_lane("metrics", RecordingStore())
+    tuner = make_tuner()
+    tuner.measured_at -= 1
+    lane.stats["submitted"] = 1000000
+    tuner.tune(lane, 0.5)
+    assert lane.flush_interval == 0.001
+    assert lane.batch_size == 500
+
+
+def test_batch_tuner_keeps_up_when_round_trip_is_above_target():
+    """
+    GIVEN: A tuned lane receives 4600 records per second.
+    AND: Round trip takes 150ms and latency target is 100ms.
+    WHEN: Batches are written.
+    THEN: The lane doesn't wait.
+    AND: Batches are large enough to write all the records arriving
+         during a round trip.
+    """
+    lane = make_lane("metrics", RecordingStore())
+    tuner = make_tuner(max_batch_size=10000, smoothing=0.2)
+    for _ in range(30):
+        tuner.measured_at -= 0.15
+        lane.stats["submitted"] += 690
+        tuner.tune(lane, 0.15)
+    assert lane.flush_interval == 0.001
+    written_per_second = lane.batch_size / (lane.flush_interval + tuner.rtt)
+    assert written_per_second >= 4500
+    assert lane.batch_size == pytest.approx(4600 * 0.151, rel=0.05)
+
+
+def test_thread_buffers_records_are_written_by_lane_writer():
+    """
+    GIVEN: There is a lane with thread buffers and its writer.
+    WHEN: 8 threads put 100 records each.
+    THEN: Every future contains its record key.
+    AND: Lane statistics count all the records.
+    """
+    lane = make_lane("metrics", RecordingStore())
+    lane.buffers = ThreadBuffers(0.005)
+    LaneWriter([lane]).start()
+    futures = []
+
+    def produce(thread):
+        futures.extend(lane.put({"key": f"{thread}-{number}"}) for number in range(100))
+
+    producers = [threading.Thread(target=produce, args=(n,)) for n in range(8)]
+    for producer in producers:
+        producer.start()
+    for producer in producers:
+        producer.join()
+    assert len({future.result(1) for future in futures}) == 800
+    assert lane.get_stats()["submitted"] == 800
+
+
+def test_thread_buffers_of_dead_threads_are_retired_after_collection():
+    """
+    GIVEN: A thread put a record into thread buffers and exited.
+    WHEN: Buffers are retired.
+    THEN: The record is still collected.
+    AND: The thread buffer is removed from the registry.
+    """
+    buffers = ThreadBuffers(0.01)
+    producer = threading.Thread(target=buffers.put, args=({"key": 1},))
+    producer.start()
+    producer.join()
+    buffers._retire()
+    assert buffers.registry == {}
+    assert [record for record, _ in buffers.collect()] == [{"key": 1}]
+
+
+def test_lane_drain_collects_thread_buffers():
+    """
+    GIVEN: There is a lane with thread buffers and a slow polling writer.
+    WHEN: A record is put and the lane is drained.
+    THEN: The record is written without waiting for the next poll.
+    """
+    lane = make_lane("metrics", RecordingStore(), flush_interval=10)
+    lane.buffers = ThreadBuffers(10)
+    LaneWriter([lane]).start()
+    time.sleep(0.01)
+    future = lane.put({"key": "key"})
+    assert lane.drain(1) == 0
+    assert future.result(0) == "key"
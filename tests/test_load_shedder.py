@@ -0,0 +1,94 @@
+import pytest
+
+from chouette_iot_client._load_shedder import LoadShedder
+
+
+@pytest.fixture
+def shedder():
+    """
+    LoadShedder that starts shedding after 10 pending records and
+    reaches its minimal rate at 110 pending records.
+    """
+    return LoadShedder(
+        low_watermark=10,
+        high_watermark=110,
+        latency_watermark=0.5,
+        min_rate=0.01,
+        report_interval=10,
+    )
+
+
+@pytest.mark.parametrize(
+    "pending, expected_rate",
+    ((0, 1.0), (10, 1.0), (60, 0.505), (110, 0.01), (500, 0.01)),
+)
+def test_effective_rate_depends_on_backlog(shedder, pending, expected_rate):
+    """
+    GIVEN: There is a number of pending records.
+    WHEN: Effective rate is calculated.
+    THEN: It's 1 below the low watermark, min_rate above the high watermark
+          and it goes down linearly between them.
+    """
+    shedder.watch([None] * pending)
+    assert shedder.effective_rate() == pytest.approx(expected_rate)
+
+
+def test_effective_rate_depends_on_latency(shedder):
+    """
+    GIVEN: Backlog is growing.
+    AND: Storing takes twice longer than the latency watermark.
+    WHEN: Effective rate is calculated.
+    THEN: It's two times lower than the backlog based rate.
+    """
+    shedder.watch([None] * 60)
+    shedder.latency = 1.0
+    assert shedder.effective_rate() == pytest.approx(0.2525)
+
+
+def test_high_latency_sheds_records_without_backlog(shedder):
+    """
+    GIVEN: There are no pending records.
+    AND: Storing takes four times longer than the latency watermark.
+    WHEN: Many histograms are checked.
+    THEN: The effective rate is a quarter.
+    AND: About three quarters of histograms are shed.
+    """
+    shedder.latency = 2.0
+    assert shedder.effective_rate() == pytest.approx(0.25)
+    kept = sum(shedder.keep("histogram") for _ in range(1000))
+    assert 150 < kept < 350
+    assert shedder.collect_report()[0]["shed"] == 1000 - kept
+
+
+def test_shed_records_are_reported(shedder):
+    """
+    GIVEN: Backlog is far above the high watermark.
+    WHEN: Many histograms are checked.
+    THEN: Most of them are shed.
+    AND: Report contains the number of shed records and the rate.
+    AND: Counters are reset after a report.
+    """
+    shedder.watch([None] * 1000)
+    kept = sum(shedder.keep("histogram") for _ in range(1000))
+    report = shedder.collect_report()
+    assert kept < 100
+    assert report == [
+        {"kind": "histogram", "shed": 1000 - kept, "rate": pytest.approx(0.01)}
+    ]
+    assert shedder.collect_report() == []
+
+
+def test_backlog_is_tracked(shedder):
+    """
+    GIVEN: A shedder watches two queues.
+    WHEN: Their lengths change.
+    THEN: Shedder's pending counter is their total length.
+    """
+    metrics, logs = [], []
+    shedder.watch(metrics)
+    shedder.watch(logs)
+    metrics.extend([None] * 3)
+    logs.append(None)
+    assert shedder.pending == 4
+    metrics.clear()
+    assert shedder.pending == 1
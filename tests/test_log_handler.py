@@ -4,6 +4,7 @@ import time
 
 import pytest
 
+from chouette_iot_client import tagged
 from chouette_iot_client._chouette_log_handler import ChouetteLogHandler
 
 
@@ -169,3 +170,37 @@ def test_log_exception(logger_with_chouette_log_level, redis_client, logs_queue)
     assert value
     record = json.loads(value)
     assert exception_string in record["exc_info"]
+
+
+def test_log_context_tags(logger_no_chouette_log_level, redis_client, logs_queue):
+    """
+    ChouetteLogHandler adds context tags to ddtags.
+
+    GIVEN: There is a tags context.
+    WHEN: A message with its own tags is logged inside it.
+    THEN: Stored message has both context and message tags.
+    """
+    redis_client.flushall()
+    with tagged({"tenant": "alice"}):
+        logger_no_chouette_log_level.info("Test message", extra={"tags": {"a": "b"}})
+    time.sleep(0.1)
+    keys = redis_client.zrange(f"{logs_queue}.keys", 0, -1)
+    assert len(keys) == 1
+    record = json.loads(redis_client.hget(f"{logs_queue}.values", keys.pop()))
+    assert sorted(record["ddtags"]) == ["a:b", "tenant:alice"]
+
+
+def test_log_unserializable_extra(
+    logger_no_chouette_log_level, redis_client, logs_queue
+):
+    """
+    GIVEN: There is a logger with ChouetteLogHandler.
+    WHEN: A message with an unserializable extra is logged.
+    THEN: It's stored with a representation of this extra.
+    """
+    redis_client.flushall()
+    logger_no_chouette_log_level.info("Test message", extra={"lock": object})
+    time.sleep(0.1)
+    values = redis_client.hvals(f"{logs_queue}.values")
+    assert len(values) == 1
+    assert json.loads(values[0])["lock"] == repr(object)
@@ -0,0 +1,84 @@
+import threading
+import time
+
+from chouette_iot_client._profiler import OTHER, SamplingProfiler
+
+
+def busy_function(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_sampling_profiler_finds_hot_function():
+    """
+    GIVEN: There is a thread running busy_function.
+    WHEN: A profiler takes 20 samples and reports.
+    THEN: busy_function is reported with its samples.
+    AND: Its stack starts with busy_function.
+    AND: Tables are reset after the report.
+    """
+    stop = threading.Event()
+    worker = threading.Thread(target=busy_function, args=(stop,))
+    worker.start()
+    profiler = SamplingProfiler(top=50)
+    try:
+        for _ in range(20):
+            profiler.sample()
+            time.sleep(0.001)
+    finally:
+        stop.set()
+        worker.join()
+    readings = profiler.report()
+    functions = {
+        tags["function"]: value
+        for metric, _, value, tags in readings
+        if metric == "runtime.python.profile.samples"
+    }
+    stacks = [
+        tags["stack"]
+        for metric, _, _, tags in readings
+        if metric == "runtime.python.profile.stacks"
+    ]
+    assert functions[f"{__name__}.busy_function"] >= 10
+    assert any(stack.startswith(f"{__name__}.busy_function < ") for stack in stacks)
+    assert readings[0][0] == "runtime.python.profile.total_samples"
+    assert readings[0][2] >= 20
+    assert profiler.functions == {} and profiler.samples == 0
+
+
+def test_sampling_profiler_tables_are_bounded():
+    """
+    GIVEN: There is a profiler with tables of 1 entry.
+    WHEN: Samples of two different functions are counted.
+    THEN: The second one is counted as 'other'.
+    """
+    profiler = SamplingProfiler(max_entries=1)
+    profiler._count(profiler.functions, "first")
+    profiler._count(profiler.functions, "second")
+    profiler._count(profiler.functions, "first")
+    assert profiler.functions == {"first": 2, OTHER: 1}
+
+
+def test_sampling_profiler_skips_client_threads():
+    """
+    GIVEN: There is a waiting ChouetteClient thread and a busy application
+           thread.
+    WHEN: A profiler takes samples.
+    THEN: Only the application thread is sampled.
+    """
+    stop = threading.Event()
+    client_thread = threading.Thread(target=stop.wait, name="chouette-iot-test")
+    worker = threading.Thread(target=busy_function, args=(stop,))
+    client_thread.start()
+    worker.start()
+    profiler = SamplingProfiler(top=50)
+    try:
+        for _ in range(10):
+            profiler.sample()
+    finally:
+        stop.set()
+        worker.join()
+        client_thread.join()
+    functions = set(profiler.functions)
+    assert f"{__name__}.busy_function" in functions
+    assert not any(function.startswith("threading.") for function in functions)
@@ -0,0 +1,71 @@
+import gc
+import os
+import time
+
+from chouette_iot_client import ChouetteClient
+from chouette_iot_client._resources import ResourceCollector
+
+
+def test_resource_collector_reads_process_resources():
+    """
+    GIVEN: There is a ResourceCollector.
+    WHEN: It collects resources twice.
+    THEN: The first collection has only absolute values.
+    AND: The second one also has CPU and GC collections deltas.
+    AND: Its values are plausible.
+    """
+    collector = ResourceCollector(interval=1)
+    first = {metric: value for metric, _, value in collector.collect()}
+    gc.collect()
+    second = {metric: value for metric, _, value in collector.collect()}
+    assert "runtime.python.cpu.percent" not in first
+    assert first["runtime.python.mem.rss"] > 1024 * 1024
+    assert first["runtime.python.thread_count"] >= 1
+    assert first["runtime.python.open_fds"] >= 3
+    assert second["runtime.python.cpu.percent"] >= 0
+    assert second["runtime.python.gc.collections.gen2"] >= 1
+    assert second["chouette.client.resource_collector.cpu_time"] >= 0
+
+
+def test_resource_collector_counts_open_fds():
+    """
+    GIVEN: There is a ResourceCollector.
+    WHEN: A file is opened between collections.
+    THEN: The number of open file descriptors is increased by one.
+    """
+    collector = ResourceCollector(interval=1)
+    before = dict((metric, value) for metric, _, value in collector.collect())
+    fd = os.open(os.devnull, os.O_RDONLY)
+    try:
+        after = dict((metric, value) for metric, _, value in collector.collect())
+    finally:
+        os.close(fd)
+    assert after["runtime.python.open_fds"] == before["runtime.python.open_fds"] + 1
+
+
+def test_resource_collector_backs_off_over_budget():
+    """
+    GIVEN: There is a ResourceCollector with a zero budget.
+    WHEN: It collects resources 10 times.
+    THEN: Its interval is backed off to at most 16 times the configured one.
+    """
+    collector = ResourceCollector(interval=1, budget=0)
+    for _ in range(10):
+        collector.collect()
+    assert collector.get_stats()["interval"] == 16
+
+
+def test_start_resource_collector_stores_a_batch(redis_client, metrics_queue):
+    """
+    GIVEN: ChouetteClient is empty.
+    WHEN: A resource collector is started twice.
+    THEN: The same collector is returned.
+    AND: Resources metrics are stored in a single batch.
+    """
+    redis_client.flushall()
+    batches = ChouetteClient.get_lanes()["metrics"].stats["batches"]
+    collector = ChouetteClient.start_resource_collector(interval=60)
+    assert ChouetteClient.start_resource_collector() is collector
+    time.sleep(0.2)
+    assert ChouetteClient.get_lanes()["metrics"].stats["batches"] == batches + 1
+    assert redis_client.zcard(f"{metrics_queue}.keys") >= 6
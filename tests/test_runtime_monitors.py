@@ -0,0 +1,89 @@
+import asyncio
+import json
+import gc
+import time
+
+from chouette_iot_client import ChouetteClient
+from chouette_iot_client._aggregators import HistogramAggregator
+from chouette_iot_client._runtime_monitors import GCMonitor, LoopLagMonitor
+
+
+def run_in_new_loop(coroutine):
+    """
+    Runs a coroutine in a new event loop, asyncio.run requires Python 3.7+.
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        asyncio.set_event_loop(loop)
+        return loop.run_until_complete(coroutine)
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+def test_gc_monitor_times_collections():
+    """
+    GIVEN: There is a started GCMonitor.
+    WHEN: Generation 2 is collected.
+    THEN: Its pause is added to a histogram tagged by generation.
+    AND: Nothing is added after the monitor is stopped.
+    """
+    histograms = HistogramAggregator()
+    monitor = GCMonitor(histograms)
+    monitor.start()
+    monitor.start()
+    try:
+        gc.collect()
+    finally:
+        monitor.stop()
+    assert monitor.callback not in gc.callbacks
+    metric, tags, pause = histograms.values[-1]
+    assert metric == "runtime.python.gc.pause"
+    assert tags == {"generation": "2"}
+    assert pause >= 0
+    histograms.values.clear()
+    gc.collect()
+    assert not histograms.values
+
+
+def test_loop_lag_monitor_measures_blocked_loop():
+    """
+    GIVEN: There is a LoopLagMonitor with a 10ms heartbeat.
+    WHEN: The loop is blocked for 100ms.
+    THEN: A lag of at least 90ms is measured.
+    """
+    histograms = HistogramAggregator()
+
+    async def block():
+        monitor = LoopLagMonitor(histograms, asyncio.get_event_loop(), 0.01, "test")
+        monitor.start()
+        await asyncio.sleep(0.02)
+        time.sleep(0.1)
+        await asyncio.sleep(0.02)
+        monitor.stop()
+
+    run_in_new_loop(block())
+    lags = [value for _, tags, value in histograms.values if tags == {"loop": "test"}]
+    assert lags
+    assert max(lags) >= 0.09
+
+
+def test_monitor_event_loop_sends_summaries(redis_client, metrics_queue):
+    """
+    GIVEN: An event loop is monitored by ChouetteClient.
+    WHEN: Aggregators are flushed.
+    THEN: Loop lag summaries are stored.
+    """
+    redis_client.flushall()
+
+    async def run():
+        monitor = ChouetteClient.monitor_event_loop(interval=0.01, name="main")
+        await asyncio.sleep(0.05)
+        monitor.stop()
+
+    run_in_new_loop(run())
+    ChouetteClient.flush()
+    values = redis_client.hvals(f"{metrics_queue}.values")
+    metrics = {json.loads(value)["metric"] for value in values}
+    assert "runtime.python.event_loop.lag.95percentile" in metrics
+    assert "runtime.python.event_loop.lag.count" in metrics
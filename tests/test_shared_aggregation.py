@@ -0,0 +1,148 @@
+import json
+import multiprocessing
+import sys
+from uuid import uuid4
+
+import pytest
+
+from chouette_iot_client._shared_aggregation import (
+    SharedCounterTable,
+    SharedCountsAggregator,
+)
+
+pytestmark = pytest.mark.skipif(
+    sys.version_info < (3, 8), reason="Shared memory requires Python 3.8+."
+)
+
+
+@pytest.fixture
+def table_name(tmp_path):
+    """
+    Unique shared table name. The segment is removed after a test.
+    """
+    name = uuid4().hex[:16]
+    yield name
+    SharedCounterTable(name, 1, str(tmp_path)).unlink()
+
+
+def _publish(name, directory, increments):
+    """
+    Worker process: publishes counters to a shared table.
+    """
+    table = SharedCounterTable(name, 64, directory)
+    for _ in range(increments):
+        table.add_many({json.dumps(["test.shared", []]).encode(): 1})
+
+
+def _lead_and_wait(name, directory, led, release):
+    """
+    Worker process: becomes a flusher and keeps this role till released.
+    """
+    table = SharedCounterTable(name, 64, directory)
+    led.value = table.try_lead()
+    release.wait(10)
+
+
+def test_counters_are_combined_across_processes(table_name, tmp_path):
+    """
+    GIVEN: There is a shared table.
+    WHEN: 4 processes publish 100 increments of the same counter each.
+    THEN: Draining the table returns a single counter with value 400.
+    AND: The table is empty after draining.
+    """
+    workers = [
+        multiprocessing.Process(target=_publish, args=(table_name, str(tmp_path), 100))
+        for _ in range(4)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    table = SharedCounterTable(table_name, 64, str(tmp_path))
+    assert table.drain() == [(json.dumps(["test.shared", []]).encode(), 400)]
+    assert table.drain() == []
+
+
+def test_flusher_is_taken_over(table_name, tmp_path):
+    """
+    GIVEN: Another process is a flusher.
+    WHEN: This process tries to become a flusher.
+    THEN: It fails while another flusher is alive.
+    AND: It succeeds after another flusher is gone.
+    """
+    led = multiprocessing.Value("b", False)
+    release = multiprocessing.Event()
+    leader = multiprocessing.Process(
+        target=_lead_and_wait, args=(table_name, str(tmp_path), led, release)
+    )
+    leader.start()
+    table = SharedCounterTable(table_name, 64, str(tmp_path))
+    while not led.value and leader.is_alive():
+        pass
+    assert not table.try_lead()
+    release.set()
+    leader.join()
+    assert table.try_lead()
+
+
+def test_aggregator_stores_leftovers(table_name, tmp_path):
+    """
+    GIVEN: A shared table has a single slot.
+    AND: Another process is a flusher.
+    WHEN: Two counters are published by a non-flusher process.
+    THEN: A counter that doesn't fit is returned to be stored directly.
+    """
+    aggregator = SharedCountsAggregator(
+        SharedCounterTable(table_name, 1, str(tmp_path))
+    )
+    aggregator.table.leading = True  # Pretend to be the flusher, don't drain.
+    aggregator.table.drain = lambda: []
+    aggregator.add("test.first", 1, {})
+    aggregator.add("test.second", 2, {"tag": "value"})
+    records = aggregator.flush()
+    assert len(records) == 1
+    assert records[0]["type"] == "count"
+    assert records[0]["metric"] == "test.second"
+    assert records[0]["tags"] == {"tag": "value"}
+    assert records[0]["value"] == 2
+
+
+def _add_and_publish(aggregator):
+    """
+    Worker process: adds to an inherited aggregator and publishes it.
+    """
+    aggregator.table.try_lead = lambda: False
+    aggregator.add("test.jobs", 1, {})
+    aggregator.flush()
+
+
+def test_forked_child_does_not_publish_parent_counters(table_name, tmp_path):
+    """
+    GIVEN: A parent process has an unpublished counter of 5.
+    WHEN: It forks a child that adds 1 and publishes.
+    AND: The parent publishes and drains the table.
+    THEN: The combined counter is 6.
+    """
+    aggregator = SharedCountsAggregator(
+        SharedCounterTable(table_name, 64, str(tmp_path))
+    )
+    aggregator.add("test.jobs", 5, {})
+    child = multiprocessing.get_context("fork").Process(
+        target=_add_and_publish, args=(aggregator,)
+    )
+    child.start()
+    child.join()
+    records = aggregator.flush()
+    assert [record["value"] for record in records] == [6]
+
+
+def test_unsupported_shared_aggregation_is_disabled(monkeypatch, caplog):
+    """
+    GIVEN: Shared aggregation is configured, but it's not supported.
+    WHEN: An aggregator is created from environment variables.
+    THEN: None is returned and a warning is logged.
+    """
+    monkeypatch.setenv("CHOUETTE_SHARED_AGGREGATION", "test")
+    monkeypatch.setattr("chouette_iot_client._shared_aggregation.shared_memory", None)
+    assert SharedCountsAggregator.from_env() is None
+    assert "Shared aggregation is disabled" in caplog.text
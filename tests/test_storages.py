@@ -1,9 +1,21 @@
+import os
+from decimal import Decimal
+import time
+from threading import Thread
 from unittest.mock import patch
 
+import pytest
 from redis import Redis, RedisError
 from redis.client import Pipeline
 
-from chouette_iot_client._storages import StoragesFactory
+from chouette_iot_client._storages import (
+    MemoryStorage,
+    NullStorage,
+    RedisEndpoints,
+    RedisStorage,
+    Storage,
+    StoragesFactory,
+)
 
 
 def test_storages_factory_returns_none_on_non_redis_type():
@@ -34,3 +46,279 @@ def test_redis_storage_returns_none_on_storing_for_redis_error():
     with patch.object(Pipeline, "execute", side_effect=RedisError):
         result = storage.store_metric(metric)
     assert result is None
+
+
+def _metrics(timestamps):
+    return [
+        {"metric": "test", "type": "count", "value": 1, "timestamp": ts, "tags": {}}
+        for ts in timestamps
+    ]
+
+
+def test_redis_storage_trims_oldest_records_over_max_records(
+    redis_client, metrics_queue
+):
+    """
+    RedisStorage trims the oldest records from both keys and values.
+
+    GIVEN: RedisStorage with a cap of 3 records checked every batch.
+    WHEN: 5 records are stored in a batch.
+    THEN: 3 newest records are left in both keys and values.
+    AND: 2 trimmed records are counted once.
+    """
+    redis_client.flushall()
+    storage = StoragesFactory.get_storage("redis")
+    storage.caps = {metrics_queue: (3, 0)}
+    storage.cap_check_every = 1
+    keys = storage.store_metrics(_metrics([1, 2, 3, 4, 5]))
+    left = [key.decode() for key in redis_client.zrange(f"{metrics_queue}.keys", 0, -1)]
+    assert left == keys[2:]
+    assert redis_client.hlen(f"{metrics_queue}.values") == 3
+    assert storage.collect_trimmed() == {metrics_queue: 2}
+    assert storage.collect_trimmed() == {}
+
+
+def test_redis_storage_trims_records_older_than_max_age(redis_client, metrics_queue):
+    """
+    GIVEN: RedisStorage with a cap of 60 seconds age.
+    WHEN: Old and fresh records are stored.
+    THEN: Only fresh records are left.
+    """
+    redis_client.flushall()
+    storage = StoragesFactory.get_storage("redis")
+    storage.caps = {metrics_queue: (0, 60)}
+    storage.cap_check_every = 1
+    now = time.time()
+    keys = storage.store_metrics(_metrics([now - 120, now - 61, now]))
+    assert redis_client.zrange(f"{metrics_queue}.keys", 0, -1) == [keys[2].encode()]
+    assert redis_client.hkeys(f"{metrics_queue}.values") == [keys[2].encode()]
+
+
+def test_redis_storage_checks_cap_every_n_batches(redis_client, metrics_queue):
+    """
+    GIVEN: RedisStorage with a cap of 1 record checked every 3 batches.
+    WHEN: 3 batches are stored.
+    THEN: The cap is checked after the 1st batch only.
+    """
+    redis_client.flushall()
+    storage = StoragesFactory.get_storage("redis")
+    storage.caps = {metrics_queue: (1, 0)}
+    storage.cap_check_every = 3
+    for timestamp in (1, 2, 3):
+        storage.store_metrics(_metrics([timestamp, timestamp]))
+    assert redis_client.zcard(f"{metrics_queue}.keys") == 5
+    assert storage.collect_trimmed() == {metrics_queue: 1}
+
+
+def _endpoints(monkeypatch, mode="failover"):
+    host = os.environ.get("REDIS_HOST", "redis")
+    port = os.environ.get("REDIS_PORT", "6379")
+    # Nothing listens on port 1, so connections to it are refused at once.
+    monkeypatch.setenv("REDIS_ENDPOINTS", f"{host}:1,{host}:{port}")
+    monkeypatch.setenv("CHOUETTE_ENDPOINTS_MODE", mode)
+    return StoragesFactory.get_storage("redis")
+
+
+def test_redis_endpoints_fail_over_to_healthy_endpoint(
+    monkeypatch, redis_client, metrics_queue
+):
+    """
+    GIVEN: Two Redis endpoints, the first one is not reachable.
+    WHEN: Metrics are stored twice.
+    THEN: Both batches are stored to the second endpoint.
+    AND: The first endpoint is skipped after its failure.
+    """
+    redis_client.flushall()
+    storage = _endpoints(monkeypatch)
+    assert isinstance(storage, RedisEndpoints)
+    assert all(storage.store_metrics(_metrics([1, 2])))
+    with patch.object(RedisStorage, "store_metrics", autospec=True) as store:
+        store.return_value = ["key"]
+        storage.store_metrics(_metrics([3]))
+    assert store.call_args[0][0] is storage.storages[1]
+    assert redis_client.zcard(f"{metrics_queue}.keys") == 2
+    dead, alive = storage.get_stats().values()
+    assert dead["healthy"] == 0 and dead["failed"] == 2
+    assert alive["healthy"] == 1 and alive["stored"] == 3
+    assert alive["failovers"] == 1
+
+
+def test_redis_endpoints_return_nones_if_all_endpoints_fail(monkeypatch):
+    """
+    GIVEN: Two Redis endpoints, both are not reachable.
+    WHEN: Metrics are stored.
+    THEN: Nones are returned for all of them.
+    """
+    monkeypatch.setenv("REDIS_ENDPOINTS", "127.0.0.1:1,127.0.0.1:2")
+    storage = StoragesFactory.get_storage("redis")
+    assert storage.store_metrics(_metrics([1, 2])) == [None, None]
+    assert storage.store_metrics(_metrics([3])) == [None]
+
+
+def test_redis_endpoints_prefer_lowest_latency(monkeypatch):
+    """
+    GIVEN: Two healthy endpoints, the second one has lower latency.
+    WHEN: Metrics are stored in failover mode.
+    THEN: They are stored to the second endpoint.
+    """
+    storage = _endpoints(monkeypatch)
+    first, second = storage.endpoints
+    first.succeeded(0.2, 1)
+    second.succeeded(0.1, 1)
+    with patch.object(RedisStorage, "store_metrics", autospec=True) as store:
+        store.return_value = ["key"]
+        storage.store_metrics(_metrics([1]))
+    assert store.call_args[0][0] is second.storage
+
+
+def test_redis_endpoints_spread_batches_in_turns(monkeypatch):
+    """
+    GIVEN: Two healthy endpoints in spread mode.
+    WHEN: 4 batches are stored.
+    THEN: Endpoints receive them in turns.
+    """
+    storage = _endpoints(monkeypatch, mode="spread")
+    with patch.object(RedisStorage, "store_metrics", autospec=True) as store:
+        store.return_value = ["key"]
+        for timestamp in range(4):
+            storage.store_metrics(_metrics([timestamp]))
+    used = [call[0][0] for call in store.call_args_list]
+    assert used[0] is not used[1]
+    assert used[0] is used[2] and used[1] is used[3]
+
+
+def test_redis_endpoints_report_endpoint_stats(monkeypatch):
+    """
+    GIVEN: Two endpoints, the first one is not reachable.
+    WHEN: Metrics are stored and a report is collected.
+    THEN: Endpoint gauges are tagged by endpoint names.
+    """
+    storage = _endpoints(monkeypatch)
+    storage.store_metrics(_metrics([1]))
+    readings = storage.collect_report()
+    healthy = {
+        tags["endpoint"]: value
+        for name, _, value, tags in readings
+        if name == "chouette.client.endpoint.healthy"
+    }
+    dead, alive = storage.get_stats()
+    assert healthy == {dead: 0, alive: 1}
+
+
+@pytest.mark.parametrize(
+    "storage_type, storage_class",
+    (("memory", MemoryStorage), ("null", NullStorage), ("Redis", RedisStorage)),
+)
+def test_storages_factory_returns_storage_of_type(storage_type, storage_class):
+    """
+    WHEN: get_storage is called with a known storage type.
+    THEN: It returns a Storage of that type.
+    """
+    storage = StoragesFactory.get_storage(storage_type)
+    assert isinstance(storage, storage_class)
+    assert isinstance(storage, Storage)
+
+
+def test_memory_storage_keeps_last_records_and_exact_counts(metrics_queue):
+    """
+    GIVEN: MemoryStorage with a capacity of 3 records.
+    WHEN: 5 metrics are stored in two batches.
+    THEN: Keys are sequence numbers.
+    AND: The last 3 metrics are kept, but all 5 are counted.
+    """
+    storage = MemoryStorage(capacity=3)
+    assert storage.store_metrics(_metrics([1, 2])) == ["1", "2"]
+    assert storage.store_metrics(_metrics([3, 4, 5])) == ["3", "4", "5"]
+    kept = storage.get_records(metrics_queue)
+    assert [metric["timestamp"] for metric in kept] == [3, 4, 5]
+    assert storage.get_stats()[metrics_queue] == {"stored": 5, "kept": 3}
+    storage.clear()
+    assert storage.get_stats()[metrics_queue] == {"stored": 0, "kept": 0}
+
+
+def test_memory_storage_counts_concurrent_writers_exactly(logs_queue):
+    """
+    GIVEN: MemoryStorage.
+    WHEN: 8 threads store 1000 log messages each.
+    THEN: All 8000 messages are counted and have unique keys.
+    """
+    storage = MemoryStorage(capacity=100)
+    keys = []
+
+    def write():
+        for _ in range(100):
+            keys.extend(storage.store_logs([{"msg": "test"}] * 10))
+
+    threads = [Thread(target=write) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert storage.get_stats()[logs_queue] == {"stored": 8000, "kept": 100}
+    assert len(set(keys)) == 8000
+
+
+def test_null_storage_counts_but_does_not_keep_records(metrics_queue):
+    """
+    GIVEN: NullStorage.
+    WHEN: A metric is stored.
+    THEN: It gets a key and it's counted, but it's not kept.
+    """
+    storage = NullStorage()
+    assert storage.store_metric(_metrics([1])[0]) == "1"
+    assert storage.get_records(metrics_queue) == []
+    assert storage.get_stats()[metrics_queue] == {"stored": 1, "kept": 0}
+
+
+def test_redis_endpoints_try_unmeasured_endpoint_after_measured_ones(monkeypatch):
+    """
+    GIVEN: Two endpoints, the first one has never stored a batch.
+    AND: Its backoff has expired.
+    WHEN: Metrics are stored.
+    THEN: They are stored to the second endpoint that has a measured latency.
+    """
+    storage = _endpoints(monkeypatch)
+    dead, alive = storage.endpoints
+    dead.failed(1)
+    dead.retry_at = 0.0
+    alive.succeeded(0.1, 1)
+    with patch.object(RedisStorage, "store_metrics", autospec=True) as store:
+        store.return_value = ["key"]
+        storage.store_metrics(_metrics([1]))
+    assert store.call_args[0][0] is alive.storage
+
+
+def test_redis_storage_stores_encodable_records_of_mixed_batch(
+    redis_client, metrics_queue
+):
+    """
+    GIVEN: A batch has a good metric and a metric that can't be encoded.
+    WHEN: The batch is stored.
+    THEN: The good metric is stored and gets a key.
+    AND: The bad metric gets None.
+    """
+    redis_client.flushall()
+    storage = StoragesFactory.get_storage("redis")
+    good, bad = _metrics([1, 2])
+    bad["value"] = Decimal("1.5")
+    good_key, bad_key = storage.store_metrics([good, bad])
+    assert good_key and bad_key is None
+    assert redis_client.zrange(f"{metrics_queue}.keys", 0, -1) == [good_key.encode()]
+
+
+def test_redis_endpoints_do_not_fail_endpoint_for_unencodable_records(
+    monkeypatch,
+):
+    """
+    GIVEN: Two healthy endpoints.
+    WHEN: A batch of a single metric that can't be encoded is stored.
+    THEN: None is returned, but the first endpoint stays healthy.
+    """
+    host = os.environ.get("REDIS_HOST", "redis")
+    port = os.environ.get("REDIS_PORT", "6379")
+    monkeypatch.setenv("REDIS_ENDPOINTS", f"{host}:{port},{host}:{port}")
+    storage = StoragesFactory.get_storage("redis")
+    (bad,) = _metrics([1])
+    bad["value"] = Decimal("1.5")
+    assert storage.store_metrics([bad]) == [None]
+    assert all(stats["healthy"] for stats in storage.get_stats().values())
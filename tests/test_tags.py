@@ -0,0 +1,90 @@
+import threading
+
+import pytest
+
+from chouette_iot_client import set_global_tags, tagged
+from chouette_iot_client._tags import get_ddtags, merge_tags
+
+
+@pytest.fixture(autouse=True)
+def no_global_tags():
+    """
+    Resets global tags after every test.
+    """
+    yield
+    set_global_tags({})
+
+
+def test_no_default_tags():
+    """
+    GIVEN: There are neither global nor context tags.
+    WHEN: Tags are merged.
+    THEN: Call tags are returned as they are.
+    AND: Without call tags an empty dict is returned.
+    """
+    assert merge_tags({"a": "b"}) == {"a": "b"}
+    assert merge_tags(None) == {}
+
+
+def test_nested_contexts_override_tags():
+    """
+    GIVEN: There are global tags and two nested tags contexts.
+    WHEN: Tags are merged inside the inner context.
+    THEN: Inner tags override outer ones and call tags override everything.
+    AND: Outer context tags are restored after the inner context exits.
+    """
+    set_global_tags({"service": "test", "tenant": "none"})
+    with tagged({"tenant": "alice", "device": "one"}):
+        with tagged({"device": "two"}):
+            assert merge_tags({"extra": "yes"}) == {
+                "service": "test",
+                "tenant": "alice",
+                "device": "two",
+                "extra": "yes",
+            }
+            assert merge_tags({"service": "other"})["service"] == "other"
+        assert merge_tags(None) == {
+            "service": "test",
+            "tenant": "alice",
+            "device": "one",
+        }
+    assert merge_tags(None) == {"service": "test", "tenant": "none"}
+
+
+def test_merged_tags_are_cached():
+    """
+    GIVEN: There is a tags context.
+    WHEN: Tags are merged multiple times without call tags.
+    THEN: The same cached dict is returned.
+    AND: It's recalculated after global tags change.
+    """
+    with tagged({"tenant": "alice"}):
+        assert merge_tags(None) is merge_tags(None)
+        set_global_tags({"service": "test"})
+        assert merge_tags(None) == {"service": "test", "tenant": "alice"}
+
+
+def test_ddtags():
+    """
+    GIVEN: There is a tags context.
+    WHEN: Log record tags are merged in a Datadog format.
+    THEN: Context tags are added to dict and list record tags.
+    """
+    with tagged({"tenant": "alice"}):
+        assert get_ddtags(None) == ["tenant:alice"]
+        assert get_ddtags({"code": "89"}) == ["tenant:alice", "code:89"]
+        assert get_ddtags(["code:89"]) == ["tenant:alice", "code:89"]
+
+
+def test_contexts_are_not_shared_between_threads():
+    """
+    GIVEN: There is a tags context in the main thread.
+    WHEN: Tags are merged in another thread.
+    THEN: Main thread context tags are not there.
+    """
+    merged = []
+    with tagged({"tenant": "alice"}):
+        thread = threading.Thread(target=lambda: merged.append(merge_tags(None)))
+        thread.start()
+        thread.join()
+    assert merged == [{}]